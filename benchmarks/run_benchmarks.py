@@ -0,0 +1,325 @@
+import argparse
+import json
+import platform
+import sys
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from unittest import mock
+
+from benchmarks.synthetic_history import (
+    BROWSERS,
+    create_synthetic_history,
+    parse_size,
+)
+from src import browser_history
+from src.paper_detection import count_papers
+from src.similarity import compare_browser_histories
+
+import main
+
+SIZES = ["10k", "1M", "10M"]
+BASELINES_PATH = Path(__file__).parent / "baselines.json"
+
+# A benchmark regresses when it is slower than its baseline by both this ratio and
+# MIN_SLOWDOWN seconds, so that the noise of short benchmarks is ignored
+TOLERANCE = 0.25
+MIN_SLOWDOWN = 0.05
+
+# The similarity matrix grows with the product of the history sizes, so histories
+# are compared on samples of at most this many entries
+COMPARE_LIMIT = 2000
+
+FETCHERS = {
+    "safari": browser_history.fetch_safari_history,
+    "chrome": browser_history.fetch_chrome_history,
+    "firefox": browser_history.fetch_firefox_history,
+    "brave": browser_history.fetch_brave_history,
+}
+PATH_SETTINGS = {
+    "safari": browser_history.SAFARI_DB_PATHS,
+    "chrome": browser_history.CHROME_USER_DATA_PATHS,
+    "firefox": browser_history.FIREFOX_PROFILES_PATHS,
+    "brave": browser_history.BRAVE_USER_DATA_PATHS,
+}
+
+
+@contextmanager
+def use_history_paths(paths: Dict[str, Path]):
+    """
+    Points the history fetchers of the current platform at the given databases.
+    """
+    system = platform.system()
+    with ExitStack() as stack:
+        for browser, path in paths.items():
+            stack.enter_context(
+                mock.patch.dict(PATH_SETTINGS[browser], {system: str(path)})
+            )
+        yield
+
+
+def measure(function: Callable, repeat: int = 1) -> Tuple[object, float, float]:
+    """
+    Runs a function `repeat` times.
+
+    Returns:
+        Tuple[object, float, float]: The result of the last run, and the shortest
+            wall time and CPU time of the runs, in seconds.
+    """
+    wall_time = cpu_time = float("inf")
+    for _ in range(repeat):
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        result = function()
+        wall_time = min(wall_time, time.perf_counter() - start_wall)
+        cpu_time = min(cpu_time, time.process_time() - start_cpu)
+    return result, wall_time, cpu_time
+
+
+def run_benchmarks(
+    folder: Path,
+    num_urls: int,
+    visits_per_url: float = 2.0,
+    skew: float = 1.0,
+    browsers: Optional[List[str]] = None,
+    num_profiles: int = 1,
+    output_format: str = "json",
+    repeat: int = 1,
+    seed: int = 0,
+) -> Dict[str, Dict]:
+    """
+    Generates synthetic histories and times each stage of the pipeline on them.
+
+    The fetchers read every generated browser, one at a time then concurrently;
+    the following stages process the distinct URLs of the first browser.
+
+    Args:
+        folder (Path): The folder to generate the databases and outputs in.
+        num_urls (int): The number of distinct URLs per browser.
+        visits_per_url (float): The average number of visits of each URL.
+        skew (float): The Zipf exponent of the distribution of URLs over domains.
+        browsers (Optional[List[str]]): The browsers to generate, defaults to all.
+        num_profiles (int): The number of profiles of Chrome, Brave and Firefox.
+        output_format (str): The output format timed by the "save" benchmark.
+        repeat (int): The number of runs of each benchmark, the fastest is kept.
+        seed (int): The seed of the generator.
+
+    Returns:
+        Dict[str, Dict]: The row count, wall time, CPU time and throughput of each
+            benchmark.
+    """
+    folder = Path(folder)
+    browsers = browsers or BROWSERS
+    results = {}
+
+    def record(name: str, rows: Optional[int], function: Callable):
+        result, wall_time, cpu_time = measure(function, repeat)
+        # The fetchers return one row per visit
+        rows = len(result) if rows is None else rows
+        results[name] = {
+            "rows": rows,
+            "wall_time": wall_time,
+            "cpu_time": cpu_time,
+            "rows_per_second": rows / wall_time if wall_time else None,
+        }
+        print(f"{name:>26}: {rows:>10} rows in {wall_time:9.3f}s")
+        return result
+
+    print(f"Generating {num_urls} URLs per browser...")
+    paths = create_synthetic_history(
+        folder / "history",
+        num_urls,
+        int(num_urls * visits_per_url),
+        skew=skew,
+        browsers=browsers,
+        num_profiles=num_profiles,
+        seed=seed,
+    )
+
+    urls = None
+    with use_history_paths(paths):
+        for browser in browsers:
+            visits = record(
+                f"fetch_{browser}",
+                None,
+                lambda: FETCHERS[browser](),
+            )
+            if urls is None:
+                urls = list(dict.fromkeys(visit.url for visit in visits))
+            del visits
+        # Every browser and profile at once, as `publish_history` reads them
+        record("fetch_concurrently", None, browser_history.fetch_history_concurrently)
+
+    classifications = record(
+        "classify_url", len(urls), lambda: main.classify_batch(urls)
+    )
+    entries = record(
+        "split_url",
+        len(urls),
+        lambda: [
+            dict(main.split_url(url, classification=classification), visit_count=1)
+            for url, classification in zip(urls, classifications)
+        ],
+    )
+    published = [entry for entry in entries if main.is_published(entry)]
+    papers = [entry for entry in entries if entry["paper_id"] is not None]
+    del entries
+    history_to_file = [(entry["netloc"], entry["visit_count"]) for entry in published]
+
+    hashed = record(
+        "hash_url", len(history_to_file), lambda: main.hash_domains(history_to_file)
+    )
+    record("paper_stats", len(papers), lambda: count_papers(papers))
+
+    def save():
+        for name, pairs in [
+            ("browser_history_enc", hashed),
+            ("browser_history_clear", history_to_file),
+        ]:
+            with main.open_output(
+                folder, name, "browser_history", output_format
+            ) as writer:
+                writer.write_counts(pairs)
+
+    record("save", len(history_to_file), save)
+
+    sample1 = folder / "compare_1.json"
+    sample2 = folder / "compare_2.json"
+    main.save(sample1, published[:COMPARE_LIMIT])
+    main.save(sample2, published[COMPARE_LIMIT : 2 * COMPARE_LIMIT])
+    record(
+        "compare_browser_histories",
+        min(len(published), 2 * COMPARE_LIMIT),
+        lambda: compare_browser_histories(sample1, sample2),
+    )
+    return results
+
+
+def get_machine_info() -> Dict[str, str]:
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "python": platform.python_version(),
+    }
+
+
+def load_baselines(path: Path) -> Dict:
+    try:
+        with open(path, "r") as baselines_file:
+            return json.load(baselines_file)
+    except FileNotFoundError:
+        return {"machine": None, "sizes": {}}
+
+
+def save_baselines(path: Path, baselines: Dict) -> None:
+    with open(path, "w") as baselines_file:
+        json.dump(baselines, baselines_file, indent=4, sort_keys=True)
+        baselines_file.write("\n")
+
+
+def compare_with_baselines(
+    results: Dict[str, Dict],
+    baselines: Dict[str, Dict],
+    tolerance: float = TOLERANCE,
+    min_slowdown: float = MIN_SLOWDOWN,
+) -> List[str]:
+    """
+    Prints the wall time of each benchmark relative to its baseline.
+
+    Args:
+        results (Dict[str, Dict]): The results of `run_benchmarks`.
+        baselines (Dict[str, Dict]): The baseline results of the same size.
+        tolerance (float): The slowdown ratio tolerated.
+        min_slowdown (float): The slowdown in seconds tolerated.
+
+    Returns:
+        List[str]: The names of the benchmarks that regressed.
+    """
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if baseline is None:
+            print(f"{name:>26}: no baseline")
+            continue
+        ratio = result["wall_time"] / max(baseline["wall_time"], 1e-9)
+        slowdown = result["wall_time"] - baseline["wall_time"]
+        regressed = ratio > 1 + tolerance and slowdown > min_slowdown
+        if regressed:
+            regressions.append(name)
+        print(
+            f"{name:>26}: {result['wall_time']:9.3f}s vs {baseline['wall_time']:9.3f}s"
+            f" ({ratio:5.2f}x){'  REGRESSION' if regressed else ''}"
+        )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline on synthetic browser histories."
+    )
+    parser.add_argument(
+        "--sizes", default="10k", help=f"Comma-separated sizes, e.g. {','.join(SIZES)}"
+    )
+    parser.add_argument("--visits-per-url", type=float, default=2.0)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--browsers", default=",".join(BROWSERS))
+    parser.add_argument("--profiles", type=int, default=1)
+    parser.add_argument("--format", default=main.OUTPUT_FORMAT)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--baselines", type=Path, default=BASELINES_PATH)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument(
+        "--update-baselines",
+        action="store_true",
+        help="Store the results as the baselines of their sizes",
+    )
+    parser.add_argument("--output", type=Path, help="Write the results as JSON")
+    args = parser.parse_args()
+
+    baselines = load_baselines(args.baselines)
+    if baselines["machine"] not in (None, get_machine_info()):
+        print(
+            "Warning: the baselines were recorded on another machine: "
+            f"{baselines['machine']}"
+        )
+
+    all_results = {}
+    regressions = []
+    for size in args.sizes.split(","):
+        print(f"\n== {size} ==")
+        with tempfile.TemporaryDirectory() as folder:
+            results = run_benchmarks(
+                Path(folder),
+                parse_size(size),
+                args.visits_per_url,
+                args.skew,
+                args.browsers.split(","),
+                args.profiles,
+                args.format,
+                args.repeat,
+                args.seed,
+            )
+        all_results[size] = results
+        if not args.update_baselines:
+            print(f"\n== {size} vs baselines ==")
+            regressions += [
+                f"{size}/{name}"
+                for name in compare_with_baselines(
+                    results, baselines["sizes"].get(size, {}), args.tolerance
+                )
+            ]
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(all_results, output_file, indent=4)
+    if args.update_baselines:
+        baselines["machine"] = get_machine_info()
+        baselines["sizes"].update(all_results)
+        save_baselines(args.baselines, baselines)
+        print(f"Baselines saved to {args.baselines}")
+    elif regressions:
+        print(f"\nRegressions: {', '.join(regressions)}")
+        sys.exit(1)
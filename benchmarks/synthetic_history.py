@@ -0,0 +1,446 @@
+import argparse
+import bisect
+import itertools
+import os
+import random
+import sqlite3
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+BROWSERS = ["safari", "chrome", "firefox", "brave"]
+
+# Rows inserted per executemany call
+INSERT_BATCH_SIZE = 50_000
+
+# Hosts the classifier and the paper detection know about, so that a realistic
+# share of the generated URLs is published. Every other host is generic.
+KNOWN_HOSTS = [
+    "www.google.com",
+    "www.youtube.com",
+    "github.com",
+    "stackoverflow.com",
+    "en.wikipedia.org",
+    "arxiv.org",
+    "docs.python.org",
+    "www.coursera.org",
+    "dl.acm.org",
+    "openreview.net",
+    "www.khanacademy.org",
+    "scholar.google.com",
+    "ieeexplore.ieee.org",
+    "medium.com",
+    "news.ycombinator.com",
+    "www.reddit.com",
+]
+GENERIC_SUFFIXES = ["com", "org", "net", "io", "co.uk", "edu", "com.au", "de"]
+PATH_WORDS = [
+    "blog",
+    "docs",
+    "tutorial",
+    "course",
+    "news",
+    "watch",
+    "article",
+    "products",
+    "search",
+    "learn",
+    "questions",
+    "wiki",
+]
+
+# Seconds between the Unix epoch and the epochs of the browsers
+WEBKIT_EPOCH_OFFSET = 11_644_473_600  # 1601-01-01
+COCOA_EPOCH_OFFSET = 978_307_200  # 2001-01-01
+
+# Minimal versions of the browser schemas: the tables and columns the history
+# queries use, with the constraints and indexes of the real databases
+CHROMIUM_SCHEMA = """
+    CREATE TABLE urls(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        url LONGVARCHAR,
+        title LONGVARCHAR,
+        visit_count INTEGER DEFAULT 0 NOT NULL,
+        typed_count INTEGER DEFAULT 0 NOT NULL,
+        last_visit_time INTEGER NOT NULL,
+        hidden INTEGER DEFAULT 0 NOT NULL
+    );
+    CREATE INDEX urls_url_index ON urls (url);
+    CREATE TABLE visits(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        url INTEGER NOT NULL,
+        visit_time INTEGER NOT NULL,
+        from_visit INTEGER,
+        transition INTEGER DEFAULT 0 NOT NULL,
+        visit_duration INTEGER DEFAULT 0 NOT NULL
+    );
+    CREATE INDEX visits_url_index ON visits (url);
+    CREATE INDEX visits_time_index ON visits (visit_time);
+"""
+FIREFOX_SCHEMA = """
+    CREATE TABLE moz_places(
+        id INTEGER PRIMARY KEY,
+        url LONGVARCHAR,
+        title LONGVARCHAR,
+        rev_host LONGVARCHAR,
+        visit_count INTEGER DEFAULT 0,
+        hidden INTEGER DEFAULT 0 NOT NULL,
+        typed INTEGER DEFAULT 0 NOT NULL,
+        frecency INTEGER DEFAULT -1 NOT NULL,
+        last_visit_date INTEGER
+    );
+    CREATE TABLE moz_historyvisits(
+        id INTEGER PRIMARY KEY,
+        from_visit INTEGER,
+        place_id INTEGER,
+        visit_date INTEGER,
+        visit_type INTEGER,
+        session INTEGER
+    );
+    CREATE INDEX moz_historyvisits_placedateindex
+        ON moz_historyvisits (place_id, visit_date);
+    CREATE INDEX moz_historyvisits_dateindex ON moz_historyvisits (visit_date);
+"""
+SAFARI_SCHEMA = """
+    CREATE TABLE history_items(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        url TEXT NOT NULL UNIQUE,
+        domain_expansion TEXT NULL,
+        visit_count INTEGER NOT NULL
+    );
+    CREATE TABLE history_visits(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        history_item INTEGER NOT NULL REFERENCES history_items(id) ON DELETE CASCADE,
+        visit_time REAL NOT NULL,
+        title TEXT NULL,
+        load_successful BOOLEAN NOT NULL DEFAULT 1
+    );
+    CREATE INDEX history_visits__last_visit
+        ON history_visits (history_item, visit_time);
+    CREATE INDEX history_visits__time ON history_visits (visit_time);
+"""
+
+
+def get_hosts(num_domains: int, seed: int = 0) -> List[str]:
+    """
+    Returns `num_domains` distinct hosts, the known ones first, so that they are
+    the most visited ones once skewed.
+    """
+    rng = random.Random(seed)
+    hosts = KNOWN_HOSTS[:num_domains]
+    for index in range(num_domains - len(hosts)):
+        subdomain = rng.choice(["", "www.", "docs.", "blog.", "m."])
+        suffix = GENERIC_SUFFIXES[index % len(GENERIC_SUFFIXES)]
+        hosts.append(f"{subdomain}site{index}.{suffix}")
+    return hosts
+
+
+def get_domain_weights(num_domains: int, skew: float) -> List[float]:
+    """
+    Returns the cumulative Zipf weights of the domains: the domain of rank k is
+    visited in proportion to 1 / k ** skew, so 0 spreads URLs uniformly and larger
+    values concentrate them on the first domains.
+    """
+    return list(
+        itertools.accumulate(1 / rank**skew for rank in range(1, num_domains + 1))
+    )
+
+
+def make_url(rng: random.Random, host: str, index: int) -> str:
+    """
+    Returns a unique URL of a host, shaped like the pages the host serves.
+    """
+    if host == "arxiv.org":
+        kind = rng.choice(["abs", "pdf"])
+        return (
+            f"https://arxiv.org/{kind}/{2000 + index % 500}.{index:05d}v{index % 3 + 1}"
+        )
+    if host == "dl.acm.org":
+        return f"https://dl.acm.org/doi/10.1145/{3000000 + index}"
+    if host == "openreview.net":
+        return f"https://openreview.net/forum?id=Syn{index:07d}"
+    if host == "ieeexplore.ieee.org":
+        return f"https://ieeexplore.ieee.org/document/{8000000 + index}/"
+    if host == "github.com":
+        return f"https://github.com/user{index % 997}/repo{index}"
+    if host == "www.youtube.com":
+        return f"https://www.youtube.com/watch?v=vid{index:08d}"
+    scheme = "https" if rng.random() < 0.95 else "http"
+    word = rng.choice(PATH_WORDS)
+    url = f"{scheme}://{host}/{word}/{index}"
+    if rng.random() < 0.2:
+        url += f"?q={rng.choice(PATH_WORDS)}&page={index % 10}"
+    return url
+
+
+def iter_synthetic_visits(
+    num_urls: int,
+    num_visits: int,
+    num_domains: int = 1000,
+    skew: float = 1.0,
+    days: float = 90,
+    end_time: Optional[float] = None,
+    seed: int = 0,
+) -> Iterator[Tuple[int, str, List[float]]]:
+    """
+    Generates a browsing history: distinct URLs spread over skewed domains, and
+    their visit times.
+
+    Every URL is visited at least once; the other visits are spread evenly over the
+    URLs. The same arguments always generate the same history, except for the
+    visit times when `end_time` is not given.
+
+    Args:
+        num_urls (int): The number of distinct URLs.
+        num_visits (int): The total number of visits, at least `num_urls`.
+        num_domains (int): The number of distinct hosts.
+        skew (float): The Zipf exponent of the distribution of URLs over hosts.
+        days (float): The number of days the visits span.
+        end_time (Optional[float]): The Unix time of the latest possible visit,
+            defaults to now.
+        seed (int): The seed of the random generator.
+
+    Yields:
+        Tuple[int, str, List[float]]: The 1-based id of each URL, the URL and the
+            Unix times of its visits.
+    """
+    if num_visits < num_urls:
+        raise ValueError("Every URL needs at least one visit")
+    end_time = time.time() if end_time is None else end_time
+    start_time = end_time - days * 24 * 3600
+    rng = random.Random(seed)
+    hosts = get_hosts(num_domains, seed)
+    weights = get_domain_weights(num_domains, skew)
+    total_weight = weights[-1]
+    extra_visits = num_visits - num_urls
+    for url_id in range(1, num_urls + 1):
+        host = hosts[bisect.bisect(weights, rng.random() * total_weight)]
+        # Spreads the extra visits evenly, so that the total is exact
+        visits = 1 + (url_id * extra_visits) // num_urls
+        visits -= ((url_id - 1) * extra_visits) // num_urls
+        visit_times = sorted(rng.uniform(start_time, end_time) for _ in range(visits))
+        yield url_id, make_url(rng, host, url_id), visit_times
+
+
+def create_database(path: Path, schema: str) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        path.unlink()
+    conn = sqlite3.connect(path)
+    conn.executescript(schema)
+    # Nothing to recover from if generation fails: the file is generated again
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    return conn
+
+
+def write_history(
+    path: Path,
+    schema: str,
+    url_query: str,
+    visit_query: str,
+    history: Iterator[Tuple[int, str, List[float]]],
+    to_url_row: Callable[[int, str, List[float]], tuple],
+    to_visit_row: Callable[[int, float], tuple],
+) -> None:
+    """
+    Writes a history into a new database in a single pass, inserting the rows of
+    the URL and visit tables in batches.
+    """
+    conn = create_database(path, schema)
+    url_rows = []
+    visit_rows = []
+    with conn:
+        for url_id, url, visit_times in history:
+            url_rows.append(to_url_row(url_id, url, visit_times))
+            visit_rows += [to_visit_row(url_id, visit) for visit in visit_times]
+            if len(visit_rows) >= INSERT_BATCH_SIZE:
+                conn.executemany(url_query, url_rows)
+                conn.executemany(visit_query, visit_rows)
+                url_rows.clear()
+                visit_rows.clear()
+        conn.executemany(url_query, url_rows)
+        conn.executemany(visit_query, visit_rows)
+    conn.close()
+
+
+def write_chromium_history(path: Path, history: Iterator) -> None:
+    """
+    Writes a history into a database with the schema of Chrome and Brave, whose
+    times are microseconds since 1601-01-01.
+    """
+
+    def to_webkit(unix_time: float) -> int:
+        return int((unix_time + WEBKIT_EPOCH_OFFSET) * 1_000_000)
+
+    write_history(
+        path,
+        CHROMIUM_SCHEMA,
+        "INSERT INTO urls (id, url, visit_count, last_visit_time) VALUES (?, ?, ?, ?)",
+        "INSERT INTO visits (url, visit_time) VALUES (?, ?)",
+        history,
+        lambda url_id, url, times: (url_id, url, len(times), to_webkit(times[-1])),
+        lambda url_id, visit_time: (url_id, to_webkit(visit_time)),
+    )
+
+
+def write_firefox_history(path: Path, history: Iterator) -> None:
+    """
+    Writes a history into a database with the schema of Firefox, whose times are
+    microseconds since the Unix epoch.
+    """
+
+    def to_prtime(unix_time: float) -> int:
+        return int(unix_time * 1_000_000)
+
+    write_history(
+        path,
+        FIREFOX_SCHEMA,
+        "INSERT INTO moz_places (id, url, rev_host, visit_count, last_visit_date) "
+        "VALUES (?, ?, ?, ?, ?)",
+        "INSERT INTO moz_historyvisits (place_id, visit_date, visit_type) "
+        "VALUES (?, ?, 1)",
+        history,
+        lambda url_id, url, times: (
+            url_id,
+            url,
+            # Firefox stores the host reversed, with a trailing dot
+            url.split("/")[2][::-1] + ".",
+            len(times),
+            to_prtime(times[-1]),
+        ),
+        lambda url_id, visit_time: (url_id, to_prtime(visit_time)),
+    )
+
+
+def write_safari_history(path: Path, history: Iterator) -> None:
+    """
+    Writes a history into a database with the schema of Safari, whose times are
+    seconds since 2001-01-01.
+    """
+    write_history(
+        path,
+        SAFARI_SCHEMA,
+        "INSERT INTO history_items (id, url, visit_count) VALUES (?, ?, ?)",
+        "INSERT INTO history_visits (history_item, visit_time) VALUES (?, ?)",
+        history,
+        lambda url_id, url, times: (url_id, url, len(times)),
+        lambda url_id, visit_time: (url_id, visit_time - COCOA_EPOCH_OFFSET),
+    )
+
+
+def create_synthetic_history(
+    folder: Path,
+    num_urls: int,
+    num_visits: Optional[int] = None,
+    num_domains: int = 1000,
+    skew: float = 1.0,
+    browsers: Optional[List[str]] = None,
+    num_profiles: int = 1,
+    days: float = 90,
+    end_time: Optional[float] = None,
+    seed: int = 0,
+) -> Dict[str, Path]:
+    """
+    Generates synthetic history databases laid out like the browsers do: Safari's
+    History.db, Chrome's and Brave's user data directories holding a History file
+    per profile ("Default", "Profile 1", ...), and Firefox's profiles directory
+    holding a places.sqlite per profile.
+
+    Each database gets its own history, seeded differently, so that the histories
+    don't overlap entirely.
+
+    Args:
+        folder (Path): The folder to generate the databases in.
+        num_urls (int): The number of distinct URLs per database.
+        num_visits (Optional[int]): The number of visits per database, defaults to
+            twice the number of URLs.
+        num_domains (int): The number of distinct hosts.
+        skew (float): The Zipf exponent of the distribution of URLs over hosts.
+        browsers (Optional[List[str]]): The browsers to generate, defaults to all.
+        num_profiles (int): The number of profiles of Chrome, Brave and Firefox;
+            Safari has a single history.
+        days (float): The number of days the visits span.
+        end_time (Optional[float]): The Unix time of the latest possible visit,
+            defaults to now.
+        seed (int): The seed of the random generator.
+
+    Returns:
+        Dict[str, Path]: The path of Safari's database, and of the directory
+            holding the profiles of the other browsers.
+    """
+    folder = Path(folder)
+    num_visits = 2 * num_urls if num_visits is None else num_visits
+    end_time = time.time() if end_time is None else end_time
+    chromium_profiles = ["Default"] + [f"Profile {n}" for n in range(1, num_profiles)]
+    layouts = {
+        "safari": (write_safari_history, Path("Safari"), ["History.db"]),
+        "chrome": (
+            write_chromium_history,
+            Path("Chrome"),
+            [f"{profile}/History" for profile in chromium_profiles],
+        ),
+        "firefox": (
+            write_firefox_history,
+            Path("Firefox") / "Profiles",
+            [f"synthetic{n}.default/places.sqlite" for n in range(num_profiles)],
+        ),
+        "brave": (
+            write_chromium_history,
+            Path("Brave"),
+            [f"{profile}/History" for profile in chromium_profiles],
+        ),
+    }
+    paths = {}
+    offset = 0
+    for browser in browsers or BROWSERS:
+        write_history, directory, databases = layouts[browser]
+        for database in databases:
+            history = iter_synthetic_visits(
+                num_urls, num_visits, num_domains, skew, days, end_time, seed + offset
+            )
+            write_history(folder / directory / database, history)
+            offset += 1
+        paths[browser] = folder / directory
+        if browser == "safari":
+            paths[browser] /= databases[0]
+    return paths
+
+
+def parse_size(size: str) -> int:
+    """
+    Parses a number of rows such as "10000", "10k" or "1M".
+    """
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    size = size.strip().lower()
+    if size and size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic browser history databases."
+    )
+    parser.add_argument("folder", type=Path)
+    parser.add_argument("--urls", default="10k", help="Distinct URLs per browser")
+    parser.add_argument("--visits", help="Visits per browser, twice --urls by default")
+    parser.add_argument("--domains", type=int, default=1000)
+    parser.add_argument("--skew", type=float, default=1.0)
+    parser.add_argument("--browsers", default=",".join(BROWSERS))
+    parser.add_argument("--profiles", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generated = create_synthetic_history(
+        args.folder,
+        parse_size(args.urls),
+        parse_size(args.visits) if args.visits else None,
+        args.domains,
+        args.skew,
+        args.browsers.split(","),
+        args.profiles,
+        seed=args.seed,
+    )
+    for browser, path in generated.items():
+        print(f"{browser}: {os.fspath(path)}")
@@ -1,16 +1,47 @@
 import hashlib
 import os
 from pathlib import Path
-import json
 from syftbox.lib import Client, SyftPermission
-from datetime import datetime, timezone
-from typing import List, Dict
+import itertools
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from urllib.parse import urlparse, parse_qs
-import tldextract
 
-from src.browser_history import fetch_combined_history
-from src.educational_content_classifier import classify_url
+from src.browser_history import (
+    Visit,
+    get_changed_sources,
+    get_source_fingerprints,
+    iter_combined_history,
+    list_history_databases,
+)
+from src.educational_content_classifier import (
+    classify_url,
+    classify_urls,
+    get_rules_version,
+)
+from src.paper_detection import count_papers, get_paper_id
+from src.title_fetcher import TitleFetcher
 from src.utils.config_reader import ConfigReader
+from src.utils.domain_parts import split_url_host
+from src.utils.output_writer import (
+    JsonListWriter,
+    get_output_path,
+    list_output_paths,
+    open_output_writer,
+    iter_output_counts,
+    remove_stale_outputs,
+)
+from src.utils.history_watcher import acquire_daemon_lock, watch_history
+from src.utils.delta_publisher import (
+    DeltaPublisher,
+    iter_published,
+    load_manifest,
+    remove_delta_outputs,
+)
+from src.utils.persistent_cache import PersistentLRUCache
+from src.utils.run_metrics import get_run_metrics, profile
+from src.utils.run_state import load_run_state, save_run_state
 
 config_reader = ConfigReader()
 
@@ -18,87 +49,175 @@ API_NAME = config_reader.get_api_name()
 AGGREGATOR_DATASITE = config_reader.get_aggregator_datasite()
 INTERVAL = config_reader.get_interval()
 ALLOW_TOP = config_reader.get_allow_top()
-
-
-def split_url(url: List[str], private: bool = False):
+FULL_RESCAN = config_reader.get_full_rescan()
+CONCURRENT_FETCH = config_reader.get_concurrent_fetch()
+AGGREGATE_VISITS = config_reader.get_aggregate_visits()
+WINDOW_DAYS = config_reader.get_window_days()
+CLASSIFICATION_CACHE_SIZE = config_reader.get_classification_cache_size()
+OUTPUT_FORMAT = config_reader.get_output_format()
+OUTPUT_COMPRESSION = config_reader.get_output_compression()
+PUBLISH_MODE = config_reader.get_publish_mode()
+MAX_SEGMENTS = config_reader.get_max_segments()
+HASH_COUNTS = config_reader.get_hash_counts()
+HASH_CACHE_SIZE = config_reader.get_hash_cache_size()
+FETCH_TITLES = config_reader.get_fetch_titles()
+DAEMON_MODE = config_reader.get_daemon_mode()
+SAVE_METRICS = config_reader.get_save_metrics()
+PROFILE_RUNS = config_reader.get_profile_runs()
+
+RUN_METRICS_FILE = "run_metrics.json"
+RUN_PROFILE_FILE = "run_profile.prof"
+
+# Tags the persisted hashes: bump it whenever `hash_url` changes
+HASH_VERSION = "sha256-1"
+
+
+def split_url(
+    url: List[str], private: bool = False, classification: Optional[str] = None
+):
     try:
         # Parse the URL
         parsed_url = urlparse(url)
-        # Extract domain details using tldextract
-        extracted = tldextract.extract(url)
+        # Extract domain details, memoized per host
+        subdomain, domain, suffix = split_url_host(url, parsed_url.netloc)
 
         components = {
             "scheme": parsed_url.scheme,
-            "subdomain": extracted.subdomain,
-            "domain": extracted.domain,
-            "tld": extracted.suffix,  # Top-level domain
+            "subdomain": subdomain,
+            "domain": domain,
+            "tld": suffix,  # Top-level domain
             "netloc": parsed_url.netloc,
             "path": parsed_url.path,
             # "query": parsed_url.query, # Skip for privacy
             # "fragment": parsed_url.fragment, # Skip for privacy
-            "classification": classify_url(url),
+            "classification": classification or classify_url(url),
+            # Extracted before the query is dropped, e.g. OpenReview's "id"
+            "paper_id": get_paper_id(
+                parsed_url.netloc, parsed_url.path, parsed_url.query
+            ),
         }
         if private:
             if parsed_url.query:
                 components["query_params"] = parse_qs(parsed_url.query)
 
-        # Skip fetching the title
-        # if components["classification"] != "general":
-        #     components["title"] = get_webpage_title(url)
+        # Titles are fetched in bulk by `process_history`, see FETCH_TITLES
 
         return components
     except Exception as e:
         return {"error": str(e), "url": url}
 
-def get_paper_stats(filtered_urls: List[Dict[str, str]]) -> List[str]:
-    cs_research_domains = [
-        "arxiv.org",
-        "ieee.org",
-        "acm.org",
-        "neurips.cc",
-        "icml.cc",
-        "iclr.cc",
-        "aaai.org",
-        "ijcai.org",
-        "usenix.org",
-        "aclweb.org",
-        "openreview.net",
-        "dl.acm.org",
-        "computer.org",
-        "semantic.scholar.org",
-        "dblp.org",
-        "researchgate.net" 
+def is_published(urlstr: Dict) -> bool:
+    # Filter out non-educational URLs
+    return (
+        urlstr.get("classification", "general") != "general"
+        and urlstr["scheme"].lower() in {"http", "https"}
+    )
+
+
+def classify_batch(
+    urls: List[str], classification_cache: Optional[PersistentLRUCache] = None
+) -> List[Optional[str]]:
+    """
+    Classifies a batch of URLs, only running the classifier on the distinct URLs
+    that are not cached yet.
+    """
+    if classification_cache is None:
+        return classify_urls(urls)
+
+    misses = [url for url in dict.fromkeys(urls) if url not in classification_cache]
+    classified = dict(zip(misses, classify_urls(misses)))
+    for url, classification in classified.items():
+        classification_cache.put(url, classification)
+    return [
+        classified[url] if url in classified else classification_cache.get(url)
+        for url in urls
     ]
-    
-    cs_paper_list = []
-    for url in filtered_urls:
-        if url["netloc"].startswith("www."):
-            netloc = url["netloc"][4:]
-        else:
-            netloc = url["netloc"]
-        
-        if netloc in cs_research_domains:
-            path = url["path"].lower()
-            
-            is_valid_paper = any([
-                (netloc == "arxiv.org" and path.startswith("/pdf/")),
-                (netloc == "researchgate.net" and path.startswith("/publication/")),
-                (netloc not in ["researchgate.net", "arxiv.org"] and 
-                 not any(skip in path for skip in [
-                     "search", 
-                     "profile",
-                     "citations",
-                     "author",
-                     "browse",
-                     "/",
-                     "index"
-                 ]))
-            ])
-            
-            if is_valid_paper:
-                cs_paper_list.append(netloc + url["path"])
-    
-    return cs_paper_list
+
+
+def process_history(
+    batches: Iterable[List[Visit]],
+    classification_cache: Optional[PersistentLRUCache] = None,
+    title_fetcher: Optional[TitleFetcher] = None,
+) -> Iterator[Tuple[List[Dict], List[Dict]]]:
+    """
+    Splits, classifies and filters the fetched visits one batch at a time.
+
+    Research papers are counted whatever their host is classified as, e.g. on
+    doi.org, but only the visits worth publishing go to the history outputs.
+
+    Args:
+        batches (Iterable[List[Visit]]): Batches of visits, as streamed by
+            `iter_combined_history`.
+        classification_cache (Optional[PersistentLRUCache]): Previously computed
+            classifications, keyed by URL.
+        title_fetcher (Optional[TitleFetcher]): If given, the titles of the pages
+            worth publishing are fetched into "title".
+
+    Yields:
+        Tuple[List[Dict], List[Dict]]: Per batch, the URL components of the visits
+            worth publishing and those of the visits of a research paper, with
+            the number of visits each entry stands for in "visit_count".
+    """
+    metrics = get_run_metrics()
+    for batch in batches:
+        urls = [visit.url for visit in batch]
+        with metrics.stage("classify_url", rows=len(urls)):
+            classifications = classify_batch(urls, classification_cache)
+
+        with metrics.stage("split_url", rows=len(urls)):
+            processed = []
+            for url, visit, classification in zip(urls, batch, classifications):
+                urlstr = split_url(url, classification=classification)
+                # Visits aggregated in SQL carry their count, others one visit
+                urlstr["visit_count"] = visit.visit_count or 1
+                processed.append((url, urlstr))
+
+        with metrics.stage("filter", rows=len(processed)):
+            published = [
+                (url, urlstr) for url, urlstr in processed if is_published(urlstr)
+            ]
+            papers = [
+                urlstr for _, urlstr in processed if urlstr.get("paper_id") is not None
+            ]
+
+        if title_fetcher is not None:
+            with metrics.stage("fetch_titles", rows=len(published)):
+                titles = title_fetcher.fetch_titles(url for url, _ in published)
+            for url, urlstr in published:
+                urlstr["title"] = titles[url]
+        yield [urlstr for _, urlstr in published], papers
+
+
+def hash_domains(
+    entries: Iterable[Tuple[str, int]],
+    hash_cache: Optional[PersistentLRUCache] = None,
+) -> List[Tuple[str, int]]:
+    """
+    Hashes the domain of each entry, hashing each distinct domain once.
+
+    The hashes keep the order of the entries, so that the hashed history stays
+    aligned with the clear history; writers storing counts aggregate them.
+
+    Args:
+        entries (Iterable[Tuple[str, int]]): (domain, visit count) pairs.
+        hash_cache (Optional[PersistentLRUCache]): Previously computed hashes,
+            keyed by domain.
+
+    Returns:
+        List[Tuple[str, int]]: The (domain hash, visit count) pair of each entry.
+    """
+    hashes = {}
+    hashed = []
+    for domain, visit_count in entries:
+        domain_hash = hashes.get(domain)
+        if domain_hash is None:
+            if hash_cache is None:
+                domain_hash = hash_url(domain)
+            else:
+                domain_hash = hash_cache.get_or_compute(domain, hash_url)
+            hashes[domain] = domain_hash
+        hashed.append((domain_hash, visit_count))
+    return hashed
 
 
 def create_restricted_public_folder(browser_history_path: Path) -> None:
@@ -152,28 +271,66 @@ def create_private_folder(path: Path) -> Path:
 
 
 def save(path: str, browser_history: List[Dict]):
-    current_time = datetime.now(timezone.utc)
-    timestamp_str = current_time.strftime("%Y-%m-%d %H:%M:%S")
-
-    with open(path, "w") as json_file:
-        json.dump(
-            {"browser_history": browser_history, "timestamp": timestamp_str},
-            json_file,
-            indent=4,
-        )
+    with JsonListWriter(path, "browser_history") as writer:
+        writer.write(browser_history)
 
 def save_papers(path: str, paper_list: List[str]):
-    current_time = datetime.now(timezone.utc)
-    timestamp_str = current_time.strftime("%Y-%m-%d %H:%M:%S")
-
-    with open(path, "w") as json_file:
-        json.dump(
-            {"papers": paper_list, "timestamp": timestamp_str},
-            json_file,
-            indent=4,
-        )
+    with JsonListWriter(path, "papers") as writer:
+        writer.write(paper_list)
 
 
+def open_output(
+    folder: Path,
+    name: str,
+    key: str,
+    output_format: str = "json",
+    value_type: str = "string",
+):
+    """
+    Opens the writer of an output file in the given format and the configured
+    compression.
+    """
+    path = get_output_path(folder, name, output_format, OUTPUT_COMPRESSION)
+    return open_output_writer(
+        path, key, output_format, OUTPUT_COMPRESSION, value_type=value_type
+    )
+
+
+def load_previous(folder: Path, name: str, key: str) -> Iterator[Tuple]:
+    """
+    Streams the entries published by a previous run, so that the visits fetched
+    incrementally can be appended to them.
+
+    Args:
+        folder (Path): The folder of the output files.
+        name (str): The name of the output file, without extension. The previous
+            file is found whatever format it was saved in, or publish mode: the
+            delta outputs are read when switching back to full files.
+        key (str): The key holding the list of entries in the file.
+
+    Yields:
+        Tuple: The previously published `(entry, count)` pairs, see
+            `iter_output_counts`, one at a time so that memory stays flat.
+    """
+    if load_manifest(folder, name)["base"] is not None:
+        yield from iter_published(folder, name, key)
+        return
+    for path in list_output_paths(folder, name):
+        if not path.exists():
+            continue
+        streamed = 0
+        try:
+            for pair in iter_output_counts(path, key):
+                streamed += 1
+                yield pair
+            return
+        except (OSError, ValueError):
+            print(f"Unable to read previous output file: {path}")
+        if streamed:
+            # The file was partly carried over already, another format would
+            # publish its entries twice.
+            return
+
 
 def should_run() -> bool:
     timestamp_file = f"./script_timestamps/{API_NAME}_last_run"
@@ -232,10 +389,223 @@ def hash_url(domain):
         print(f"Error hashing domain {domain}: {str(e)}")
         return None
 
+def publish_history(
+    restricted_public_folder: Path,
+    classification_cache: PersistentLRUCache,
+    hash_cache: PersistentLRUCache,
+    title_cache: PersistentLRUCache,
+    full_rescan: bool = False,
+) -> None:
+    """
+    Fetches the visits since the previous run, then publishes them along with the
+    previously published ones.
+
+    The outputs are replaced before the run state is saved, as they live in
+    different folders and can't be replaced at once: a crash in between publishes
+    the visits of this run again on the next one, but never loses them.
+
+    Args:
+        restricted_public_folder (Path): The folder shared with the aggregator.
+        classification_cache (PersistentLRUCache): Classifications, keyed by URL.
+        hash_cache (PersistentLRUCache): Domain hashes, keyed by domain.
+        title_cache (PersistentLRUCache): Page titles, keyed by URL.
+        full_rescan (bool): Whether to read the whole history again.
+    """
+    metrics = get_run_metrics()
+
+    # Only fetch visits newer than the last run, unless a full rescan is requested.
+    # The state is read again on every run, as a failed run may have advanced the
+    # cursors in memory without publishing the visits.
+    run_state = load_run_state()
+    cursors = {} if full_rescan else run_state["cursors"]
+    previous_cursors = dict(cursors)
+    # Without stored cursors everything is re-read, so previous outputs are replaced
+    resume = bool(cursors)
+
+    # Sources whose database files are untouched since the last run are skipped
+    fingerprints = get_source_fingerprints()
+    previous_fingerprints = {} if full_rescan else run_state.get("fingerprints", {})
+    changed = get_changed_sources(fingerprints, previous_fingerprints)
+    if not changed:
+        print("No browser history changed since the last run.")
+        return
+
+    since = None
+    if WINDOW_DAYS > 0:
+        since = datetime.now(timezone.utc) - timedelta(days=WINDOW_DAYS)
+
+    completed = set()
+    batches = iter_combined_history(
+        cursors=cursors,
+        concurrent=CONCURRENT_FETCH,
+        aggregate=AGGREGATE_VISITS,
+        only=changed,
+        completed=completed,
+        since=since,
+    )
+
+    # Saving public browser history added in it.
+    name_enc = "browser_history_enc"
+    name_clear = "browser_history_clear"
+    name_papers = "paper_stats"
+    # Hashes are published as {hash: count} aggregates if enabled; the binary
+    # format already stores each distinct hash once with its count
+    enc_format = (
+        "json_counts" if HASH_COUNTS and OUTPUT_FORMAT != "binary" else OUTPUT_FORMAT
+    )
+    outputs = [(name_enc, "browser_history", enc_format, "digest")]
+    if ALLOW_TOP:
+        outputs += [
+            (name_clear, "browser_history", OUTPUT_FORMAT, "string"),
+            (name_papers, "papers", OUTPUT_FORMAT, "string"),
+        ]
+
+    # Stream every batch through the pipeline and straight into the output files,
+    # which only replace the previous ones once the whole history has been written
+    writers = {}
+    publishers = {}
+    with ExitStack() as stack:
+        for name, key, output_format, value_type in outputs:
+            if PUBLISH_MODE == "delta":
+                publisher = DeltaPublisher(
+                    restricted_public_folder,
+                    name,
+                    key,
+                    output_format,
+                    OUTPUT_COMPRESSION,
+                    value_type,
+                    max_segments=MAX_SEGMENTS,
+                )
+                # New visits go to a segment, unless there is no snapshot to add
+                # them to yet, in which case the previous full output seeds one
+                snapshot = not (resume and publisher.has_base)
+                writer = stack.enter_context(publisher.open(snapshot))
+                publishers[name] = publisher
+                carry_over = resume and snapshot
+            else:
+                writer = stack.enter_context(
+                    open_output(
+                        restricted_public_folder, name, key, output_format, value_type
+                    )
+                )
+                carry_over = resume
+            if carry_over:
+                writer.write_counts(load_previous(restricted_public_folder, name, key))
+            writers[name] = writer
+
+        enc_writer = writers[name_enc]
+        if ALLOW_TOP:
+            clear_writer = writers[name_clear]
+            papers_writer = writers[name_papers]
+
+        title_fetcher = None
+        if FETCH_TITLES:
+            # Titles stay in the local title cache, they are never published
+            title_fetcher = stack.enter_context(
+                TitleFetcher(
+                    title_cache,
+                    max_workers=config_reader.get_title_workers(),
+                    max_per_host=config_reader.get_title_workers_per_host(),
+                    timeout=config_reader.get_title_timeout(),
+                    ttl=config_reader.get_title_ttl(),
+                )
+            )
+
+        for filtered_batch, paper_batch in process_history(
+            batches, classification_cache, title_fetcher
+        ):
+            # Keep only information we need to save
+            history_to_file = [
+                (urlstr["netloc"], urlstr["visit_count"]) for urlstr in filtered_batch
+            ]
+
+            # Save the hashed history and the clear history if allowed
+            with metrics.stage("hash_url", rows=len(history_to_file)):
+                hashed = hash_domains(history_to_file, hash_cache)
+            with metrics.stage("save", rows=len(history_to_file)):
+                enc_writer.write_counts(hashed)
+
+            if ALLOW_TOP:
+                # Get the list of research papers browsed by the user
+                with metrics.stage("paper_stats", rows=len(paper_batch)):
+                    papers = count_papers(paper_batch)
+                with metrics.stage("save"):
+                    clear_writer.write_counts(history_to_file)
+                    papers_writer.write_counts(papers.items())
+
+        # Finish the output files, replacing the previous ones
+        with metrics.stage("save"):
+            stack.close()
+
+    with metrics.stage("save"):
+        for name, writer in writers.items():
+            if name in publishers:
+                publishers[name].commit()
+                remove_stale_outputs(restricted_public_folder, name)
+            else:
+                remove_stale_outputs(restricted_public_folder, name, writer.path)
+                remove_delta_outputs(restricted_public_folder, name)
+        # Titles are never published: remove those an earlier version published
+        remove_stale_outputs(restricted_public_folder, "page_titles")
+        remove_delta_outputs(restricted_public_folder, "page_titles")
+
+    # Persist the cursors only once the new visits have been published, see the
+    # docstring for a crash before this point. A source that fails aborts the run
+    # before it, so nothing it read is published: only the sources read to the
+    # end advance their cursor and fingerprint.
+    run_state["cursors"] = {
+        **previous_cursors,
+        **{key: cursors[key] for key in completed if key in cursors},
+    }
+    run_state["fingerprints"] = {
+        **previous_fingerprints,
+        **{key: fingerprints[key] for key in completed},
+    }
+    save_run_state(run_state)
+    classification_cache.save()
+    hash_cache.save()
+    if FETCH_TITLES:
+        title_cache.save()
+
+
+def run_with_metrics(private_folder: Path, run: Callable[[], None]) -> None:
+    """
+    Runs `run` as one instrumented run, writing its metrics, and its profile in
+    profile mode, to the private folder.
+
+    Metrics stay private: the number of rows per browser and profile describes the
+    user's history too.
+    """
+    metrics = get_run_metrics()
+    metrics.reset()
+    with ExitStack() as stack:
+        if PROFILE_RUNS:
+            stack.enter_context(profile(private_folder / RUN_PROFILE_FILE))
+        with metrics.stage("total"):
+            run()
+    if SAVE_METRICS:
+        metrics.save(private_folder / RUN_METRICS_FILE)
+
+
 if __name__ == "__main__":
-    if not should_run():
-        print(f"Skipping {API_NAME}, not enough time has passed.")
-        exit(0)
+    if DAEMON_MODE:
+        # The app keeps being launched every INTERVAL: only one daemon may run
+        daemon_lock = acquire_daemon_lock(
+            Path(config_reader.get_temp_data_folder()) / "daemon.lock"
+        )
+        if daemon_lock is None:
+            print(f"Skipping {API_NAME}, the daemon is already running.")
+            exit(0)
+    else:
+        if not should_run():
+            print(f"Skipping {API_NAME}, not enough time has passed.")
+            exit(0)
+        # Exit before loading anything when no source changed since the last run
+        if not FULL_RESCAN and not get_changed_sources(
+            get_source_fingerprints(), load_run_state().get("fingerprints", {})
+        ):
+            print(f"Skipping {API_NAME}, no browser history changed.")
+            exit(0)
 
     client = Client.load()
 
@@ -246,35 +616,54 @@ if __name__ == "__main__":
     # Create private folder
     private_folder = create_private_folder(client.datasite_path)
 
-    combined_history = fetch_combined_history()
-    processed_history_public = [split_url(urlstr["url"]) for urlstr in combined_history]
-
-    # Filter out non-educational URLs
-    filtered_history_public = [
-        urlstr
-        for urlstr in processed_history_public
-        if urlstr["classification"] != "general"
-        and urlstr["scheme"].lower() in {"http", "https"}
-    ]
-
-    # Get the list of research papers browsed by the user
-    cs_paper_list = get_paper_stats(filtered_history_public)
-
-    # Saving public browser history added in it.
-    file_enc: Path = restricted_public_folder / "browser_history_enc.json"
-    file_clear: Path = restricted_public_folder / "browser_history_clear.json"
-    file_papers: Path = restricted_public_folder / "paper_stats.json"
-
-    # Keep only information we need to save
-    history_to_file = [
-        urlstr["netloc"]
-        for urlstr in filtered_history_public
-    ]
-    hash_history = [hash_url(url) for url in history_to_file]
-
-    # Save the hashed history and the clear history if allowed
-    save(path=str(file_enc), browser_history=hash_history)
-
-    if ALLOW_TOP:
-        save(path=str(file_clear), browser_history=history_to_file)
-        save_papers(path=str(file_papers), paper_list=cs_paper_list)
+    # Classifications of previously seen URLs, dropped whenever the rules change
+    classification_cache = PersistentLRUCache(
+        Path(config_reader.get_temp_data_folder()) / "classification_cache.json",
+        max_size=CLASSIFICATION_CACHE_SIZE,
+        version=get_rules_version(),
+    )
+
+    # Titles of previously fetched pages, refetched once expired
+    title_cache = PersistentLRUCache(
+        Path(config_reader.get_temp_data_folder()) / "title_cache.json",
+        max_size=config_reader.get_title_cache_size(),
+    )
+
+    # Hashes of previously seen domains
+    hash_cache = PersistentLRUCache(
+        Path(config_reader.get_temp_data_folder()) / "hash_cache.json",
+        max_size=HASH_CACHE_SIZE,
+        version=HASH_VERSION,
+    )
+
+    if not DAEMON_MODE:
+        run_with_metrics(
+            private_folder,
+            lambda: publish_history(
+                restricted_public_folder,
+                classification_cache,
+                hash_cache,
+                title_cache,
+                full_rescan=FULL_RESCAN,
+            ),
+        )
+    else:
+        # Stay resident, with the classifier and caches warm, and publish whenever
+        # a history database changes. Only the first run may be a full rescan.
+        runs = itertools.count()
+        watch_history(
+            list_history_databases,
+            lambda: run_with_metrics(
+                private_folder,
+                lambda: publish_history(
+                    restricted_public_folder,
+                    classification_cache,
+                    hash_cache,
+                    title_cache,
+                    full_rescan=FULL_RESCAN and next(runs) == 0,
+                ),
+            ),
+            debounce=config_reader.get_daemon_debounce(),
+            min_interval=INTERVAL,
+            poll_interval=config_reader.get_daemon_poll_interval(),
+        )
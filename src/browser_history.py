@@ -1,111 +1,529 @@
 import os
-import sqlite3
 import platform
-from datetime import datetime, timedelta
-from typing import List, Dict
-from pathlib import Path
-import shutil
-from src.utils.config_reader import ConfigReader
+import queue
+import threading
+from datetime import datetime, timedelta, timezone
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import partial
+from typing import (
+    Callable,
+    Collection,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+from src.utils.history_watcher import get_file_stats, get_watched_paths
+from src.utils.run_metrics import get_run_metrics
+from src.utils.sqlite_snapshot import open_snapshot
 
+# Lower bound used when a source has no stored cursor: every row is newer than it
+FULL_SCAN = float("-inf")
 
-def fetch_safari_history() -> List[Dict]:
-    if platform.system() != "Darwin":
-        return []
-    safari_db_path = os.path.expanduser("~/Library/Safari/History.db")
+# Number of rows pulled from a SQLite cursor at a time
+BATCH_SIZE = 5000
+
+# Offsets of the browsers' timestamp epochs from the Unix epoch
+UNIX_EPOCH = datetime(1970, 1, 1)
+WEBKIT_EPOCH_OFFSET_US = 11_644_473_600_000_000  # Chromium: µs since 1601-01-01
+MAC_EPOCH_OFFSET = 978_307_200  # Safari: seconds since 2001-01-01
+
+
+def from_unix_us(timestamp: int) -> datetime:
+    """
+    Converts Unix microseconds into a naive UTC datetime.
+    """
+    return UNIX_EPOCH + timedelta(microseconds=timestamp)
+
+
+def to_unix_us(time: datetime) -> int:
+    """
+    Converts a datetime, naive UTC or aware, into Unix microseconds.
+    """
+    if time.tzinfo is not None:
+        time = time.astimezone(timezone.utc).replace(tzinfo=None)
+    return (time - UNIX_EPOCH) // timedelta(microseconds=1)
+
+
+class Visit(Mapping):
+    """
+    A fetched visit, or with `aggregate` all the new visits of a URL.
+
+    Millions of visits can be fetched at once, so they are stored compactly: slots
+    instead of a dict, and times as int Unix microseconds, "visit_us" and
+    "first_visit_us". The record can still be read like the dicts fetchers used to
+    return, with the keys "url", "visit_time", "browser", and when aggregated
+    "visit_count" and "first_visit_time"; the datetimes are only built when read.
+    """
+
+    __slots__ = ("url", "visit_us", "browser", "visit_count", "first_visit_us")
+    KEYS = ("url", "visit_time", "browser")
+    AGGREGATED_KEYS = KEYS + ("visit_count", "first_visit_time")
+
+    def __init__(
+        self,
+        url: str,
+        visit_us: int,
+        browser: str,
+        visit_count: Optional[int] = None,
+        first_visit_us: Optional[int] = None,
+    ):
+        self.url = url
+        self.visit_us = visit_us
+        self.browser = browser
+        self.visit_count = visit_count
+        self.first_visit_us = first_visit_us
+
+    @property
+    def visit_time(self) -> datetime:
+        return from_unix_us(self.visit_us)
+
+    @property
+    def first_visit_time(self) -> Optional[datetime]:
+        if self.first_visit_us is None:
+            return None
+        return from_unix_us(self.first_visit_us)
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.KEYS if self.visit_count is None else self.AGGREGATED_KEYS
+
+    def __getitem__(self, key: str):
+        if key not in self.keys():
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+    def __repr__(self) -> str:
+        return f"Visit({dict(self)!r})"
+
+
+def get_cursor(cursors: Optional[Dict[str, float]], key: str) -> float:
+    """
+    Returns the last seen visit time for a source, in the source's native time unit.
+
+    Args:
+        cursors (Optional[Dict[str, float]]): The high-water marks keyed by source,
+            or None to read the whole history.
+        key (str): The source key, e.g. "chrome" or "firefox:<profile>".
+
+    Returns:
+        float: The stored high-water mark, or FULL_SCAN if there is none.
+    """
+    if cursors is None:
+        return FULL_SCAN
+    return cursors.get(key, FULL_SCAN)
+
+
+def update_cursor(
+    cursors: Optional[Dict[str, float]], key: str, rows: List[tuple]
+) -> None:
+    """
+    Advances the high-water mark of a source to the newest visit time in `rows`,
+    their second column, in the source's native time unit.
+    """
+    if cursors is None or not rows:
+        return
+    cursors[key] = max(max(row[1] for row in rows), cursors.get(key, FULL_SCAN))
+
+
+def get_time_conditions(
+    column: str,
+    to_native: str,
+    cursor: float = FULL_SCAN,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> Tuple[str, tuple]:
+    """
+    Returns the WHERE conditions selecting the visits newer than a cursor and
+    within a time window, and their parameters.
+
+    The bounds are compared with the raw timestamp `column`, so that SQLite can use
+    its index rather than converting every row: `to_native` is the SQL expression
+    converting a parameter "?" in Unix microseconds into the unit of the column.
+
+    Args:
+        column (str): The timestamp column, in the browser's native unit.
+        to_native (str): The conversion of a Unix microseconds parameter.
+        cursor (float): The high-water mark, in the native unit.
+        since (Optional[datetime]): If given, the earliest visit time, included.
+        until (Optional[datetime]): If given, the latest visit time, excluded.
+
+    Returns:
+        Tuple[str, tuple]: The conditions, "1" if there are none, and parameters.
+    """
+    conditions = []
+    params = []
+    if cursor != FULL_SCAN:
+        conditions.append(f"{column} > ?")
+        params.append(cursor)
+    if since is not None:
+        conditions.append(f"{column} >= {to_native}")
+        params.append(to_unix_us(since))
+    if until is not None:
+        conditions.append(f"{column} < {to_native}")
+        params.append(to_unix_us(until))
+    return " AND ".join(conditions) or "1", tuple(params)
+
+
+def get_limit_clause(order_by: str, limit: Optional[int]) -> Tuple[str, tuple]:
+    """
+    Returns the clause keeping the `limit` newest rows, and its parameters.
+
+    Rows are only sorted when they are limited: the cursors don't depend on the
+    order of the rows, and sorting a whole history is the costliest part of a scan.
+    """
+    if limit is None:
+        return "", ()
+    return f"ORDER BY {order_by} DESC LIMIT ?", (limit,)
+
+
+def iter_query_batches(
+    db_path: str, query: str, params: tuple, batch_size: int = BATCH_SIZE
+) -> Iterator[List[tuple]]:
+    """
+    Runs a query against a snapshot of a browser database and yields its rows in
+    batches, so that the whole result set is never held in memory.
+
+    The live database is read in place, falling back to a copy if it is locked.
+    """
+    metrics = get_run_metrics()
+    with open_snapshot(db_path) as conn:
+        with metrics.stage("query"):
+            cursor = conn.execute(query, params)
+        while True:
+            with metrics.stage("query") as stage:
+                rows = cursor.fetchmany(batch_size)
+                stage["rows"] = len(rows)
+            if not rows:
+                break
+            yield rows
+
+
+def iter_visit_batches(
+    db_path: str,
+    query: str,
+    params: tuple,
+    browser: str,
+    cursors: Optional[Dict[str, float]] = None,
+    cursor_key: Optional[str] = None,
+    batch_size: int = BATCH_SIZE,
+) -> Iterator[List[Visit]]:
+    """
+    Runs a history query and yields its rows as visits, advancing the cursor.
+
+    The query returns the URL, the visit time in the browser's native unit, the
+    visit time in Unix microseconds and, for aggregated visits, the visit count
+    and the first visit time in Unix microseconds.
+    """
+    cursor_key = cursor_key or browser
+    for rows in iter_query_batches(db_path, query, params, batch_size):
+        update_cursor(cursors, cursor_key, rows)
+        yield [
+            Visit(url, visit_us, browser, *aggregates)
+            for url, _, visit_us, *aggregates in rows
+        ]
+
+
+SAFARI_DB_PATHS = {"Darwin": "~/Library/Safari/History.db"}
+FIREFOX_PROFILES_PATHS = {
+    "Darwin": "~/Library/Application Support/Firefox/Profiles",
+    "Linux": "~/.mozilla/firefox",
+}
+
+# User data directories of the browsers sharing Chromium's history schema, each
+# holding one directory per profile ("Default", "Profile 1", ...)
+CHROME_USER_DATA_PATHS = {
+    "Darwin": "~/Library/Application Support/Google/Chrome",
+    "Linux": "~/.config/google-chrome",
+}
+BRAVE_USER_DATA_PATHS = {
+    "Darwin": "~/Library/Application Support/BraveSoftware/Brave-Browser",
+    "Linux": "~/.config/BraveSoftware/Brave-Browser",
+}
+CHROMIUM_USER_DATA_PATHS = {
+    "Darwin": "~/Library/Application Support/Chromium",
+    "Linux": "~/.config/chromium",
+}
+EDGE_USER_DATA_PATHS = {
+    "Darwin": "~/Library/Application Support/Microsoft Edge",
+    "Linux": "~/.config/microsoft-edge",
+}
+VIVALDI_USER_DATA_PATHS = {
+    "Darwin": "~/Library/Application Support/Vivaldi",
+    "Linux": "~/.config/vivaldi",
+}
+# Browser key: (display name, user data directories)
+CHROMIUM_BROWSERS = {
+    "chrome": ("Chrome", CHROME_USER_DATA_PATHS),
+    "brave": ("Brave", BRAVE_USER_DATA_PATHS),
+    "chromium": ("Chromium", CHROMIUM_USER_DATA_PATHS),
+    "edge": ("Edge", EDGE_USER_DATA_PATHS),
+    "vivaldi": ("Vivaldi", VIVALDI_USER_DATA_PATHS),
+}
+# Internal profiles that never hold the user's browsing
+IGNORED_CHROMIUM_PROFILES = {"System Profile", "Guest Profile"}
+
+
+def get_platform_path(paths: Dict[str, str]) -> Optional[str]:
+    """
+    Returns the path for the current platform, with "~" expanded, if there is one.
+    """
+    path = paths.get(platform.system())
+    return os.path.expanduser(path) if path else None
+
+
+def iter_safari_history(
+    cursors: Optional[Dict[str, float]] = None,
+    batch_size: int = BATCH_SIZE,
+    aggregate: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> Iterator[List[Visit]]:
+    safari_db_path = get_platform_path(SAFARI_DB_PATHS)
+    if not safari_db_path:
+        return
     if not os.path.exists(safari_db_path):
         print("Safari history database not found.")
-        return []
+        return
 
-    # Copying is necessary because databases are locked
-    # Copies are intentionally outside syftbox, but we can process them locally
-    config_reader = ConfigReader()
-    temp_data_folder = config_reader.get_temp_data_folder()
-    temp_db_path = Path(f"{temp_data_folder}/Safary_History.db").expanduser()
-    shutil.copy(safari_db_path, temp_db_path)
-
-    conn = sqlite3.connect(temp_db_path)
-    cursor = conn.cursor()
-    cursor.execute(
+    # Safari stores float seconds since 2001-01-01
+    where, params = get_time_conditions(
+        "history_visits.visit_time",
+        f"(? / 1000000.0 - {MAC_EPOCH_OFFSET})",
+        get_cursor(cursors, "safari"),
+        since,
+        until,
+    )
+    unix_us = f"CAST(ROUND({{}} * 1000000) AS INTEGER) + {MAC_EPOCH_OFFSET * 10**6}"
+    if aggregate:
+        order_by, limit_params = get_limit_clause("last_visit", limit)
+        query = f"""
+            SELECT
+                history_items.url,
+                MAX(history_visits.visit_time) AS last_visit,
+                {unix_us.format("MAX(history_visits.visit_time)")},
+                COUNT(*) AS visit_count,
+                {unix_us.format("MIN(history_visits.visit_time)")}
+            FROM
+                history_visits
+            JOIN
+                history_items
+            ON
+                history_items.id = history_visits.history_item
+            WHERE
+                {where}
+            GROUP BY
+                history_items.id
+            {order_by}
         """
-        SELECT
-            history_items.url,
-            history_visits.visit_time
-        FROM
-            history_visits
-        JOIN
-            history_items
-        ON
-            history_items.id = history_visits.history_item
-        ORDER BY
-            visit_time DESC
-    """
+    else:
+        order_by, limit_params = get_limit_clause("history_visits.visit_time", limit)
+        query = f"""
+            SELECT
+                history_items.url,
+                history_visits.visit_time,
+                {unix_us.format("history_visits.visit_time")}
+            FROM
+                history_visits
+            JOIN
+                history_items
+            ON
+                history_items.id = history_visits.history_item
+            WHERE
+                {where}
+            {order_by}
+        """
+    yield from iter_visit_batches(
+        safari_db_path,
+        query,
+        params + limit_params,
+        "safari",
+        cursors,
+        "safari",
+        batch_size,
     )
-    rows = cursor.fetchall()
-    conn.close()
 
-    # Remove tmp copy as we are done with it
-    temp_db_path.unlink(missing_ok=True)
 
-    history = []
-    for url, visit_time in rows:
-        visit_time = datetime(2001, 1, 1) + timedelta(seconds=visit_time)
-        history.append({"url": url, "visit_time": visit_time, "browser": "safari"})
-    return history
+def get_chromium_source_key(browser: str, profile: str) -> str:
+    """
+    Returns the cursor key of a Chromium-family profile: the browser key for the
+    default profile, as used before other profiles were read, and
+    "<browser>:<profile>" for the others.
+    """
+    return browser if profile == "Default" else f"{browser}:{profile}"
 
 
-def fetch_chrome_history() -> List[Dict]:
-    db_paths = {
-        "Darwin": os.path.expanduser(
-            "~/Library/Application Support/Google/Chrome/Default/History"
-        ),
-        "Linux": os.path.expanduser("~/.config/google-chrome/Default/History"),
-    }
-    chrome_db_path = db_paths.get(platform.system())
-    if not chrome_db_path or not os.path.exists(chrome_db_path):
-        print("Chrome history database not found.")
-        return []
+def list_chromium_profiles(
+    browsers: Optional[Collection[str]] = None,
+) -> List[Tuple[str, str, str]]:
+    """
+    Lists the profiles of Chromium-family browsers that have a history database.
 
-    # Copying is necessary because databases are locked
-    # Copies are intentionally outside syftbox, but we can process them locally
-    temp_db_path = Path("~/.tmp/Chrome_History").expanduser()
-    shutil.copy(chrome_db_path, temp_db_path)
+    Args:
+        browsers (Optional[Collection[str]]): The keys of the browsers to list,
+            defaults to all of CHROMIUM_BROWSERS.
 
-    conn = sqlite3.connect(temp_db_path)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT
-            urls.url,
-            urls.last_visit_time
-        FROM
-            urls
-        ORDER BY
-            last_visit_time DESC
+    Returns:
+        List[Tuple[str, str, str]]: The browser keys, profile directory names and
+            History database paths, the default profile of each browser first.
+    """
+    profiles = []
+    for browser, (_, user_data_paths) in CHROMIUM_BROWSERS.items():
+        if browsers is not None and browser not in browsers:
+            continue
+        user_data_path = get_platform_path(user_data_paths)
+        if not user_data_path or not os.path.isdir(user_data_path):
+            continue
+        names = os.listdir(user_data_path)
+        for profile in sorted(names, key=lambda name: (name != "Default", name)):
+            if profile in IGNORED_CHROMIUM_PROFILES:
+                continue
+            history_db = os.path.join(user_data_path, profile, "History")
+            if os.path.isfile(history_db):
+                profiles.append((browser, profile, history_db))
+    return profiles
+
+
+def iter_chromium_profile_history(
+    browser: str,
+    profile: str,
+    history_db: str,
+    cursors: Optional[Dict[str, float]] = None,
+    batch_size: int = BATCH_SIZE,
+    aggregate: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> Iterator[List[Visit]]:
+    """
+    Streams the history of one profile of a Chromium-family browser, all of which
+    share the same schema, with times in microseconds since 1601-01-01.
     """
+    cursor_key = get_chromium_source_key(browser, profile)
+    # Every visit is read from the visits table, whose visit_time is indexed,
+    # rather than the last visit of each URL from the urls table
+    where, params = get_time_conditions(
+        "visits.visit_time",
+        f"(? + {WEBKIT_EPOCH_OFFSET_US})",
+        get_cursor(cursors, cursor_key),
+        since,
+        until,
+    )
+    if aggregate:
+        order_by, limit_params = get_limit_clause("last_visit", limit)
+        query = f"""
+            SELECT
+                urls.url,
+                MAX(visits.visit_time) AS last_visit,
+                MAX(visits.visit_time) - {WEBKIT_EPOCH_OFFSET_US},
+                COUNT(*) AS visit_count,
+                MIN(visits.visit_time) - {WEBKIT_EPOCH_OFFSET_US} AS first_visit
+            FROM
+                urls
+            JOIN
+                visits
+            ON
+                urls.id = visits.url
+            WHERE
+                {where}
+            GROUP BY
+                urls.id
+            {order_by}
+        """
+    else:
+        order_by, limit_params = get_limit_clause("visits.visit_time", limit)
+        query = f"""
+            SELECT
+                urls.url,
+                visits.visit_time,
+                visits.visit_time - {WEBKIT_EPOCH_OFFSET_US}
+            FROM
+                urls
+            JOIN
+                visits
+            ON
+                urls.id = visits.url
+            WHERE
+                {where}
+            {order_by}
+        """
+    yield from iter_visit_batches(
+        history_db,
+        query,
+        params + limit_params,
+        browser,
+        cursors,
+        cursor_key,
+        batch_size,
     )
-    rows = cursor.fetchall()
-    conn.close()
 
-    temp_db_path.unlink(missing_ok=True)
 
-    history = []
-    for url, last_visit_time in rows:
-        visit_time = datetime(1601, 1, 1) + timedelta(microseconds=last_visit_time)
-        history.append({"url": url, "visit_time": visit_time, "browser": "chrome"})
-    return history
+def iter_chromium_history(
+    browser: str,
+    cursors: Optional[Dict[str, float]] = None,
+    batch_size: int = BATCH_SIZE,
+    aggregate: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> Iterator[List[Visit]]:
+    """
+    Streams the history of every profile of a Chromium-family browser, one profile
+    after the other.
+    """
+    profiles = list_chromium_profiles([browser])
+    if not profiles:
+        print(f"{CHROMIUM_BROWSERS[browser][0]} history database not found.")
+    for _, profile, history_db in profiles:
+        yield from iter_chromium_profile_history(
+            browser,
+            profile,
+            history_db,
+            cursors,
+            batch_size,
+            aggregate,
+            since,
+            until,
+            limit,
+        )
 
 
-def fetch_firefox_history() -> List[Dict]:
-    db_paths = {
-        "Darwin": os.path.expanduser("~/Library/Application Support/Firefox/Profiles"),
-        "Linux": os.path.expanduser("~/.mozilla/firefox"),
-    }
-    firefox_profile_path = db_paths.get(platform.system())
+def iter_chrome_history(
+    cursors: Optional[Dict[str, float]] = None,
+    batch_size: int = BATCH_SIZE,
+    aggregate: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> Iterator[List[Visit]]:
+    return iter_chromium_history(
+        "chrome", cursors, batch_size, aggregate, since, until, limit
+    )
+
+
+def list_firefox_profiles() -> List[Tuple[str, str]]:
+    """
+    Lists the Firefox profiles that have a history database.
+
+    Returns:
+        List[Tuple[str, str]]: The profile names and their places.sqlite paths.
+    """
+    firefox_profile_path = get_platform_path(FIREFOX_PROFILES_PATHS)
     if not firefox_profile_path or not os.path.exists(firefox_profile_path):
         print("Firefox profile directory not found.")
         return []
 
-    history = []
+    profiles = []
     for profile in os.listdir(firefox_profile_path):
         profile_path = os.path.join(firefox_profile_path, profile)
         if not os.path.isdir(profile_path):
@@ -114,18 +532,56 @@ def fetch_firefox_history() -> List[Dict]:
 
         if not os.path.exists(places_db):
             continue
+        profiles.append((profile, places_db))
+    return profiles
 
-        # Copying is necessary because databases are locked
-        # Copies are intentionally outside syftbox, but we can process them locally
-        temp_db_path = Path("~/.tmp/Firefox_places.sqlite").expanduser()
-        shutil.copy(places_db, temp_db_path)
 
-        conn = sqlite3.connect(temp_db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
+def iter_firefox_profile_history(
+    profile: str,
+    places_db: str,
+    cursors: Optional[Dict[str, float]] = None,
+    batch_size: int = BATCH_SIZE,
+    aggregate: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> Iterator[List[Visit]]:
+    cursor_key = f"firefox:{profile}"
+    # Firefox already stores Unix microseconds
+    where, params = get_time_conditions(
+        "moz_historyvisits.visit_date",
+        "?",
+        get_cursor(cursors, cursor_key),
+        since,
+        until,
+    )
+    if aggregate:
+        order_by, limit_params = get_limit_clause("last_visit", limit)
+        query = f"""
             SELECT
                 moz_places.url,
+                MAX(moz_historyvisits.visit_date) AS last_visit,
+                MAX(moz_historyvisits.visit_date),
+                COUNT(*) AS visit_count,
+                MIN(moz_historyvisits.visit_date) AS first_visit
+            FROM
+                moz_places
+            JOIN
+                moz_historyvisits
+            ON
+                moz_places.id = moz_historyvisits.place_id
+            WHERE
+                {where}
+            GROUP BY
+                moz_places.id
+            {order_by}
+        """
+    else:
+        order_by, limit_params = get_limit_clause("moz_historyvisits.visit_date", limit)
+        query = f"""
+            SELECT
+                moz_places.url,
+                moz_historyvisits.visit_date,
                 moz_historyvisits.visit_date
             FROM
                 moz_places
@@ -133,84 +589,445 @@ def fetch_firefox_history() -> List[Dict]:
                 moz_historyvisits
             ON
                 moz_places.id = moz_historyvisits.place_id
-            ORDER BY
-                visit_date DESC
+            WHERE
+                {where}
+            {order_by}
         """
+    yield from iter_visit_batches(
+        places_db,
+        query,
+        params + limit_params,
+        "firefox",
+        cursors,
+        cursor_key,
+        batch_size,
+    )
+
+
+def iter_firefox_history(
+    cursors: Optional[Dict[str, float]] = None,
+    batch_size: int = BATCH_SIZE,
+    aggregate: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> Iterator[List[Visit]]:
+    for profile, places_db in list_firefox_profiles():
+        yield from iter_firefox_profile_history(
+            profile, places_db, cursors, batch_size, aggregate, since, until, limit
         )
-        rows = cursor.fetchall()
-        conn.close()
 
-        temp_db_path.unlink(missing_ok=True)
 
-        for url, visit_date in rows:
-            visit_time = datetime(1970, 1, 1) + timedelta(microseconds=visit_date)
-            history.append({"url": url, "visit_time": visit_time, "browser": "firefox"})
-    return history
+def iter_brave_history(
+    cursors: Optional[Dict[str, float]] = None,
+    batch_size: int = BATCH_SIZE,
+    aggregate: bool = False,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> Iterator[List[Visit]]:
+    return iter_chromium_history(
+        "brave", cursors, batch_size, aggregate, since, until, limit
+    )
+
+
+def collect(batches: Iterator[List[Visit]]) -> List[Visit]:
+    return [visit for batch in batches for visit in batch]
+
+
+def fetch_safari_history(
+    cursors: Optional[Dict[str, float]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> List[Visit]:
+    return collect(iter_safari_history(cursors, since=since, until=until, limit=limit))
+
+
+def fetch_chrome_history(
+    cursors: Optional[Dict[str, float]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> List[Visit]:
+    return collect(iter_chrome_history(cursors, since=since, until=until, limit=limit))
+
+
+def fetch_firefox_profile_history(
+    profile: str,
+    places_db: str,
+    cursors: Optional[Dict[str, float]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> List[Visit]:
+    return collect(
+        iter_firefox_profile_history(
+            profile, places_db, cursors, since=since, until=until, limit=limit
+        )
+    )
+
+
+def fetch_firefox_history(
+    cursors: Optional[Dict[str, float]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> List[Visit]:
+    return collect(iter_firefox_history(cursors, since=since, until=until, limit=limit))
 
 
-def fetch_brave_history() -> List[Dict]:
-    db_paths = {
-        "Darwin": os.path.expanduser(
-            "~/Library/Application Support/BraveSoftware/Brave-Browser/Default/History"
-        ),
-        "Linux": os.path.expanduser(
-            "~/.config/BraveSoftware/Brave-Browser/Default/History"
-        ),
+def fetch_brave_history(
+    cursors: Optional[Dict[str, float]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> List[Visit]:
+    return collect(iter_brave_history(cursors, since=since, until=until, limit=limit))
+
+
+def fetch_chromium_history(
+    browser: str,
+    cursors: Optional[Dict[str, float]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> List[Visit]:
+    return collect(
+        iter_chromium_history(browser, cursors, since=since, until=until, limit=limit)
+    )
+
+
+def list_history_sources(
+    only: Optional[Collection[str]] = None,
+) -> List[Tuple[str, str, Callable]]:
+    """
+    Lists the independent history sources: Safari, and one per profile of Firefox
+    and of the Chromium-family browsers.
+
+    Args:
+        only (Optional[Collection[str]]): If given, the keys of the sources to list.
+
+    Returns:
+        List[Tuple[str, str, Callable]]: The source names, their keys (as used for
+            cursors) and their batch iterators, each taking the cursors mapping, the
+            batch size, the aggregate flag and the since, until and limit bounds
+            of `iter_combined_history` as arguments.
+    """
+    sources = [("Safari", "safari", iter_safari_history)]
+    for browser, profile, history_db in list_chromium_profiles():
+        name = CHROMIUM_BROWSERS[browser][0]
+        sources.append(
+            (
+                name if profile == "Default" else f"{name} ({profile})",
+                get_chromium_source_key(browser, profile),
+                partial(iter_chromium_profile_history, browser, profile, history_db),
+            )
+        )
+    for profile, places_db in list_firefox_profiles():
+        sources.append(
+            (
+                f"Firefox ({profile})",
+                f"firefox:{profile}",
+                partial(iter_firefox_profile_history, profile, places_db),
+            )
+        )
+    if only is not None:
+        sources = [source for source in sources if source[1] in only]
+    return sources
+
+
+def list_source_databases() -> Dict[str, str]:
+    """
+    Lists the existing history databases.
+
+    Returns:
+        Dict[str, str]: The database paths, keyed by source key.
+    """
+    db_paths = {"safari": get_platform_path(SAFARI_DB_PATHS)}
+    for browser, profile, history_db in list_chromium_profiles():
+        db_paths[get_chromium_source_key(browser, profile)] = history_db
+    # Firefox profiles are listed without printing when none exist, as this is
+    # called repeatedly
+    profiles_path = get_platform_path(FIREFOX_PROFILES_PATHS)
+    if profiles_path and os.path.isdir(profiles_path):
+        for profile, places_db in list_firefox_profiles():
+            db_paths[f"firefox:{profile}"] = places_db
+    return {
+        key: db_path
+        for key, db_path in db_paths.items()
+        if db_path and os.path.exists(db_path)
     }
 
-    brave_profile_path = db_paths.get(platform.system())
-    if not brave_profile_path or not os.path.exists(brave_profile_path):
-        print("brave profile directory not found.")
-        return []
 
-    # Copying is necessary because databases are locked
-    # Copies are intentionally outside syftbox, but we can process them locally
-    temp_db_path = Path("~/.tmp/brave_places.sqlite").expanduser()
-    shutil.copy(brave_profile_path, temp_db_path)
+def list_history_databases() -> List[str]:
+    """
+    Lists the paths of the existing history databases of all sources, e.g. to
+    watch them for changes.
+    """
+    return list(list_source_databases().values())
 
-    conn = sqlite3.connect(temp_db_path)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT url,last_visit_time FROM urls ORDER BY last_visit_time DESC
+
+def get_source_fingerprints() -> Dict[str, List]:
     """
-    )
-    rows = cursor.fetchall()
-    conn.close()
-    ""
-    temp_db_path.unlink(missing_ok=True)
-    history = []
-    print(rows)
-    for data in rows:
-        (url, visit_time) = data
-        visit_time = datetime(1601, 1, 1) + timedelta(microseconds=visit_time)
-        history.append({"url": url, "visit_time": visit_time, "browser": "brave"})
-    return history
-
-
-def fetch_combined_history() -> List[Dict]:
-    temp_folder = Path("~/.tmp").expanduser()
-    os.makedirs(temp_folder, exist_ok=True)
+    Returns a cheap fingerprint of every source: the modification time and size of
+    its database and of its WAL or journal file.
+
+    A source whose fingerprint is the same as in the previous run has no new visits
+    and doesn't need to be read. Only file metadata is read, so this is cheap even
+    for large or locked databases.
+
+    Returns:
+        Dict[str, List]: JSON-serializable fingerprints, keyed by source key.
+    """
+    return {
+        key: [
+            [path.name, *stat] if stat else [path.name, None]
+            for path, stat in get_file_stats(get_watched_paths([db_path])).items()
+        ]
+        for key, db_path in list_source_databases().items()
+    }
+
+
+def get_changed_sources(
+    fingerprints: Dict[str, List], previous: Dict[str, List]
+) -> Set[str]:
+    """
+    Returns the keys of the sources whose fingerprint changed since `previous`.
+    """
+    return {
+        key
+        for key, fingerprint in fingerprints.items()
+        if previous.get(key) != fingerprint
+    }
+
+
+def iter_history_concurrently(
+    cursors: Optional[Dict[str, float]] = None,
+    max_workers: Optional[int] = None,
+    batch_size: int = BATCH_SIZE,
+    aggregate: bool = False,
+    only: Optional[Collection[str]] = None,
+    completed: Optional[Set[str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> Iterator[List[Visit]]:
+    """
+    Reads all history sources in a thread pool and yields their batches as they
+    arrive.
+
+    SQLite releases the GIL while it runs a query, so the total time is bounded by
+    the slowest source. Every source updates its own cursor key only, and locked
+    databases are copied into a private temporary folder, so tasks never collide.
+    A source that fails makes the iteration raise its error once the batches
+    already queued have been yielded, as when reading sources one at a time: the
+    caller then publishes nothing and saves no cursor, so the next run reads the
+    source again without counting any visit twice.
+    Batches go through a bounded queue: producers wait for the consumer, so memory
+    stays bounded as well.
+
+    Args:
+        cursors (Optional[Dict[str, float]]): See `fetch_combined_history`.
+        max_workers (Optional[int]): The size of the thread pool, defaults to one
+            thread per source.
+        batch_size (int): The number of visits per batch.
+        aggregate (bool): See `iter_combined_history`.
+        only (Optional[Collection[str]]): See `iter_combined_history`.
+        completed (Optional[Set[str]]): See `iter_combined_history`.
+        since (Optional[datetime]): See `iter_combined_history`.
+        until (Optional[datetime]): See `iter_combined_history`.
+        limit (Optional[int]): See `iter_combined_history`.
+
+    Yields:
+        List[Visit]: Batches of visits, interleaved across sources.
+    """
+    sources = list_history_sources(only)
+    if not sources:
+        return
+    batches = queue.Queue(maxsize=2 * len(sources))
+    stop = threading.Event()
+    source_done = object()
+
+    def put(item) -> None:
+        # Give up if the consumer went away, instead of blocking forever
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def produce(name: str, key: str, iter_source: Callable) -> None:
+        count = 0
+        try:
+            # Closed in this thread, which owns the SQLite connection, when the
+            # consumer stops early
+            with closing(
+                iter_source(cursors, batch_size, aggregate, since, until, limit)
+            ) as source_batches:
+                for batch in get_run_metrics().timed_batches(key, source_batches):
+                    if stop.is_set():
+                        return
+                    count += len(batch)
+                    put(batch)
+            print(f"{name} history: {count} items")
+            if completed is not None:
+                completed.add(key)
+        except Exception as e:
+            print(f"Error fetching {name} history: {str(e)}")
+            put(e)
+        finally:
+            put(source_done)
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(sources)) as executor:
+        for name, key, iter_source in sources:
+            executor.submit(produce, name, key, iter_source)
+        try:
+            pending = len(sources)
+            while pending:
+                item = batches.get()
+                if item is source_done:
+                    pending -= 1
+                    continue
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+
+
+def iter_combined_history(
+    cursors: Optional[Dict[str, float]] = None,
+    concurrent: bool = False,
+    max_workers: Optional[int] = None,
+    batch_size: int = BATCH_SIZE,
+    aggregate: bool = False,
+    only: Optional[Collection[str]] = None,
+    completed: Optional[Set[str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: Optional[int] = None,
+) -> Iterator[List[Visit]]:
+    """
+    Streams the history of every supported browser in batches.
+
+    Args:
+        cursors (Optional[Dict[str, float]]): See `fetch_combined_history`.
+        concurrent (bool): Read all browsers and profiles in parallel.
+        max_workers (Optional[int]): The thread pool size in concurrent mode.
+        batch_size (int): The number of visits per batch.
+        aggregate (bool): Group the visits by URL in SQL. Each record then stands
+            for all the new visits of a URL, with their "visit_count" and the
+            "first_visit_time" and last "visit_time" among them.
+        only (Optional[Collection[str]]): If given, the keys of the sources to read,
+            e.g. those whose fingerprint changed; the others are skipped entirely.
+        completed (Optional[Set[str]]): If given, the keys of the sources read to
+            the end without error are added to it.
+        since (Optional[datetime]): If given, only the visits from this time on
+            are read, e.g. the last 7 days. Naive datetimes are in UTC.
+        until (Optional[datetime]): If given, only the visits before this time are
+            read.
+        limit (Optional[int]): If given, only the newest `limit` visits, or URLs
+            when aggregated, of each source are read. The cursors then skip the
+            older visits left out.
+
+    Yields:
+        List[Visit]: Batches of visits.
+    """
+    if concurrent:
+        yield from iter_history_concurrently(
+            cursors,
+            max_workers,
+            batch_size,
+            aggregate,
+            only,
+            completed,
+            since,
+            until,
+            limit,
+        )
+        return
+
+    for name, key, iter_source in list_history_sources(only):
+        print(f"Fetching {name} history...")
+        count = 0
+        source_batches = iter_source(
+            cursors, batch_size, aggregate, since, until, limit
+        )
+        for batch in get_run_metrics().timed_batches(key, source_batches):
+            count += len(batch)
+            yield batch
+        print(f"{name} history: {count} items")
+        if completed is not None:
+            completed.add(key)
+
+
+def fetch_history_concurrently(
+    cursors: Optional[Dict[str, float]] = None, max_workers: Optional[int] = None
+) -> List[Visit]:
+    return collect(iter_history_concurrently(cursors, max_workers))
+
+
+def fetch_combined_history(
+    cursors: Optional[Dict[str, float]] = None,
+    concurrent: bool = False,
+    max_workers: Optional[int] = None,
+) -> List[Visit]:
+    """
+    Fetches the history of every supported browser.
+
+    Args:
+        cursors (Optional[Dict[str, float]]): Per-source high-water marks (last seen
+            visit time per browser and profile). When given, only visits newer than
+            the stored mark are returned and the marks are advanced in place, so the
+            caller can persist them once the new visits have been processed.
+            When None, the whole history is read.
+        concurrent (bool): Fetch all browsers and profiles in parallel.
+        max_workers (Optional[int]): The thread pool size in concurrent mode.
+
+    Returns:
+        List[Visit]: The visits of all browsers.
+    """
+    if concurrent:
+        print("Fetching browser histories concurrently...")
+        return fetch_history_concurrently(cursors, max_workers)
 
     print("Fetching Safari history...")
-    safari_history = fetch_safari_history()
+    safari_history = fetch_safari_history(cursors)
     print(f"Safari history: {len(safari_history)} items")
 
     print("\nFetching Chrome history...")
-    chrome_history = fetch_chrome_history()
+    chrome_history = fetch_chrome_history(cursors)
     print(f"Chrome history: {len(chrome_history)} items")
 
     print("\nFetching Firefox history...")
-    firefox_history = fetch_firefox_history()
+    firefox_history = fetch_firefox_history(cursors)
     print(f"Firefox history: {len(firefox_history)} items")
 
     print("\nFetching Brave history...")
-    brave_history = fetch_brave_history()
+    brave_history = fetch_brave_history(cursors)
     print(f"Brave history: {len(brave_history)} items")
 
+    other_history = []
+    for browser in ["chromium", "edge", "vivaldi"]:
+        if not list_chromium_profiles([browser]):
+            continue
+        name = CHROMIUM_BROWSERS[browser][0]
+        print(f"\nFetching {name} history...")
+        history = fetch_chromium_history(browser, cursors)
+        print(f"{name} history: {len(history)} items")
+        other_history += history
+
     print("\nSafari sample history:", safari_history[:5])
     print("Chrome sample history:", chrome_history[:5])
     print("Firefox sample history:", firefox_history[:5])
     print("Brave sample history:", brave_history[:5])
-    combined_history = safari_history + chrome_history + firefox_history + brave_history
+    combined_history = (
+        safari_history
+        + chrome_history
+        + firefox_history
+        + brave_history
+        + other_history
+    )
     return combined_history
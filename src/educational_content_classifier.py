@@ -1,61 +1,107 @@
+import codecs
+import hashlib
 import re
-from urllib.parse import parse_qs, urlparse
+from html.parser import HTMLParser
+from pathlib import Path
+from urllib.parse import ParseResult, parse_qs, urlparse
 
 import requests
 from bs4 import BeautifulSoup
-from typing import Optional, Dict
-from functools import reduce
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+# Academic domain suffixes, matched label by label from the top-level domain.
+# "??" stands for any two-letter country code and "uni-*" for any label starting
+# with "uni-". A suffix only matches when preceded by at least one more label.
+ACADEMIC_SUFFIXES = [
+    # United States
+    "edu",
+    # International academic domains: .ac.uk, .ac.jp, .ac.nz, .ac.kr, etc.
+    "ac.??",
+    # European academic domains
+    "uni-*.de",  # German universities
+    "univ-*.fr",  # French universities
+    "uni-*.at",  # Austrian universities
+    "uni-*.ch",  # Swiss universities
+    "universitet.dk",  # Danish universities
+    "universiteit.nl",  # Dutch universities
+]
+
+# Academic patterns that can appear anywhere in the domain
+ACADEMIC_INFIX_PATTERN = re.compile(
+    "|".join(
+        [
+            r"\.edu\.",  # .edu.au, .edu.cn, .edu.br, and other .edu variants
+            # Common university URL patterns
+            r"university\.",
+            r"\.uni\.",
+            r"\.college\.",
+            r"\.institute\.",
+            r"\.school\.",
+        ]
+    )
+)
+
+COUNTRY_CODE_PATTERN = re.compile(r"[a-z]{2}")
+SUFFIX_END = object()
+
+
+def build_suffix_trie(suffixes: List[str]) -> Dict:
+    """
+    Builds a trie of domain suffixes keyed by their labels in reverse order.
+    """
+    trie = {}
+    for suffix in suffixes:
+        node = trie
+        for label in reversed(suffix.split(".")):
+            node = node.setdefault(label, {})
+        node[SUFFIX_END] = True
+    return trie
+
+
+ACADEMIC_SUFFIX_TRIE = build_suffix_trie(ACADEMIC_SUFFIXES)
+
+
+def get_label_keys(label: str) -> List[str]:
+    """
+    Returns the trie keys a domain label can match: itself and its wildcards.
+    """
+    keys = [label]
+    if COUNTRY_CODE_PATTERN.fullmatch(label):
+        keys.append("??")
+    prefix, dash, rest = label.partition("-")
+    if dash and rest:
+        keys.append(prefix + "-*")
+    return keys
+
+
+def has_suffix(trie: Dict, domain: str) -> bool:
+    """
+    Checks if a domain ends with one of the suffixes of a trie built with
+    `build_suffix_trie`, in a single pass over its labels.
+    """
+    labels = domain.split(".")
+    nodes = [trie]
+    # The first label is never part of the suffix: a suffix must follow a dot
+    for label in reversed(labels[1:]):
+        nodes = [
+            node[key] for node in nodes for key in get_label_keys(label) if key in node
+        ]
+        if not nodes:
+            return False
+        if any(SUFFIX_END in node for node in nodes):
+            return True
+    return False
 
 
 def is_educational_domain(domain: str) -> bool:
     """
     Checks if a domain is educational based on TLD and common patterns.
     """
-    edu_patterns = [
-        # United States
-        r"\.edu$",
-        # International academic domains
-        r"\.edu\.[a-z]{2}$",  # .edu.au, .edu.uk, etc.
-        r"\.ac\.[a-z]{2}$",  # .ac.uk, .ac.jp, etc.
-        r"\.edu\.",  # Catch other .edu variants
-        # Country-specific academic domains
-        r"\.ac\.jp$",  # Japan
-        r"\.ac\.uk$",  # United Kingdom
-        r"\.ac\.nz$",  # New Zealand
-        r"\.ac\.za$",  # South Africa
-        r"\.edu\.au$",  # Australia
-        r"\.edu\.cn$",  # China
-        r"\.edu\.hk$",  # Hong Kong
-        r"\.edu\.sg$",  # Singapore
-        r"\.edu\.my$",  # Malaysia
-        r"\.edu\.in$",  # India
-        r"\.edu\.br$",  # Brazil
-        r"\.edu\.mx$",  # Mexico
-        r"\.edu\.ar$",  # Argentina
-        r"\.edu\.es$",  # Spain
-        r"\.edu\.pl$",  # Poland
-        r"\.edu\.ru$",  # Russia
-        r"\.edu\.tr$",  # Turkey
-        r"\.ac\.ir$",  # Iran
-        r"\.ac\.kr$",  # South Korea
-        r"\.ac\.th$",  # Thailand
-        r"\.ac\.id$",  # Indonesia
-        # European academic domains
-        r"\.uni-[^.]+\.de$",  # German universities
-        r"\.univ-[^.]+\.fr$",  # French universities
-        r"\.uni-[^.]+\.at$",  # Austrian universities
-        r"\.uni-[^.]+\.ch$",  # Swiss universities
-        r"\.universitet\.dk$",  # Danish universities
-        r"\.universiteit\.nl$",  # Dutch universities
-        # Common university URL patterns
-        r"university\.",
-        r"\.uni\.",
-        r"\.college\.",
-        r"\.institute\.",
-        r"\.school\.",
-    ]
-
-    return any(re.search(pattern, domain.lower()) for pattern in edu_patterns)
+    domain = domain.lower()
+    return has_suffix(ACADEMIC_SUFFIX_TRIE, domain) or bool(
+        ACADEMIC_INFIX_PATTERN.search(domain)
+    )
 
 
 def is_research_repository(domain: str) -> bool:
@@ -120,148 +166,182 @@ def is_github_repo(url: str) -> bool:
         return False
 
 
-def classify_url(url: str):
-    url_lower = url.lower()
+def get_rules_version() -> str:
+    """
+    Returns a hash of the classification rules, i.e. of this module's source.
 
-    parsed = urlparse(url)
+    Cached classifications are tagged with it, so any change to the rules
+    invalidates them.
+    """
+    return hashlib.sha256(Path(__file__).read_bytes()).hexdigest()
+
+
+EDUCATIONAL_PLATFORMS = {
+    "coursera.org": "online_course",
+    "udemy.com": "online_course",
+    "edx.org": "online_course",
+    "khanacademy.org": "online_course",
+    "udacity.com": "online_course",
+    "skillshare.com": "online_course",
+    "pluralsight.com": "online_course",
+    "linkedin.com/learning": "online_course",
+    "codecademy.com": "online_course",
+    "brilliant.org": "online_course",
+    "duolingo.com": "online_course",
+    "canvas.net": "lms",
+    "blackboard.com": "lms",
+    "moodle.org": "lms",
+    "youtube.com": "video_platform",
+    "youtu.be": "video_platform",
+    "teachertube.com": "video_platform",
+}
+
+TUTORIAL_PATTERNS = [
+    r"/tutorial",
+    r"/learn",
+    r"/course",
+    r"/lesson",
+    r"/documentation",
+    r"/workshop",
+    r"/training",
+    r"/lecture",
+    r"/class",
+    r"/syllabus",
+    r"/curriculum",
+    r"/mooc",
+    r"/resources",
+    r"/study",
+    r"/teach",
+    r"/explained",
+    r"/introduction",
+    r"/basics",
+    r"/degree",
+    r"/assignment",
+    r"/practice",
+    r"/exercise",
+    r"/problem",
+    r"/solution",
+    r"/example",
+    r"/demo",
+    r"/showcase",
+    r"/walkthrough",
+    r"/step-by-step",
+    r"/crash-course",
+]
+
+EDUCATIONAL_KEYWORDS = [
+    "tutorial",
+    "learn",
+    "course",
+    "lesson",
+    "lecture",
+    "educational",
+    "teaching",
+    "explained",
+    "introduction",
+    "guide",
+    "how to",
+    "basics",
+    "fundamentals",
+    "principles",
+    "crash course",
+    "for beginners",
+    "101",
+    "masterclass",
+    "workshop",
+    "training",
+    "education",
+    "walkthrough",
+    "step by step",
+    "introduction to",
+    "getting started",
+    "complete guide",
+    "deep dive",
+    "explanation",
+    "understand",
+    "concept",
+    "theory",
+    "practice",
+    "example",
+    "demonstration",
+    "review",
+]
+
+EDUCATIONAL_CHANNELS = [
+    "crash course",
+    "khan academy",
+    "mit",
+    "stanford",
+    "harvard",
+    "ted-ed",
+    "vsauce",
+    "3blue1brown",
+    "codecademy",
+    "freecodecamp",
+    "coursera",
+]
+
+
+def is_educational_video(domain: str, url_lower: str, query: Dict) -> bool:
+    if "youtube.com" in domain or "youtu.be" in domain:
+        if "/playlist" in url_lower and "learning" in url_lower:
+            return True
+
+        if "/c/" in url_lower or "/channel/" in url_lower:
+            return any(channel in url_lower for channel in EDUCATIONAL_CHANNELS)
+
+        video_title = " ".join(query.get("title", []) + query.get("v", []))
+        return any(keyword in video_title.lower() for keyword in EDUCATIONAL_KEYWORDS)
+
+    return False
+
+
+def get_domain(parsed: ParseResult) -> str:
     domain = parsed.netloc.lower()
-    query = parse_qs(parsed.query)
-
     if domain.startswith("www."):
         domain = domain[4:]
+    return domain
 
-    educational_platforms = {
-        "coursera.org": "online_course",
-        "udemy.com": "online_course",
-        "edx.org": "online_course",
-        "khanacademy.org": "online_course",
-        "udacity.com": "online_course",
-        "skillshare.com": "online_course",
-        "pluralsight.com": "online_course",
-        "linkedin.com/learning": "online_course",
-        "codecademy.com": "online_course",
-        "brilliant.org": "online_course",
-        "duolingo.com": "online_course",
-        "canvas.net": "lms",
-        "blackboard.com": "lms",
-        "moodle.org": "lms",
-        "youtube.com": "video_platform",
-        "youtu.be": "video_platform",
-        "teachertube.com": "video_platform",
-    }
 
-    tutorial_patterns = [
-        r"/tutorial",
-        r"/learn",
-        r"/course",
-        r"/lesson",
-        r"/documentation",
-        r"/workshop",
-        r"/training",
-        r"/lecture",
-        r"/class",
-        r"/syllabus",
-        r"/curriculum",
-        r"/mooc",
-        r"/resources",
-        r"/study",
-        r"/teach",
-        r"/explained",
-        r"/introduction",
-        r"/basics",
-        r"/degree",
-        r"/assignment",
-        r"/practice",
-        r"/exercise",
-        r"/problem",
-        r"/solution",
-        r"/example",
-        r"/demo",
-        r"/showcase",
-        r"/walkthrough",
-        r"/step-by-step",
-        r"/crash-course",
-    ]
-
-    educational_keywords = [
-        "tutorial",
-        "learn",
-        "course",
-        "lesson",
-        "lecture",
-        "educational",
-        "teaching",
-        "explained",
-        "introduction",
-        "guide",
-        "how to",
-        "basics",
-        "fundamentals",
-        "principles",
-        "crash course",
-        "for beginners",
-        "101",
-        "masterclass",
-        "workshop",
-        "training",
-        "education",
-        "walkthrough",
-        "step by step",
-        "introduction to",
-        "getting started",
-        "complete guide",
-        "deep dive",
-        "explanation",
-        "understand",
-        "concept",
-        "theory",
-        "practice",
-        "example",
-        "demonstration",
-        "review",
-    ]
-
-    def is_educational_video(url_lower, query):
-        if "youtube.com" in domain or "youtu.be" in domain:
-            if "/playlist" in url_lower and "learning" in url_lower:
-                return True
-
-            if "/c/" in url_lower or "/channel/" in url_lower:
-                educational_channels = [
-                    "crash course",
-                    "khan academy",
-                    "mit",
-                    "stanford",
-                    "harvard",
-                    "ted-ed",
-                    "vsauce",
-                    "3blue1brown",
-                    "codecademy",
-                    "freecodecamp",
-                    "coursera",
-                ]
-                return any(channel in url_lower for channel in educational_channels)
-
-            video_title = " ".join(query.get("title", []) + query.get("v", []))
-            return any(
-                keyword in video_title.lower() for keyword in educational_keywords
-            )
+def classify_host(domain: str) -> Tuple[Optional[str], bool]:
+    """
+    Runs the checks that only depend on the host of a URL.
 
-        return False
+    Args:
+        domain (str): The lowercase host, without its "www." prefix.
 
-    if domain in educational_platforms.keys():
+    Returns:
+        Tuple[Optional[str], bool]: The educational platform type of the host, if
+            any, and whether the host is an academic domain or research repository.
+    """
+    platform_type = None
+    if domain in EDUCATIONAL_PLATFORMS:
         platform_type = next(
-            (v for k, v in educational_platforms.items() if k in domain), None
+            (v for k, v in EDUCATIONAL_PLATFORMS.items() if k in domain), None
         )
-        if platform_type == "video_platform" and is_educational_video(url_lower, query):
+    is_academic = is_educational_domain(domain) or is_research_repository(domain)
+    return platform_type, is_academic
+
+
+def classify_parsed_url(
+    url: str, parsed: ParseResult, domain: str, host: Tuple[Optional[str], bool]
+) -> str:
+    url_lower = url.lower()
+    platform_type, is_academic = host
+
+    if platform_type is not None:
+        query = parse_qs(parsed.query)
+        if platform_type == "video_platform" and is_educational_video(
+            domain, url_lower, query
+        ):
             return "educational_video"
         else:
             return platform_type
 
-    if any(re.search(pattern, url_lower) for pattern in tutorial_patterns):
+    if any(re.search(pattern, url_lower) for pattern in TUTORIAL_PATTERNS):
         return "tutorial"
 
-    if is_educational_domain(domain) or is_research_repository(domain):
+    if is_academic:
         return "academic"
 
     if re.search(r"/research/", url_lower) or domain == "":
@@ -273,6 +353,41 @@ def classify_url(url: str):
     return "general"
 
 
+def classify_url(url: str):
+    parsed = urlparse(url)
+    domain = get_domain(parsed)
+    return classify_parsed_url(url, parsed, domain, classify_host(domain))
+
+
+def classify_urls(urls: Iterable[str]) -> List[Optional[str]]:
+    """
+    Classifies many URLs at once.
+
+    Every distinct URL is classified once, and the host-level checks (platform
+    lookup, academic domain and research repository) run once per distinct host.
+
+    Args:
+        urls (Iterable[str]): The URLs to classify, possibly with repetitions.
+
+    Returns:
+        List[Optional[str]]: The classification of each URL, in input order, or
+            None for the URLs that cannot be parsed.
+    """
+    urls = list(urls)
+    hosts = {}
+    classifications = {}
+    for url in dict.fromkeys(urls):
+        try:
+            parsed = urlparse(url)
+        except ValueError:
+            classifications[url] = None
+            continue
+        domain = get_domain(parsed)
+        if domain not in hosts:
+            hosts[domain] = classify_host(domain)
+        classifications[url] = classify_parsed_url(url, parsed, domain, hosts[domain])
+    return [classifications[url] for url in urls]
+
 
 def create_headers() -> Dict[str, str]:
     return {
@@ -299,9 +414,15 @@ def clean_title(title: str) -> str:
     return " ".join(re.sub(r"[\n\r\t]", "", title).split()).strip()
 
 
-def fetch_webpage(url: str, headers: Dict[str, str]) -> Optional[str]:
+def fetch_webpage(
+    url: str,
+    headers: Dict[str, str],
+    session: Optional[requests.Session] = None,
+    timeout: float = 10,
+) -> Optional[str]:
     try:
-        response = requests.get(url, headers=headers, timeout=10)
+        get = session.get if session is not None else requests.get
+        response = get(url, headers=headers, timeout=timeout)
         response.raise_for_status()
         return response.text
     except requests.RequestException:
@@ -337,13 +458,151 @@ def extract_title(soup: Optional[BeautifulSoup]) -> Optional[str]:
     return None
 
 
-def get_webpage_title(url: str) -> Dict[str, Optional[str]]:
-    pipeline = [
-        lambda url_parsed: fetch_webpage(url, create_headers()),
-        parse_html,
-        extract_title,
-    ]
+# Bytes of a page read at most to find its title, and size of the chunks read
+MAX_TITLE_BYTES = 128 * 1024
+TITLE_CHUNK_SIZE = 8 * 1024
+
+# Elements without an end tag, which don't nest anything
+VOID_ELEMENTS = set(
+    "area base br col embed hr img input link meta source track wbr".split()
+)
+
+
+class TitleParser(HTMLParser):
+    """
+    Incrementally finds the title of a page, the way `extract_title` does: the
+    `<title>`, else the `og:title` or `twitter:title` meta tag, else the first
+    `<h1>`.
+
+    Like BeautifulSoup's `.string`, a `<title>` or `<h1>` only counts if its content
+    is a single string, possibly wrapped in one element. `done` is set as soon as
+    the rest of the page can't change the result: once the `<title>` is read, or
+    once the head is over and a meta title or the first `<h1>` is known.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.candidates = {}
+        self.head_done = False
+        self.done = False
+        # The "title" or "h1" element being read, if any
+        self.reading = None
+        self.depth = 0
+        self.children = 0
+        self.direct_text = False
+        self.text = []
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]):
+        if self.reading is not None:
+            if self.depth == 0:
+                self.children += 1
+            if tag not in VOID_ELEMENTS:
+                self.depth += 1
+            return
+
+        if tag == "meta":
+            attributes = dict(attrs)
+            content = attributes.get("content")
+            if attributes.get("property") == "og:title" and content:
+                self.candidates.setdefault("og:title", content)
+            if attributes.get("name") == "twitter:title" and content:
+                self.candidates.setdefault("twitter:title", content)
+        elif tag in {"body", "h1"}:
+            self.head_done = True
+
+        if tag in {"title", "h1"} and tag not in self.candidates:
+            self.reading = tag
+            self.depth = 0
+            self.children = 0
+            self.direct_text = False
+            self.text = []
+        self.update_done()
+
+    def handle_endtag(self, tag: str):
+        if self.reading is None:
+            if tag == "head":
+                self.head_done = True
+                self.update_done()
+            return
+        if self.depth > 0:
+            self.depth -= 1
+            return
+        if tag != self.reading:
+            return
+
+        # A single string, or a single element wrapping one, as `.string` requires
+        single = self.children == 0 or (self.children == 1 and not self.direct_text)
+        text = "".join(self.text)
+        self.candidates[self.reading] = text if single and text else None
+        self.reading = None
+        self.update_done()
+
+    def handle_data(self, data: str):
+        if self.reading is not None:
+            if self.depth == 0:
+                self.direct_text = True
+            self.text.append(data)
+
+    def update_done(self):
+        if self.candidates.get("title"):
+            self.done = True
+        elif self.head_done and "title" not in self.candidates:
+            # A <title> after the head is ignored, to keep reading bounded
+            self.candidates["title"] = None
+        if self.head_done and any(
+            self.candidates.get(key) for key in ["og:title", "twitter:title"]
+        ):
+            self.done = True
+        elif self.head_done and "h1" in self.candidates:
+            self.done = True
+
+    def get_title(self) -> Optional[str]:
+        for key in ["title", "og:title", "twitter:title", "h1"]:
+            if self.candidates.get(key):
+                return clean_title(self.candidates[key])
+        return None
+
+
+def fetch_title(
+    url: str,
+    headers: Dict[str, str],
+    session: Optional[requests.Session] = None,
+    timeout: float = 10,
+    max_bytes: int = MAX_TITLE_BYTES,
+) -> Optional[str]:
+    """
+    Fetches the title of a web page, reading the response in chunks and parsing
+    them as they arrive, until the title is found or `max_bytes` have been read.
+
+    Args:
+        url (str): The URL of the page.
+        headers (Dict[str, str]): The request headers, see `create_headers`.
+        session (Optional[requests.Session]): The session to send the request with.
+        timeout (float): The connect and read timeout, in seconds.
+        max_bytes (int): The number of (decompressed) bytes read at most.
+
+    Returns:
+        Optional[str]: The title, or None if the page could not be fetched or has no
+            title within its first `max_bytes`.
+    """
+    get = session.get if session is not None else requests.get
+    parser = TitleParser()
+    try:
+        with get(url, headers=headers, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(
+                errors="replace"
+            )
+            read = 0
+            for chunk in response.iter_content(TITLE_CHUNK_SIZE):
+                parser.feed(decoder.decode(chunk))
+                read += len(chunk)
+                if parser.done or read >= max_bytes:
+                    break
+    except (requests.RequestException, LookupError):
+        return None
+    return parser.get_title()
 
-    title = reduce(lambda x, f: f(x) if x is not None else None, pipeline, url)
 
-    return title
+def get_webpage_title(url: str) -> Optional[str]:
+    return fetch_title(url, create_headers())
@@ -0,0 +1,178 @@
+import re
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote
+
+# arXiv identifiers: new style "2101.00001" and old style "hep-th/9901001". The
+# version suffix is left out of the canonical ID, so all versions of a paper count
+# as the same paper.
+ARXIV_ID = r"(\d{4}\.\d{4,5}|[a-z][a-z\-]*(?:\.[a-z]{2})?/\d{7})(?:v\d+)?"
+
+# DOIs may contain slashes, so they run to the end of the path, minus a file
+# extension or a trailing slash
+DOI = r"(10\.\d{4,9}/.+?)(?:\.pdf|/)?"
+
+
+def prefixed(prefix: str) -> Callable[[re.Match], str]:
+    """
+    Returns a formatter of the canonical ID `<prefix>:<first group>` of a match.
+    """
+    return lambda match: f"{prefix}:{match.group(1)}"
+
+
+def format_doi(match: re.Match) -> str:
+    return f"doi:{unquote(match.group(1))}"
+
+
+# A rule matches the whole of a URL component, the lowercased path or the value of
+# a query parameter given as "query:<name>", and formats the canonical paper ID
+# from the match
+PaperRule = Tuple[str, re.Pattern, Callable[[re.Match], str]]
+
+
+def path_rule(pattern: str, format_id: Callable[[re.Match], str]) -> PaperRule:
+    return ("path", re.compile(pattern), format_id)
+
+
+def query_rule(name: str, pattern: str, prefix: str) -> PaperRule:
+    return (f"query:{name}", re.compile(f"({pattern})"), prefixed(prefix))
+
+
+ARXIV_RULES = [
+    path_rule(rf"/(?:abs|pdf|html|format|ps)/{ARXIV_ID}(?:\.pdf)?/?", prefixed("arxiv"))
+]
+DOI_RULES = [path_rule(rf"/{DOI}", format_doi)]
+NEURIPS_RULES = [
+    path_rule(
+        r"/paper(?:_files/paper)?/\d{4}/(?:hash|file)/([0-9a-f]{32})-[\w\-]+\.\w+",
+        prefixed("neurips"),
+    )
+]
+
+
+def virtual_conference_rules(conference: str) -> List[PaperRule]:
+    return [
+        path_rule(
+            r"/virtual/(\d{4}/(?:poster|oral|spotlight)/\d+)/?", prefixed(conference)
+        )
+    ]
+
+
+# Rules per host, without "www.". Only pages identifying a single paper yield an
+# ID: search, author and listing pages, and bibliographies such as dblp, don't.
+PAPER_RULES: Dict[str, List[PaperRule]] = {
+    "arxiv.org": ARXIV_RULES,
+    "export.arxiv.org": ARXIV_RULES,
+    "doi.org": DOI_RULES,
+    "dx.doi.org": DOI_RULES,
+    "dl.acm.org": [
+        path_rule(rf"/doi/(?:abs/|pdf/|full/|fullhtml/|epdf/)?{DOI}", format_doi)
+    ],
+    "link.springer.com": [
+        path_rule(rf"/(?:article|chapter|content/pdf)/{DOI}", format_doi)
+    ],
+    "ieeexplore.ieee.org": [
+        path_rule(r"/(?:abstract/)?document/(\d+)/?", prefixed("ieee")),
+        query_rule("arnumber", r"\d+", "ieee"),
+    ],
+    "openreview.net": [query_rule("id", r"[\w\-]+", "openreview")],
+    "researchgate.net": [
+        path_rule(r"/publication/(\d+)(?:_[^/]*)?/?", prefixed("researchgate"))
+    ],
+    "aclanthology.org": [
+        path_rule(
+            r"/(\d{4}\.[\w\-]+\.\d+|[a-z]\d{2}-\d{4})(?:\.pdf)?/?", prefixed("acl")
+        )
+    ],
+    "aclweb.org": [
+        path_rule(
+            r"/anthology/(?:[a-z]/[a-z]\d{2}/)?(\d{4}\.[\w\-]+\.\d+|[a-z]\d{2}-\d{4})"
+            r"(?:\.pdf)?/?",
+            prefixed("acl"),
+        )
+    ],
+    "proceedings.neurips.cc": NEURIPS_RULES,
+    "papers.nips.cc": NEURIPS_RULES,
+    "proceedings.mlr.press": [
+        path_rule(r"/(v\d+/[\w\-]+?)(?:\.html|\.pdf|/[\w\-]+\.pdf)", prefixed("pmlr"))
+    ],
+    "iclr.cc": virtual_conference_rules("iclr"),
+    "icml.cc": virtual_conference_rules("icml"),
+    "neurips.cc": virtual_conference_rules("neurips-virtual"),
+    "ojs.aaai.org": [
+        path_rule(
+            r"/index\.php/\w+/article/(?:view|download)/(\d+)(?:/\d+)?",
+            prefixed("aaai"),
+        )
+    ],
+    "ijcai.org": [
+        path_rule(r"/proceedings/(\d{4}/\d+)(?:\.pdf)?/?", prefixed("ijcai"))
+    ],
+    "usenix.org": [
+        path_rule(r"/conference/([\w\-]+/presentation/[\w\-]+)/?", prefixed("usenix"))
+    ],
+    "semanticscholar.org": [
+        path_rule(r"/paper/(?:[^/]+/)?([0-9a-f]{40})/?", prefixed("s2"))
+    ],
+}
+
+
+def get_paper_host(netloc: str) -> str:
+    """
+    Returns the host rules are keyed by: lowercase, without port and "www.".
+    """
+    host = netloc.lower().rpartition("@")[2].partition(":")[0]
+    return host[4:] if host.startswith("www.") else host
+
+
+def get_paper_id(netloc: str, path: str, query: str = "") -> Optional[str]:
+    """
+    Extracts the canonical ID of the research paper a URL points to.
+
+    Args:
+        netloc (str): The network location of the URL, e.g. "www.arxiv.org".
+        path (str): The path of the URL, e.g. "/pdf/2101.00001v2.pdf".
+        query (str): The query string of the URL, e.g. "id=abc" on OpenReview.
+
+    Returns:
+        Optional[str]: The canonical ID, e.g. "arxiv:2101.00001" or
+            "doi:10.1145/3368089.3409740", or None if the URL is not a paper.
+    """
+    rules = PAPER_RULES.get(get_paper_host(netloc))
+    if not rules:
+        return None
+
+    lower_path = path.lower()
+    params = None
+    for field, pattern, format_id in rules:
+        if field == "path":
+            match = pattern.fullmatch(lower_path)
+        else:
+            if params is None:
+                params = parse_qs(query)
+            values = params.get(field.partition(":")[2])
+            match = pattern.fullmatch(values[0]) if values else None
+        if match:
+            return format_id(match)
+    return None
+
+
+def count_papers(urls: Iterable[Dict]) -> Counter:
+    """
+    Counts the visits of each paper, in a single pass over the URLs.
+
+    Args:
+        urls (Iterable[Dict]): URL components, as returned by `split_url`, with the
+            paper ID extracted from the full URL in "paper_id" and the number of
+            visits each stands for in "visit_count".
+
+    Returns:
+        Counter: The number of visits per canonical paper ID, all the URLs of a
+            paper (versions, abstract and PDF pages, ...) counting together.
+    """
+    papers = Counter()
+    for url in urls:
+        paper_id = url.get("paper_id")
+        if paper_id is not None:
+            papers[paper_id] += url.get("visit_count", 1)
+    return papers
@@ -1,7 +1,46 @@
 from difflib import SequenceMatcher
+import itertools
 import json
+import os
+import shutil
+import tempfile
+import zlib
 from pathlib import Path
-from typing import List
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Union
+
+import numpy as np
+
+from src.utils import output_writer
+
+KEY_COMPONENTS = [
+    "scheme",
+    "subdomain",
+    "domain",
+    "tld",
+    "netloc",
+    "path",
+    "query",
+    "fragment",
+    "classification",
+]
+
+# Length of the character n-grams and number of hash buckets per URL component
+NGRAM_SIZE = 2
+FEATURE_DIM = 64
+
+# Number of rows of the first history scored per matrix product
+BATCH_SIZE = 2048
+
+# Length of the character shingles hashed by MinHash
+SHINGLE_SIZE = 3
+
+# Side of the square blocks of the score matrix computed by each worker
+TILE_SIZE = 4096
+
+# Bytes read at a time when streaming a history file
+READ_SIZE = 1 << 16
 
 
 def compare_urls(url1: dict, url2: dict) -> float:
@@ -9,26 +48,16 @@ def compare_urls(url1: dict, url2: dict) -> float:
     Compares two URLs based on their components and returns a similarity score.
 
     Args:
-        url1 (dict): The first URL components as a dictionary.
+        url1 (dict): The first URL components as a dictionary. Missing components,
+            such as the query `split_url` leaves out, compare as empty strings.
         url2 (dict): The second URL components as a dictionary.
 
     Returns:
         float: The average similarity score between the two URLs.
     """
-    key_components = [
-        "scheme",
-        "subdomain",
-        "domain",
-        "tld",
-        "netloc",
-        "path",
-        "query",
-        "fragment",
-        "classification",
-    ]
     results = []
-    for key in key_components:
-        value = SequenceMatcher(None, url1[key], url2[key]).ratio()
+    for key in KEY_COMPONENTS:
+        value = SequenceMatcher(None, url1.get(key) or "", url2.get(key) or "").ratio()
         results.append(value)
     # TODO: now equal weight is given to all components.
     # We can add weights to each component to give more importance to some components
@@ -36,28 +65,113 @@ def compare_urls(url1: dict, url2: dict) -> float:
     return avg_result
 
 
+def encode_component(value: str, dim: int = FEATURE_DIM) -> np.ndarray:
+    """
+    Encodes a string as a unit-norm vector of hashed character n-gram counts.
+
+    The vector has one extra slot, set only for empty strings, so that two empty
+    components score 1 and an empty and a non-empty one score 0, as with
+    `SequenceMatcher`.
+    """
+    vector = np.zeros(dim + 1, dtype=np.float32)
+    if not value:
+        vector[dim] = 1.0
+        return vector
+    # Pad so that single characters and word boundaries yield n-grams too
+    padded = f"^{value}$"
+    for i in range(max(1, len(padded) - NGRAM_SIZE + 1)):
+        ngram = padded[i : i + NGRAM_SIZE]
+        vector[zlib.crc32(ngram.encode()) % dim] += 1.0
+    return vector / np.linalg.norm(vector)
+
+
+def encode_urls(urls: List[dict], dim: int = FEATURE_DIM) -> np.ndarray:
+    """
+    Encodes URL components into fixed-width features.
+
+    Each component is encoded with `encode_component` and scaled so that the dot
+    product of two encoded URLs is the average cosine similarity of their
+    components.
+
+    Args:
+        urls (List[dict]): The URL components, as produced by `split_url`. Missing
+            components are treated as empty.
+        dim (int): The number of hash buckets per component.
+
+    Returns:
+        np.ndarray: A float32 matrix with one row per URL.
+    """
+    scale = np.float32(1 / np.sqrt(len(KEY_COMPONENTS)))
+    features = np.zeros((len(urls), len(KEY_COMPONENTS) * (dim + 1)), np.float32)
+    for row, url in enumerate(urls):
+        for column, key in enumerate(KEY_COMPONENTS):
+            start = column * (dim + 1)
+            features[row, start : start + dim + 1] = encode_component(
+                url.get(key) or "", dim
+            )
+    return features * scale
+
+
+def similarity_matrix(
+    features1: np.ndarray, features2: np.ndarray, batch_size: int = BATCH_SIZE
+) -> np.ndarray:
+    """
+    Computes the similarity scores between all pairs of encoded URLs.
+
+    Args:
+        features1 (np.ndarray): The first history, encoded with `encode_urls`.
+        features2 (np.ndarray): The second history, encoded with `encode_urls`.
+        batch_size (int): The number of rows of `features1` per matrix product.
+
+    Returns:
+        np.ndarray: A float32 matrix of shape (len(features1), len(features2)).
+    """
+    matrix = np.empty((len(features1), len(features2)), dtype=np.float32)
+    for start in range(0, len(features1), batch_size):
+        stop = start + batch_size
+        np.matmul(features1[start:stop], features2.T, out=matrix[start:stop])
+    # Rounding can push scores of identical URLs slightly above 1
+    return np.clip(matrix, 0.0, 1.0, out=matrix)
+
+
 def compare_browser_histories(
-    path_browser_history1: Path, path_browser_history2: Path
-) -> List[List[float]]:
+    path_browser_history1: Path,
+    path_browser_history2: Path,
+    mode: str = "vectorized",
+) -> Union[np.ndarray, List[List[float]]]:
     """
     Compares two browser histories and returns a matrix of similarity scores.
 
     Args:
         path_browser_history1 (Path): The path to the first browser history JSON file.
         path_browser_history2 (Path): The path to the second browser history JSON file.
+        mode (str): "vectorized" scores the cosine similarity of character n-gram
+            profiles of each URL component, computed with NumPy. "compat"
+            reproduces the original pairwise `compare_urls` scores, which is only
+            practical for a few thousand entries per history.
 
     Returns:
-        List[List[float]]:
-            A matrix of similarity scores between the URLs in the two browser histories.
+        Union[np.ndarray, List[List[float]]]:
+            A matrix of similarity scores between the URLs in the two browser
+            histories: a NumPy array in "vectorized" mode, nested lists in "compat"
+            mode.
     """
+    if mode not in {"vectorized", "compat"}:
+        raise ValueError(f"Unknown comparison mode: {mode}")
+
     print("Opening browser history files...")
     with open(path_browser_history1, "r") as file1:
         browser_history1 = json.load(file1)["browser_history"]
     with open(path_browser_history2, "r") as file2:
         browser_history2 = json.load(file2)["browser_history"]
 
-    matrix = []
     print("Comparing browser histories...")
+    if mode == "vectorized":
+        return similarity_matrix(
+            encode_urls(browser_history1), encode_urls(browser_history2)
+        )
+
+    matrix = []
     for entry1 in browser_history1:
         row = []
         for entry2 in browser_history2:
@@ -65,3 +179,282 @@ def compare_browser_histories(
             row.append(comparison)
         matrix.append(row)
     return matrix
+
+
+def get_shingles(url: dict) -> Set[str]:
+    """
+    Returns the character shingles of every component of a URL, tagged with the
+    component name so that e.g. a domain never matches a path.
+    """
+    shingles = set()
+    for key in KEY_COMPONENTS:
+        value = url.get(key) or ""
+        if len(value) <= SHINGLE_SIZE:
+            shingles.add(f"{key}:{value}")
+            continue
+        for i in range(len(value) - SHINGLE_SIZE + 1):
+            shingles.add(f"{key}:{value[i : i + SHINGLE_SIZE]}")
+    return shingles
+
+
+class MinHashLSHIndex:
+    """
+    Locality-sensitive hashing index to find the most similar URLs of a history.
+
+    URLs are summarized by MinHash signatures of their component shingles. The
+    signatures are cut into `bands` bands of `rows` values each, and two URLs
+    become candidates when any band matches exactly. More bands (or fewer rows
+    per band) raise the recall at the cost of more candidates to re-rank. The
+    candidates are then re-ranked exactly with `compare_urls`.
+
+    Example:
+        index = MinHashLSHIndex(bands=16, rows=4)
+        index.add(browser_history1)
+        matches = index.query_history(browser_history2, k=5)
+    """
+
+    def __init__(self, bands: int = 16, rows: int = 4, seed: int = 0):
+        self.bands = bands
+        self.rows = rows
+        rng = np.random.default_rng(seed)
+        num_perm = bands * rows
+        # Multiply-shift hash functions: h(x) = ((a * x + b) mod 2^64) >> 32
+        self.a = rng.integers(0, 2**64, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self.b = rng.integers(0, 2**64, size=num_perm, dtype=np.uint64)
+        self.buckets: List[Dict[bytes, List[int]]] = [
+            defaultdict(list) for _ in range(bands)
+        ]
+        self.urls: List[dict] = []
+
+    def signature(self, url: dict) -> np.ndarray:
+        shingle_hashes = np.array(
+            [zlib.crc32(shingle.encode()) for shingle in get_shingles(url)],
+            dtype=np.uint64,
+        )
+        hashes = (shingle_hashes[:, None] * self.a + self.b) >> np.uint64(32)
+        return hashes.min(axis=0)
+
+    def band_keys(self, url: dict) -> List[bytes]:
+        signature = self.signature(url)
+        return [
+            signature[band * self.rows : (band + 1) * self.rows].tobytes()
+            for band in range(self.bands)
+        ]
+
+    def add(self, urls: List[dict]) -> None:
+        """
+        Indexes URL components; their positions in the index follow insertion order.
+        """
+        for url in urls:
+            index = len(self.urls)
+            self.urls.append(url)
+            for band, key in enumerate(self.band_keys(url)):
+                self.buckets[band][key].append(index)
+
+    def candidates(self, url: dict) -> Set[int]:
+        candidates = set()
+        for band, key in enumerate(self.band_keys(url)):
+            candidates.update(self.buckets[band].get(key, ()))
+        return candidates
+
+    def query(self, url: dict, k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Finds the indexed URLs most similar to `url`.
+
+        Args:
+            url (dict): The URL components to look up.
+            k (int): The maximum number of matches to return.
+
+        Returns:
+            List[Tuple[int, float]]: The positions of the matches in the index and
+                their `compare_urls` scores, best first. Fewer than `k` matches are
+                returned when fewer candidates share a band with `url`.
+        """
+        scores = [
+            (index, compare_urls(url, self.urls[index]))
+            for index in self.candidates(url)
+        ]
+        scores.sort(key=lambda match: (-match[1], match[0]))
+        return scores[:k]
+
+    def query_history(
+        self, urls: List[dict], k: int = 5
+    ) -> List[List[Tuple[int, float]]]:
+        return [self.query(url, k) for url in urls]
+
+
+def find_similar_entries(
+    path_browser_history1: Path,
+    path_browser_history2: Path,
+    k: int = 5,
+    bands: int = 16,
+    rows: int = 4,
+) -> List[List[Tuple[int, float]]]:
+    """
+    Finds, for each URL of the second history, the most similar URLs of the first.
+
+    Unlike `compare_browser_histories`, the dense matrix is never computed: the
+    first history is indexed once with `MinHashLSHIndex` and only the candidates
+    it returns are scored.
+
+    Args:
+        path_browser_history1 (Path): The path to the browser history JSON file to
+            index.
+        path_browser_history2 (Path): The path to the browser history JSON file to
+            look up.
+        k (int): The maximum number of matches per URL.
+        bands (int): The number of LSH bands, see `MinHashLSHIndex`.
+        rows (int): The number of MinHash values per band.
+
+    Returns:
+        List[List[Tuple[int, float]]]: For each URL of the second history, the
+            positions in the first history of its best matches and their scores.
+    """
+    with open(path_browser_history1, "r") as file1:
+        browser_history1 = json.load(file1)["browser_history"]
+    with open(path_browser_history2, "r") as file2:
+        browser_history2 = json.load(file2)["browser_history"]
+
+    index = MinHashLSHIndex(bands=bands, rows=rows)
+    index.add(browser_history1)
+    return index.query_history(browser_history2, k)
+
+
+def iter_json_list(path: Path, key: str = "browser_history") -> Iterator:
+    """
+    Streams the entries of the `key` list of a JSON document one at a time, so
+    that the file is never loaded whole.
+
+    Args:
+        path (Path): The JSON file, e.g. a browser history saved by `save`.
+        key (str): The key of the list to read.
+
+    Yields:
+        The entries of the list.
+    """
+    with open(path, "r") as json_file:
+        yield from output_writer.iter_json_list(json_file, key, READ_SIZE)
+
+
+def encode_history_file(
+    path: Path, features_path: Path, batch_size: int = BATCH_SIZE
+) -> np.memmap:
+    """
+    Streams a browser history file into a memory-mapped matrix of URL features.
+
+    Args:
+        path (Path): The browser history JSON file.
+        features_path (Path): Where to write the raw float32 features.
+        batch_size (int): The number of entries encoded at a time.
+
+    Returns:
+        np.memmap: The read-only features, one row per entry, see `encode_urls`.
+    """
+    entries = iter_json_list(path)
+    num_rows = 0
+    with open(features_path, "wb") as features_file:
+        while True:
+            batch = list(itertools.islice(entries, batch_size))
+            if not batch:
+                break
+            features_file.write(encode_urls(batch).tobytes())
+            num_rows += len(batch)
+    width = len(KEY_COMPONENTS) * (FEATURE_DIM + 1)
+    if num_rows == 0:
+        return np.zeros((0, width), dtype=np.float32)
+    return np.memmap(features_path, np.float32, mode="r", shape=(num_rows, width))
+
+
+def compute_tile(
+    features1_path: str,
+    features2_path: str,
+    output_path: str,
+    rows: Tuple[int, int],
+    columns: Tuple[int, int],
+    width: int,
+) -> None:
+    """
+    Scores one block of the similarity matrix and writes it into the output file.
+
+    Runs in a worker process: every argument is a path or a shape, and the inputs
+    and the output are memory-mapped, so no matrix is sent between processes.
+    """
+    features1 = np.memmap(features1_path, np.float32, mode="r").reshape(-1, width)
+    features2 = np.memmap(features2_path, np.float32, mode="r").reshape(-1, width)
+    output = np.load(output_path, mmap_mode="r+")
+    output[rows[0] : rows[1], columns[0] : columns[1]] = similarity_matrix(
+        features1[rows[0] : rows[1]], features2[columns[0] : columns[1]]
+    )
+    output.flush()
+
+
+def compare_browser_histories_tiled(
+    path_browser_history1: Path,
+    path_browser_history2: Path,
+    output_path: Path,
+    tile_size: int = TILE_SIZE,
+    max_workers: Optional[int] = None,
+) -> np.memmap:
+    """
+    Compares two large browser histories without holding them or the score matrix
+    in memory.
+
+    Both files are streamed into memory-mapped feature matrices, and the score
+    matrix is split into tiles computed by a process pool. Each worker writes its
+    float32 tile directly into the memory-mapped output, a `.npy` file that can be
+    reopened with `np.load(output_path, mmap_mode="r")`. Scores are the same as
+    the "vectorized" mode of `compare_browser_histories`.
+
+    Args:
+        path_browser_history1 (Path): The path to the first browser history JSON file.
+        path_browser_history2 (Path): The path to the second browser history JSON file.
+        output_path (Path): Where to write the score matrix, as a `.npy` file.
+        tile_size (int): The side of the square tiles computed by each task.
+        max_workers (Optional[int]): The number of worker processes, defaults to
+            the number of CPUs.
+
+    Returns:
+        np.memmap: The read-only score matrix.
+    """
+    output_path = Path(output_path)
+    workspace = Path(tempfile.mkdtemp(dir=output_path.parent))
+    try:
+        print("Encoding browser history files...")
+        features1_path = workspace / "features1.f32"
+        features2_path = workspace / "features2.f32"
+        features1 = encode_history_file(path_browser_history1, features1_path)
+        features2 = encode_history_file(path_browser_history2, features2_path)
+        num_rows, num_columns = len(features1), len(features2)
+        width = features1.shape[1]
+        del features1, features2
+
+        output = np.lib.format.open_memmap(
+            output_path, mode="w+", dtype=np.float32, shape=(num_rows, num_columns)
+        )
+        del output
+
+        print("Comparing browser histories...")
+        tiles = [
+            ((i, min(i + tile_size, num_rows)), (j, min(j + tile_size, num_columns)))
+            for i in range(0, num_rows, tile_size)
+            for j in range(0, num_columns, tile_size)
+        ]
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    compute_tile,
+                    os.fspath(features1_path),
+                    os.fspath(features2_path),
+                    os.fspath(output_path),
+                    rows,
+                    columns,
+                    width,
+                )
+                for rows, columns in tiles
+            ]
+            for future in futures:
+                future.result()
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    return np.load(output_path, mmap_mode="r")
@@ -0,0 +1,132 @@
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.educational_content_classifier import create_headers, fetch_title
+from src.utils.persistent_cache import PersistentLRUCache
+
+MAX_WORKERS = 16
+MAX_PER_HOST = 2
+TIMEOUT = 10
+TITLE_TTL = 30 * 24 * 3600
+FAILURE_TTL = 24 * 3600
+
+
+def create_session(pool_size: int) -> requests.Session:
+    """
+    Creates a session keeping up to `pool_size` connections alive per host, so
+    that URLs of the same host reuse their connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def interleave_hosts(urls: Iterable[str]) -> List[str]:
+    """
+    Orders URLs round-robin across their hosts, so that the workers are spread over
+    hosts instead of all queueing behind the per-host limit of the first one.
+    """
+    by_host = defaultdict(list)
+    for url in urls:
+        by_host[urlparse(url).netloc].append(url)
+    return [url for group in zip_longest(*by_host.values()) for url in group if url]
+
+
+class TitleFetcher:
+    """
+    Fetches the titles of many web pages concurrently.
+
+    Pages are fetched by a bounded thread pool sharing a pooled keep-alive session,
+    with at most `max_per_host` requests in flight per host. Titles are cached with
+    their fetch time and refetched once older than `ttl` seconds; failures are
+    cached as None and retried after `failure_ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        cache: Optional[PersistentLRUCache] = None,
+        max_workers: int = MAX_WORKERS,
+        max_per_host: int = MAX_PER_HOST,
+        timeout: float = TIMEOUT,
+        ttl: float = TITLE_TTL,
+        failure_ttl: float = FAILURE_TTL,
+    ):
+        self.cache = cache
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.headers = create_headers()
+        self.session = create_session(max_workers)
+        self.host_slots = {}
+        self.host_slots_lock = threading.Lock()
+
+    def __enter__(self) -> "TitleFetcher":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.session.close()
+
+    def get_host_slot(self, host: str) -> threading.BoundedSemaphore:
+        with self.host_slots_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self.host_slots[host]
+
+    def get_cached(self, url: str) -> Optional[List]:
+        """
+        Returns the cached `[title, fetched_at]` entry of a URL, unless missing or
+        expired.
+        """
+        if self.cache is None:
+            return None
+        entry = self.cache.get(url)
+        if entry is None:
+            return None
+        (title, fetched_at) = entry
+        ttl = self.ttl if title is not None else self.failure_ttl
+        return entry if time.time() - fetched_at <= ttl else None
+
+    def fetch_title(self, url: str) -> Optional[str]:
+        with self.get_host_slot(urlparse(url).netloc):
+            return fetch_title(url, self.headers, self.session, self.timeout)
+
+    def fetch_titles(self, urls: Iterable[str]) -> Dict[str, Optional[str]]:
+        """
+        Fetches the titles of URLs, only requesting the distinct URLs whose title
+        is not cached or has expired.
+
+        Args:
+            urls (Iterable[str]): The URLs of the pages.
+
+        Returns:
+            Dict[str, Optional[str]]: The title of each URL, or None if the page
+                could not be fetched or has no title.
+        """
+        titles = {}
+        misses = []
+        for url in dict.fromkeys(urls):
+            entry = self.get_cached(url)
+            if entry is None:
+                misses.append(url)
+            else:
+                titles[url] = entry[0]
+
+        misses = interleave_hosts(misses)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for url, title in zip(misses, executor.map(self.fetch_title, misses)):
+                titles[url] = title
+                if self.cache is not None:
+                    self.cache.put(url, [title, time.time()])
+        return titles
@@ -35,3 +35,69 @@ class ConfigReader:
 
     def get_allow_top(self) -> bool:
         return self._config["API_INFO"].getboolean("ALLOW_TOP")
+
+    def get_full_rescan(self) -> bool:
+        return self._config["HISTORY"].getboolean("FULL_RESCAN")
+
+    def get_concurrent_fetch(self) -> bool:
+        return self._config["HISTORY"].getboolean("CONCURRENT_FETCH")
+
+    def get_aggregate_visits(self) -> bool:
+        return self._config["HISTORY"].getboolean("AGGREGATE_VISITS")
+
+    def get_window_days(self) -> float:
+        return float(self._config["HISTORY"]["WINDOW_DAYS"])
+
+    def get_classification_cache_size(self) -> int:
+        return int(self._config["CACHE"]["CLASSIFICATION_CACHE_SIZE"])
+
+    def get_hash_cache_size(self) -> int:
+        return int(self._config["CACHE"]["HASH_CACHE_SIZE"])
+
+    def get_daemon_mode(self) -> bool:
+        return self._config["DAEMON"].getboolean("DAEMON_MODE")
+
+    def get_daemon_debounce(self) -> float:
+        return float(self._config["DAEMON"]["DEBOUNCE"])
+
+    def get_daemon_poll_interval(self) -> float:
+        return float(self._config["DAEMON"]["POLL_INTERVAL"])
+
+    def get_save_metrics(self) -> bool:
+        return self._config["METRICS"].getboolean("SAVE_METRICS")
+
+    def get_profile_runs(self) -> bool:
+        return self._config["METRICS"].getboolean("PROFILE")
+
+    def get_title_cache_size(self) -> int:
+        return int(self._config["CACHE"]["TITLE_CACHE_SIZE"])
+
+    def get_fetch_titles(self) -> bool:
+        return self._config["TITLES"].getboolean("FETCH_TITLES")
+
+    def get_title_workers(self) -> int:
+        return int(self._config["TITLES"]["MAX_WORKERS"])
+
+    def get_title_workers_per_host(self) -> int:
+        return int(self._config["TITLES"]["MAX_WORKERS_PER_HOST"])
+
+    def get_title_timeout(self) -> float:
+        return float(self._config["TITLES"]["TIMEOUT"])
+
+    def get_title_ttl(self) -> float:
+        return float(self._config["TITLES"]["TTL"])
+
+    def get_output_format(self) -> str:
+        return self._config["OUTPUT"]["FORMAT"]
+
+    def get_output_compression(self) -> str:
+        return self._config["OUTPUT"]["COMPRESSION"]
+
+    def get_publish_mode(self) -> str:
+        return self._config["OUTPUT"]["PUBLISH_MODE"]
+
+    def get_max_segments(self) -> int:
+        return int(self._config["OUTPUT"]["MAX_SEGMENTS"])
+
+    def get_hash_counts(self) -> bool:
+        return self._config["OUTPUT"].getboolean("HASH_COUNTS")
@@ -0,0 +1,253 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from src.utils.output_writer import (
+    COMPRESSIONS,
+    FILE_EXTENSIONS,
+    OutputWriter,
+    get_timestamp,
+    iter_output_counts,
+    open_output_writer,
+    read_output,
+)
+
+# Bumped whenever the layout of the manifest changes
+MANIFEST_VERSION = 1
+
+
+def get_manifest_path(folder: Path, name: str) -> Path:
+    return folder / f"{name}.manifest.json"
+
+
+def get_delta_path(
+    folder: Path,
+    name: str,
+    kind: str,
+    sequence: int,
+    output_format: str = "json",
+    compression: str = "none",
+) -> Path:
+    """
+    Returns the path of a base snapshot or segment file, e.g.
+    `browser_history_enc.delta-000042.json`.
+
+    Args:
+        kind (str): "base" for a snapshot, "delta" for a segment.
+    """
+    path = folder / f"{name}.{kind}-{sequence:06d}{FILE_EXTENSIONS[output_format]}"
+    if compression == "gzip":
+        path = path.with_name(f"{path.name}.gz")
+    return path
+
+
+def load_manifest(folder: Path, name: str) -> Dict:
+    """
+    Loads the manifest listing the base snapshot and segments of an output.
+
+    A missing or unreadable manifest yields an empty one, without a base, which
+    makes the next run publish a new snapshot.
+
+    Returns:
+        Dict: The manifest, with "base" (None or {"sequence", "file"}), "segments"
+            (a list of {"sequence", "file", "entries"}) and "next_sequence".
+    """
+    manifest_path = get_manifest_path(folder, name)
+    manifest = {}
+    if manifest_path.exists():
+        try:
+            with open(manifest_path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            print(f"Unable to read manifest file: {manifest_path}")
+            manifest = {}
+    manifest.setdefault("base", None)
+    manifest.setdefault("segments", [])
+    manifest.setdefault("next_sequence", 1)
+    return manifest
+
+
+def save_manifest(folder: Path, name: str, manifest: Dict) -> None:
+    manifest_path = get_manifest_path(folder, name)
+    tmp_path = manifest_path.with_name(f".{manifest_path.name}.tmp")
+    manifest = {
+        **manifest,
+        "format_version": MANIFEST_VERSION,
+        "timestamp": get_timestamp(),
+    }
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+    os.replace(tmp_path, manifest_path)
+
+
+def list_published_files(folder: Path, name: str) -> List[str]:
+    """
+    Lists the files of an output published in delta mode: the base snapshot
+    followed by the segments, in sequence order.
+    """
+    manifest = load_manifest(folder, name)
+    files = [manifest["base"]] if manifest["base"] else []
+    files += sorted(manifest["segments"], key=lambda segment: segment["sequence"])
+    return [published["file"] for published in files]
+
+
+def iter_published(folder: Path, name: str, key: str) -> Iterator[Tuple[Any, int]]:
+    """
+    Streams every entry of an output published in delta mode as `(entry, count)`
+    pairs, see `iter_output_counts`.
+    """
+    for file_name in list_published_files(folder, name):
+        yield from iter_output_counts(folder / file_name, key)
+
+
+def read_published(folder: Path, name: str, key: str, counts: bool = False) -> List:
+    """
+    Reads every entry of an output published in delta mode: the base snapshot
+    followed by the segments, in sequence order.
+
+    Args:
+        folder (Path): The folder of the output files.
+        name (str): The name of the output, e.g. "browser_history_enc".
+        key (str): The key of the list of entries, e.g. "browser_history".
+        counts (bool): Whether to read `(entry, count)` pairs, see `read_output`.
+
+    Returns:
+        List: The published entries, one per visit unless `counts` is set.
+    """
+    entries = []
+    for file_name in list_published_files(folder, name):
+        entries.extend(read_output(folder / file_name, counts).get(key, []))
+    return entries
+
+
+def remove_delta_outputs(folder: Path, name: str) -> None:
+    """
+    Removes the manifest, base snapshots and segments of an output, e.g. when
+    switching back to publishing full files.
+    """
+    for kind in ["base", "delta"]:
+        for path in folder.glob(f"{name}.{kind}-*"):
+            path.unlink(missing_ok=True)
+    get_manifest_path(folder, name).unlink(missing_ok=True)
+
+
+class DeltaPublisher:
+    """
+    Publishes an output as a base snapshot plus small append-only segments.
+
+    Each run writes its new entries to a segment numbered with the next sequence
+    number, so the sync layer only uploads what changed since the previous run.
+    Once more than `max_segments` segments have accumulated, they are compacted
+    with the base into a new snapshot.
+
+    The manifest is the source of truth for readers: files are only listed in it
+    once fully written, and files it no longer lists are removed only after it has
+    been replaced, so a crash never makes entries appear twice or disappear.
+    """
+
+    def __init__(
+        self,
+        folder: Path,
+        name: str,
+        key: str,
+        output_format: str = "json",
+        compression: str = "none",
+        value_type: str = "string",
+        max_segments: int = 24,
+    ):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.folder = Path(folder)
+        self.name = name
+        self.key = key
+        self.output_format = output_format
+        self.compression = compression
+        self.value_type = value_type
+        self.max_segments = max_segments
+        self.manifest = load_manifest(self.folder, name)
+        self.writer: Optional[OutputWriter] = None
+        self.sequence: Optional[int] = None
+        self.snapshot = False
+
+    @property
+    def has_base(self) -> bool:
+        return self.manifest["base"] is not None
+
+    def open_writer(self, kind: str, sequence: int) -> OutputWriter:
+        path = get_delta_path(
+            self.folder, self.name, kind, sequence, self.output_format, self.compression
+        )
+        return open_output_writer(
+            path, self.key, self.output_format, self.compression, self.value_type
+        )
+
+    def open(self, snapshot: bool = False) -> OutputWriter:
+        """
+        Opens the writer of this run's entries, to be used as a context manager and
+        followed by `commit` once it has exited without error.
+
+        Args:
+            snapshot (bool): Whether the entries replace everything published so
+                far, e.g. after a full rescan, instead of being appended to it.
+
+        Returns:
+            OutputWriter: The writer of the new base snapshot or segment.
+        """
+        self.snapshot = snapshot
+        self.sequence = self.manifest["next_sequence"]
+        self.writer = self.open_writer("base" if snapshot else "delta", self.sequence)
+        return self.writer
+
+    def commit(self) -> None:
+        """
+        Lists the file written by this run in the manifest, compacting the
+        segments when there are too many of them.
+        """
+        obsolete = []
+        self.manifest["next_sequence"] = self.sequence + 1
+        published = {"sequence": self.sequence, "file": self.writer.path.name}
+        if self.snapshot:
+            obsolete = self.get_published_files()
+            self.manifest["base"] = published
+            self.manifest["segments"] = []
+        elif self.writer.count:
+            self.manifest["segments"].append(
+                {**published, "entries": self.writer.count}
+            )
+        else:
+            # Nothing new to publish: don't make the sync layer upload a new file
+            obsolete = [self.writer.path.name]
+
+        if len(self.manifest["segments"]) > self.max_segments:
+            obsolete += self.compact()
+
+        save_manifest(self.folder, self.name, self.manifest)
+        for file_name in obsolete:
+            (self.folder / file_name).unlink(missing_ok=True)
+
+    def get_published_files(self) -> List[str]:
+        files = [self.manifest["base"]] if self.has_base else []
+        return [published["file"] for published in files + self.manifest["segments"]]
+
+    def compact(self) -> List[str]:
+        """
+        Streams the base snapshot and all segments into a new base snapshot. The
+        formats storing counts are copied without expanding them.
+
+        Returns:
+            List[str]: The files made obsolete, to be removed once the manifest no
+                longer lists them.
+        """
+        obsolete = self.get_published_files()
+        sequence = self.manifest["next_sequence"]
+        with self.open_writer("base", sequence) as writer:
+            for file_name in obsolete:
+                writer.write_counts(
+                    iter_output_counts(self.folder / file_name, self.key)
+                )
+
+        self.manifest["next_sequence"] = sequence + 1
+        self.manifest["base"] = {"sequence": sequence, "file": writer.path.name}
+        self.manifest["segments"] = []
+        return obsolete
@@ -0,0 +1,44 @@
+from functools import lru_cache
+from typing import Tuple
+
+import tldextract
+
+# Uses the public suffix list snapshot bundled with tldextract: the list is never
+# fetched over the network, nor read from or written to a disk cache
+OFFLINE_EXTRACTOR = tldextract.TLDExtract(suffix_list_urls=(), cache_dir=None)
+
+# Maximum number of hosts whose split is memoized. A history holds far fewer
+# distinct hosts, but the daemon keeps the cache for its whole life.
+SPLIT_HOST_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=SPLIT_HOST_CACHE_SIZE)
+def split_host(host: str) -> Tuple[str, str, str]:
+    """
+    Splits a host into its subdomain, registered domain and public suffix.
+
+    Results are memoized per host, up to SPLIT_HOST_CACHE_SIZE recently used
+    hosts, so after the first URL of a host the split costs a dictionary lookup.
+
+    Args:
+        host (str): A host or netloc, e.g. "www.cs.ox.ac.uk" or "user@mit.edu:80".
+
+    Returns:
+        Tuple[str, str, str]: The subdomain, domain and suffix, e.g.
+            ("www.cs", "ox", "ac.uk").
+    """
+    extracted = OFFLINE_EXTRACTOR(host)
+    return extracted.subdomain, extracted.domain, extracted.suffix
+
+
+def split_url_host(url: str, netloc: str) -> Tuple[str, str, str]:
+    """
+    Splits the host of a URL, given the netloc parsed from it.
+
+    URLs without a netloc (e.g. "about:blank") are rare and not worth caching;
+    they are split as a whole, the way tldextract would.
+    """
+    if netloc:
+        return split_host(netloc)
+    extracted = OFFLINE_EXTRACTOR(url)
+    return extracted.subdomain, extracted.domain, extracted.suffix
@@ -0,0 +1,294 @@
+import ctypes
+import ctypes.util
+import os
+import platform
+import select
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import IO, Callable, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows, where browser histories aren't supported anyway
+    fcntl = None
+
+# Files SQLite writes next to a database, depending on its journal mode
+JOURNAL_SUFFIXES = ["-wal", "-journal"]
+
+# inotify(7) constants
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# Seconds between checks of the list of databases, e.g. for new Firefox profiles
+RESCAN_INTERVAL = 60
+# Seconds a continuous stream of writes can postpone processing at most
+MAX_DEBOUNCE_DELAY = 60
+
+
+def acquire_daemon_lock(path: Path) -> Optional[IO]:
+    """
+    Takes an exclusive lock on `path`, held until the returned file is closed or
+    the process exits, so that a single daemon runs at a time.
+
+    Returns:
+        Optional[IO]: The locked file, or None if another process holds the lock.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lock_file = open(path, "a")
+    if fcntl is None:
+        return lock_file
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+def get_watched_paths(db_paths: Iterable[str]) -> List[Path]:
+    """
+    Returns the files whose changes reveal new visits: the databases and their
+    WAL or rollback journal files, which may not exist yet.
+    """
+    paths = []
+    for db_path in db_paths:
+        paths.append(Path(db_path))
+        paths += [Path(f"{db_path}{suffix}") for suffix in JOURNAL_SUFFIXES]
+    return paths
+
+
+def get_file_stats(paths: Iterable[Path]) -> Dict[Path, Optional[Tuple[int, int]]]:
+    """
+    Returns the modification time and size of files, None for missing ones.
+    """
+    stats = {}
+    for path in paths:
+        try:
+            stat = path.stat()
+            stats[path] = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stats[path] = None
+    return stats
+
+
+class PollingWatcher:
+    """
+    Detects changes of files by comparing their modification time and size every
+    `interval` seconds.
+    """
+
+    def __init__(self, paths: List[Path], interval: float = 30):
+        self.paths = paths
+        self.interval = interval
+        self.stats = get_file_stats(paths)
+
+    def __enter__(self) -> "PollingWatcher":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        pass
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until one of the files changes, or `timeout` seconds have passed.
+
+        Returns:
+            bool: Whether a change was detected.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            stats = get_file_stats(self.paths)
+            if stats != self.stats:
+                self.stats = stats
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            time.sleep(
+                self.interval if remaining is None else min(self.interval, remaining)
+            )
+
+
+class InotifyWatcher:
+    """
+    Detects changes of files with Linux inotify, without polling.
+
+    The parent directories are watched rather than the files themselves, so that
+    files created or replaced after the watcher started, such as a new WAL file,
+    are noticed too.
+    """
+
+    def __init__(self, paths: List[Path]):
+        self.names = {(str(path.parent), path.name) for path in paths}
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.directories = {}
+        try:
+            for directory in {parent for parent, _ in self.names}:
+                if not os.path.isdir(directory):
+                    continue
+                wd = libc.inotify_add_watch(
+                    self.fd, os.fsencode(directory), INOTIFY_MASK
+                )
+                if wd < 0:
+                    raise OSError(ctypes.get_errno(), f"Unable to watch {directory}")
+                self.directories[wd] = directory
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def __enter__(self) -> "InotifyWatcher":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def read_events(self) -> bool:
+        """
+        Reads the pending events, returning whether any concerns a watched file.
+        """
+        changed = False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+        offset = 0
+        while offset < len(data):
+            (wd, _, _, length) = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset : offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+            if (self.directories.get(wd), name) in self.names:
+                changed = True
+        return changed
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        Waits until one of the files changes, or `timeout` seconds have passed.
+
+        Returns:
+            bool: Whether a change was detected.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = (
+                None if deadline is None else max(0, deadline - time.monotonic())
+            )
+            (readable, _, _) = select.select([self.fd], [], [], remaining)
+            if not readable:
+                return False
+            if self.read_events():
+                return True
+
+
+def create_watcher(paths: List[Path], poll_interval: float = 30):
+    """
+    Creates an inotify watcher on Linux, falling back to polling elsewhere or when
+    inotify is unavailable, e.g. once the user's inotify watch limit is reached.
+    """
+    if platform.system() == "Linux":
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError) as e:
+            print(f"Unable to use inotify, falling back to polling: {e}")
+    return PollingWatcher(paths, poll_interval)
+
+
+def wait_until_quiet(watcher, debounce: float, max_delay: float) -> None:
+    """
+    Waits until no change happened for `debounce` seconds, or at most `max_delay`
+    seconds, so that a burst of writes is processed once.
+    """
+    deadline = time.monotonic() + max_delay
+    while time.monotonic() < deadline:
+        if not watcher.wait(min(debounce, deadline - time.monotonic())):
+            return
+
+
+def watch_history(
+    list_databases: Callable[[], List[str]],
+    on_change: Callable[[], None],
+    debounce: float = 5,
+    min_interval: float = 0,
+    poll_interval: float = 30,
+    rescan_interval: float = RESCAN_INTERVAL,
+    stop_event: Optional[threading.Event] = None,
+) -> None:
+    """
+    Calls `on_change` once at start, then whenever the history databases changed
+    since the previous call, until `stop_event` is set.
+
+    Changes are debounced, and calls are at least `min_interval` seconds apart.
+    Events that leave every database file as it was, e.g. a checkpoint rewriting
+    the same WAL, don't trigger a call.
+
+    Args:
+        list_databases (Callable[[], List[str]]): Returns the paths of the history
+            databases, listed again regularly to pick up new ones.
+        on_change (Callable[[], None]): Processes the new visits.
+        debounce (float): Seconds without changes to wait for after a change.
+        min_interval (float): Minimum number of seconds between two calls.
+        poll_interval (float): Seconds between checks when polling.
+        rescan_interval (float): Seconds between listings of the databases.
+        stop_event (Optional[threading.Event]): Stops watching once set.
+    """
+    stop_event = stop_event or threading.Event()
+    watched = None
+    watcher = None
+    processed = None
+    last_run = None
+    try:
+        while not stop_event.is_set():
+            paths = get_watched_paths(list_databases())
+            if paths != watched:
+                if watcher is not None:
+                    watcher.close()
+                watcher = create_watcher(paths, poll_interval)
+                watched = paths
+
+            if get_file_stats(paths) == processed:
+                if watcher.wait(rescan_interval):
+                    wait_until_quiet(
+                        watcher, debounce, max(debounce, MAX_DEBOUNCE_DELAY)
+                    )
+                continue
+
+            if last_run is not None:
+                delay = last_run + min_interval - time.monotonic()
+                if delay > 0 and stop_event.wait(delay):
+                    break
+            # Changes made while processing are picked up by the next iteration
+            processed = get_file_stats(paths)
+            last_run = time.monotonic()
+            try:
+                on_change()
+            except Exception as e:
+                # Keep watching: the next change, or the next run, retries
+                print(f"Error while processing history changes: {e}")
+                processed = None
+    finally:
+        if watcher is not None:
+            watcher.close()
@@ -0,0 +1,517 @@
+import gzip
+import io
+import itertools
+import json
+import os
+import re
+import struct
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+# Bumped whenever the layout of any output format changes
+FORMAT_VERSION = 1
+
+OUTPUT_FORMATS = ["json", "compact_json", "ndjson", "binary", "json_counts"]
+COMPRESSIONS = ["none", "gzip"]
+
+FILE_EXTENSIONS = {
+    "json": ".json",
+    "compact_json": ".json",
+    "ndjson": ".ndjson",
+    "binary": ".bin",
+    "json_counts": ".json",
+}
+
+# Binary columnar layout, all integers little-endian:
+#   magic, format version (uint16), header length (uint32), JSON header,
+#   values column, counts column (uint32 per value).
+# Digest values are stored as raw 32-byte SHA-256 digests, all zeros standing for
+# a missing hash; string values as a uint32 byte length followed by UTF-8 bytes.
+BINARY_MAGIC = b"BHMC"
+NULL_DIGEST = bytes(32)
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Characters read at a time when streaming a JSON list
+READ_SIZE = 1 << 16
+LIST_SEPARATORS = re.compile(r"[\s,]*")
+
+
+def get_timestamp() -> str:
+    current_time = datetime.now(timezone.utc)
+    return current_time.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def get_output_path(
+    folder: Path, name: str, output_format: str = "json", compression: str = "none"
+) -> Path:
+    """
+    Returns the path of an output file, with the extension of its format, e.g.
+    `browser_history_enc.ndjson.gz`.
+    """
+    path = folder / f"{name}{FILE_EXTENSIONS[output_format]}"
+    if compression == "gzip":
+        path = path.with_name(f"{path.name}.gz")
+    return path
+
+
+class OutputWriter:
+    """
+    Base class of the writers of `{key: [...], "timestamp": ...}` output files.
+
+    Entries are appended as they are produced, so the full list never has to be
+    held in memory. The document is written to a temporary file which replaces
+    `path` only when the writer exits without error, so readers never see a partial
+    file and a failed run leaves the previous output untouched.
+    """
+
+    output_format = None
+    binary = False
+
+    def __init__(self, path: Union[str, Path], key: str, compression: str = "none"):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.path = Path(path)
+        self.key = key
+        self.compression = compression
+        self.tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        self.file: Optional[IO] = None
+        self.count = 0
+        self.timestamp = get_timestamp()
+
+    def get_header(self) -> Dict:
+        return {
+            "format": self.output_format,
+            "format_version": FORMAT_VERSION,
+            "timestamp": self.timestamp,
+        }
+
+    def __enter__(self) -> "OutputWriter":
+        mode = "wb" if self.binary else "wt"
+        if self.compression == "gzip":
+            self.file = gzip.open(self.tmp_path, mode)
+        else:
+            self.file = open(self.tmp_path, mode)
+        self.write_header()
+        return self
+
+    def write_header(self) -> None:
+        pass
+
+    def write(self, entries: Iterable) -> None:
+        raise NotImplementedError
+
+    def write_counts(self, counts: Iterable[Tuple[str, int]]) -> None:
+        """
+        Writes each entry of `(entry, count)` pairs `count` times. Writers storing
+        counts override it to skip the expansion.
+        """
+        for entry, count in counts:
+            self.write(itertools.repeat(entry, count))
+
+    def write_footer(self) -> None:
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None:
+            self.file.close()
+            self.tmp_path.unlink(missing_ok=True)
+            return
+
+        self.write_footer()
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class JsonListWriter(OutputWriter):
+    """
+    Writes the output as a single JSON document, indented with one entry per line,
+    or on a single line when `compact` is set.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        key: str,
+        compression: str = "none",
+        compact: bool = False,
+    ):
+        super().__init__(path, key, compression)
+        self.compact = compact
+        self.output_format = "compact_json" if compact else "json"
+
+    def write_header(self) -> None:
+        if self.compact:
+            self.file.write("{" + json.dumps(self.key) + ":[")
+        else:
+            self.file.write("{\n    " + json.dumps(self.key) + ": [")
+
+    def write(self, entries: Iterable) -> None:
+        for entry in entries:
+            separator = "," if self.count else ""
+            if self.compact:
+                self.file.write(separator + json.dumps(entry, separators=(",", ":")))
+            else:
+                self.file.write(f"{separator}\n        {json.dumps(entry)}")
+            self.count += 1
+
+    def write_footer(self) -> None:
+        header = self.get_header()
+        if self.compact:
+            self.file.write("]," + json.dumps(header, separators=(",", ":"))[1:])
+        else:
+            fields = ",\n".join(
+                f"    {json.dumps(name)}: {json.dumps(value)}"
+                for name, value in header.items()
+            )
+            self.file.write(f"\n    ],\n{fields}\n}}")
+
+
+class NdjsonWriter(OutputWriter):
+    """
+    Writes the output as newline-delimited JSON: a header object with the format,
+    the list key and the timestamp, followed by one entry per line.
+    """
+
+    output_format = "ndjson"
+
+    def write_header(self) -> None:
+        header = {**self.get_header(), "key": self.key}
+        self.file.write(json.dumps(header, separators=(",", ":")) + "\n")
+
+    def write(self, entries: Iterable) -> None:
+        for entry in entries:
+            self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self.count += 1
+
+
+class JsonCountsWriter(OutputWriter):
+    """
+    Writes the output as a single JSON object mapping each distinct entry to its
+    number of occurrences, e.g. `{"browser_history": {"<hash>": 3}, ...}`.
+
+    Counts are aggregated in memory, so memory grows with the number of distinct
+    entries only. A missing (None) entry is stored under the "null" key.
+    """
+
+    output_format = "json_counts"
+
+    def __init__(self, path: Union[str, Path], key: str, compression: str = "none"):
+        super().__init__(path, key, compression)
+        self.counts = Counter()
+
+    def write(self, entries: Iterable) -> None:
+        self.write_counts((entry, 1) for entry in entries)
+
+    def write_counts(self, counts: Iterable[Tuple[str, int]]) -> None:
+        for entry, count in counts:
+            self.counts[entry] += count
+            self.count += count
+
+    def write_footer(self) -> None:
+        counts = {
+            "null" if entry is None else entry: count
+            for entry, count in self.counts.items()
+        }
+        document = {**self.get_header(), "key": self.key, self.key: counts}
+        self.file.write(json.dumps(document, separators=(",", ":")))
+
+
+class BinaryColumnarWriter(OutputWriter):
+    """
+    Writes the output as binary columns of distinct values and their counts.
+
+    With `value_type="digest"` the entries must be hex SHA-256 digests (or None),
+    which are stored as raw 32-byte values. Counts are aggregated in memory, so
+    memory grows with the number of distinct values only.
+    """
+
+    output_format = "binary"
+    binary = True
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        key: str,
+        compression: str = "none",
+        value_type: str = "string",
+    ):
+        super().__init__(path, key, compression)
+        if value_type not in {"string", "digest"}:
+            raise ValueError(f"Unknown value type: {value_type}")
+        self.value_type = value_type
+        self.counts = Counter()
+
+    def write(self, entries: Iterable) -> None:
+        self.write_counts((entry, 1) for entry in entries)
+
+    def write_counts(self, counts: Iterable[Tuple[str, int]]) -> None:
+        for entry, count in counts:
+            self.counts[entry] += count
+            self.count += count
+
+    def encode_value(self, value: Optional[str]) -> bytes:
+        if self.value_type == "digest":
+            return NULL_DIGEST if value is None else bytes.fromhex(value)
+        encoded = value.encode()
+        return struct.pack("<I", len(encoded)) + encoded
+
+    def write_footer(self) -> None:
+        header = {
+            **self.get_header(),
+            "key": self.key,
+            "value_type": self.value_type,
+            "num_values": len(self.counts),
+        }
+        encoded_header = json.dumps(header).encode()
+        self.file.write(BINARY_MAGIC)
+        self.file.write(struct.pack("<HI", FORMAT_VERSION, len(encoded_header)))
+        self.file.write(encoded_header)
+        for value in self.counts:
+            self.file.write(self.encode_value(value))
+        self.file.write(struct.pack(f"<{len(self.counts)}I", *self.counts.values()))
+
+
+def open_output_writer(
+    path: Union[str, Path],
+    key: str,
+    output_format: str = "json",
+    compression: str = "none",
+    value_type: str = "string",
+) -> OutputWriter:
+    """
+    Creates the writer of an output file in the given format.
+
+    Args:
+        path (Union[str, Path]): The output file, see `get_output_path`.
+        key (str): The key of the list of entries, e.g. "browser_history".
+        output_format (str): One of OUTPUT_FORMATS.
+        compression (str): One of COMPRESSIONS.
+        value_type (str): "digest" if the entries are hex SHA-256 digests, which the
+            binary format stores as raw bytes; "string" otherwise.
+
+    Returns:
+        OutputWriter: The writer, to be used as a context manager.
+    """
+    if output_format in {"json", "compact_json"}:
+        return JsonListWriter(
+            path, key, compression, compact=output_format == "compact_json"
+        )
+    if output_format == "ndjson":
+        return NdjsonWriter(path, key, compression)
+    if output_format == "binary":
+        return BinaryColumnarWriter(path, key, compression, value_type)
+    if output_format == "json_counts":
+        return JsonCountsWriter(path, key, compression)
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+def read_binary_columns(data: bytes) -> Tuple[Dict, Iterator[Tuple[str, int]]]:
+    (version, header_length) = struct.unpack_from("<HI", data, len(BINARY_MAGIC))
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Unsupported binary output format version: {version}")
+    offset = len(BINARY_MAGIC) + struct.calcsize("<HI")
+    header = json.loads(data[offset : offset + header_length])
+    offset += header_length
+
+    values = []
+    for _ in range(header["num_values"]):
+        if header["value_type"] == "digest":
+            digest = data[offset : offset + 32]
+            values.append(None if digest == NULL_DIGEST else digest.hex())
+            offset += 32
+        else:
+            (length,) = struct.unpack_from("<I", data, offset)
+            offset += 4
+            values.append(data[offset : offset + length].decode())
+            offset += length
+    counts = struct.unpack_from(f"<{len(values)}I", data, offset)
+    return header, zip(values, counts)
+
+
+def read_output(path: Union[str, Path], counts: bool = False) -> Dict:
+    """
+    Reads an output file written in any of the OUTPUT_FORMATS, compressed or not.
+
+    Args:
+        path (Union[str, Path]): The output file.
+        counts (bool): Whether to read the entries as `(entry, count)` pairs, to be
+            passed to `OutputWriter.write_counts`: the formats storing counts then
+            aren't expanded, and the other formats give each entry a count of 1.
+
+    Returns:
+        Dict: The header fields ("format", "format_version", "timestamp") and the
+            list of entries under its key, one entry per visit whatever the format
+            unless `counts` is set. Files written before formats were introduced
+            read as format "json", version 0.
+    """
+    with open(path, "rb") as output_file:
+        data = output_file.read()
+    if data.startswith(GZIP_MAGIC):
+        data = gzip.decompress(data)
+
+    if data.startswith(BINARY_MAGIC):
+        header, pairs = read_binary_columns(data)
+        key = header.pop("key")
+        header.pop("value_type")
+        header.pop("num_values")
+        return {**header, key: format_entries(pairs, counts)}
+
+    text = data.decode()
+    first_line, _, rest = text.partition("\n")
+    try:
+        header = json.loads(first_line)
+    except ValueError:
+        header = None
+    if isinstance(header, dict) and header.get("format") == "ndjson":
+        key = header.pop("key")
+        entries = [json.loads(line) for line in rest.splitlines() if line]
+        if counts:
+            entries = [(entry, 1) for entry in entries]
+        return {**header, key: entries}
+
+    document = json.loads(text)
+    if document.get("format") == "json_counts":
+        key = document.pop("key")
+        pairs = (
+            (None if entry == "null" else entry, count)
+            for entry, count in document.pop(key).items()
+        )
+        return {**document, key: format_entries(pairs, counts)}
+    document.setdefault("format", "json")
+    document.setdefault("format_version", 0)
+    if counts:
+        # The list of entries is the only field that isn't part of the header
+        for key, entries in document.items():
+            if isinstance(entries, list):
+                document[key] = [(entry, 1) for entry in entries]
+    return document
+
+
+def format_entries(pairs: Iterable[Tuple[str, int]], counts: bool) -> List:
+    """
+    Returns `(entry, count)` pairs as a list of pairs, or of entries repeated
+    `count` times.
+    """
+    if counts:
+        return list(pairs)
+    return [entry for entry, count in pairs for _ in range(count)]
+
+
+def open_output_file(path: Union[str, Path]) -> IO[bytes]:
+    """
+    Opens an output file for reading, decompressing it on the fly if gzipped.
+    """
+    output_file = open(path, "rb")
+    if output_file.read(len(GZIP_MAGIC)) == GZIP_MAGIC:
+        output_file.close()
+        return gzip.open(path, "rb")
+    output_file.seek(0)
+    return output_file
+
+
+def iter_json_list(
+    json_file: IO[str], key: str, read_size: int = READ_SIZE
+) -> Iterator[Any]:
+    """
+    Streams the entries of the `key` list of a JSON document one at a time, so
+    that the document is never loaded whole.
+
+    Args:
+        json_file (IO[str]): The JSON document, opened in text mode.
+        key (str): The key of the list to read.
+        read_size (int): The number of characters read at a time.
+
+    Yields:
+        The entries of the list.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = -1
+    # Find the opening bracket of the list
+    while position < 0:
+        chunk = json_file.read(read_size)
+        if not chunk:
+            raise ValueError(f"No {key} list found")
+        buffer += chunk
+        key_position = buffer.find(json.dumps(key))
+        if key_position >= 0:
+            position = buffer.find("[", key_position)
+    position += 1
+
+    while True:
+        position = LIST_SEPARATORS.match(buffer, position).end()
+        if buffer.startswith("]", position):
+            return
+        try:
+            entry, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            # The entry is cut by the end of the buffer: read more, dropping the
+            # entries already decoded
+            chunk = json_file.read(read_size)
+            if not chunk:
+                raise
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield entry
+
+
+def iter_output_counts(path: Union[str, Path], key: str) -> Iterator[Tuple[Any, int]]:
+    """
+    Streams the entries of an output file as `(entry, count)` pairs, to be passed
+    to `OutputWriter.write_counts`, see `read_output`.
+
+    JSON lists and ndjson files are read one entry at a time, so memory stays flat
+    whatever the size of the file. The formats storing counts are read whole, as
+    they hold each distinct entry once.
+
+    Args:
+        path (Union[str, Path]): The output file.
+        key (str): The key of the list of entries, e.g. "browser_history".
+
+    Yields:
+        Tuple[Any, int]: The entries and their counts.
+    """
+    with open_output_file(path) as output_file:
+        head = output_file.read(64)
+        output_file.seek(0)
+        if head.startswith(BINARY_MAGIC) or head.startswith(b'{"format":"json_counts"'):
+            yield from read_output(path, counts=True).get(key, [])
+            return
+
+        text_file = io.TextIOWrapper(output_file, encoding="utf-8")
+        if head.startswith(b'{"format":"ndjson"'):
+            text_file.readline()
+            for line in text_file:
+                if line.strip():
+                    yield json.loads(line), 1
+            return
+        for entry in iter_json_list(text_file, key):
+            yield entry, 1
+
+
+def list_output_paths(folder: Path, name: str) -> Iterator[Path]:
+    """
+    Lists the paths an output file can have, in any format and compression.
+    """
+    seen = set()
+    for output_format in OUTPUT_FORMATS:
+        for compression in COMPRESSIONS:
+            path = get_output_path(folder, name, output_format, compression)
+            if path not in seen:
+                seen.add(path)
+                yield path
+
+
+def remove_stale_outputs(
+    folder: Path, name: str, current_path: Optional[Path] = None
+) -> None:
+    """
+    Removes the copies of an output file left in other formats, or all of them
+    when `current_path` is None, so that the aggregator never reads an outdated one.
+    """
+    for path in list_output_paths(folder, name):
+        if path != current_path:
+            path.unlink(missing_ok=True)
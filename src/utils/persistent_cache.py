@@ -0,0 +1,79 @@
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable, Union
+
+
+class PersistentLRUCache:
+    """
+    A size-bounded mapping with least-recently-used eviction, persisted as JSON.
+
+    The cache is tagged with a version: when the stored version differs from the
+    one the cache is opened with, the stored entries are discarded. Callers derive
+    the version from whatever the cached values depend on, e.g. a rule set.
+    """
+
+    def __init__(self, path: Union[str, Path], max_size: int, version: str = ""):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.version = version
+        self.entries = OrderedDict()
+        self.load()
+
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "r") as cache_file:
+                data = json.load(cache_file)
+        except (OSError, ValueError):
+            print(f"Unable to read cache file: {self.path}")
+            return
+        if data.get("version") != self.version:
+            return
+        self.entries = OrderedDict(data.get("entries", []))
+        self.evict()
+
+    def save(self) -> None:
+        """
+        Writes the entries in LRU order, atomically replacing the previous file.
+        """
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp_path, "w") as cache_file:
+            json.dump(
+                {"version": self.version, "entries": list(self.entries.items())},
+                cache_file,
+            )
+        os.replace(tmp_path, self.path)
+
+    def evict(self) -> None:
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        self.evict()
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[Hashable], Any]) -> Any:
+        """
+        Returns the cached value for `key`, computing and caching it on a miss.
+        """
+        if key in self.entries:
+            return self.get(key)
+        value = compute(key)
+        self.put(key, value)
+        return value
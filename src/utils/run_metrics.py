@@ -0,0 +1,239 @@
+import cProfile
+import json
+import os
+import platform
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Union
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Number of allocation sites listed in profile mode
+TOP_ALLOCATIONS = 25
+
+
+def get_max_rss_kb() -> Optional[int]:
+    """
+    Returns the peak resident memory of the process so far, in KiB.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS, in KiB elsewhere
+    return max_rss // 1024 if platform.system() == "Darwin" else max_rss
+
+
+def get_rss_growth_kb(start_rss_kb: Optional[int]) -> Optional[int]:
+    """
+    Returns how much the peak resident memory of the process grew since
+    `start_rss_kb`, in KiB.
+    """
+    if start_rss_kb is None:
+        return None
+    return get_max_rss_kb() - start_rss_kb
+
+
+class RunMetrics:
+    """
+    Collects the wall time, CPU time, row count and memory of the stages of a run,
+    and of the reading of each history source.
+
+    CPU time is the time of the thread running the stage, so stages running in
+    parallel threads are measured independently. "peak_rss_growth_kb" is how much
+    the stage raised the peak resident memory of the process, the largest over its
+    calls: 0 when the stage fits in memory already reached before it, and shared
+    between stages running at the same time. It costs two getrusage calls per call,
+    or per batch in `timed_batches`. The process-wide peak is "max_rss_kb" at the
+    top level. When tracemalloc is tracing, see `profile`, "peak_traced_bytes" is
+    the peak Python memory allocated during the stage, approximate when stages
+    overlap.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.started_at = time.time()
+            self.sections = {"stages": {}, "sources": {}}
+            self.extra = {}
+
+    def record(
+        self,
+        name: str,
+        wall_time: float,
+        cpu_time: float,
+        rows: int = 0,
+        peak_traced_bytes: Optional[int] = None,
+        section: str = "stages",
+        calls: int = 1,
+        peak_rss_growth_kb: Optional[int] = None,
+    ) -> None:
+        with self.lock:
+            entry = self.sections[section].setdefault(
+                name,
+                {
+                    "calls": 0,
+                    "wall_time": 0.0,
+                    "cpu_time": 0.0,
+                    "rows": 0,
+                    "peak_rss_growth_kb": None,
+                    "peak_traced_bytes": None,
+                },
+            )
+            entry["calls"] += calls
+            entry["wall_time"] += wall_time
+            entry["cpu_time"] += cpu_time
+            entry["rows"] += rows
+            if peak_rss_growth_kb is not None:
+                entry["peak_rss_growth_kb"] = max(
+                    entry["peak_rss_growth_kb"] or 0, peak_rss_growth_kb
+                )
+            if peak_traced_bytes is not None:
+                entry["peak_traced_bytes"] = max(
+                    entry["peak_traced_bytes"] or 0, peak_traced_bytes
+                )
+
+    @contextmanager
+    def stage(self, name: str, rows: int = 0) -> Iterator[Dict]:
+        """
+        Measures the code run in the context as one call of a stage.
+
+        Yields:
+            Dict: A counter whose "rows" can be increased within the context, when
+                the number of rows is only known at the end.
+        """
+        counter = {"rows": rows}
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            start_traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        start_rss = get_max_rss_kb()
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield counter
+        finally:
+            wall_time = time.perf_counter() - start_wall
+            cpu_time = time.thread_time() - start_cpu
+            peak = None
+            if tracing:
+                peak = max(0, tracemalloc.get_traced_memory()[1] - start_traced)
+            self.record(
+                name,
+                wall_time,
+                cpu_time,
+                counter["rows"],
+                peak,
+                peak_rss_growth_kb=get_rss_growth_kb(start_rss),
+            )
+
+    def timed_batches(
+        self, name: str, batches: Iterable[List], section: str = "sources"
+    ) -> Iterator[List]:
+        """
+        Passes batches through, measuring the time spent producing them, e.g. the
+        reading of a history source, and counting their rows.
+        """
+        iterator = iter(batches)
+        wall_time = cpu_time = 0.0
+        rows = 0
+        rss_growth = None
+        try:
+            while True:
+                start_rss = get_max_rss_kb()
+                start_wall = time.perf_counter()
+                start_cpu = time.thread_time()
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    wall_time += time.perf_counter() - start_wall
+                    cpu_time += time.thread_time() - start_cpu
+                    growth = get_rss_growth_kb(start_rss)
+                    if growth is not None:
+                        rss_growth = (rss_growth or 0) + growth
+                rows += len(batch)
+                yield batch
+        finally:
+            self.record(
+                name,
+                wall_time,
+                cpu_time,
+                rows,
+                section=section,
+                peak_rss_growth_kb=rss_growth,
+            )
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                "started_at": self.started_at,
+                "duration": time.time() - self.started_at,
+                "max_rss_kb": get_max_rss_kb(),
+                **{name: dict(entries) for name, entries in self.sections.items()},
+                **self.extra,
+            }
+
+    def save(self, path: Union[str, Path]) -> None:
+        """
+        Writes the metrics as JSON, atomically replacing the previous file.
+        """
+        path = Path(path)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "w") as metrics_file:
+            json.dump(self.to_dict(), metrics_file, indent=4)
+        os.replace(tmp_path, path)
+
+
+RUN_METRICS = RunMetrics()
+
+
+def get_run_metrics() -> RunMetrics:
+    """
+    Returns the metrics of the current run, shared by all modules.
+    """
+    return RUN_METRICS
+
+
+@contextmanager
+def profile(profile_path: Union[str, Path], metrics: Optional[RunMetrics] = None):
+    """
+    Profiles the code run in the context with cProfile and tracemalloc.
+
+    The cProfile statistics are dumped to `profile_path`, to be read with `pstats`
+    or a viewer such as snakeviz; like cProfile itself, they only cover the calling
+    thread. The top allocation sites at the end of the context are added to the
+    metrics under "top_allocations". Both slow the run down noticeably, so this is
+    meant to be turned on when investigating.
+    """
+    metrics = metrics or get_run_metrics()
+    profiler = cProfile.Profile()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(str(profile_path))
+        snapshot = tracemalloc.take_snapshot()
+        metrics.extra["top_allocations"] = [
+            {
+                "location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "size": stat.size,
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+        ]
+        if started_tracing:
+            tracemalloc.stop()
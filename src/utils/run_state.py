@@ -0,0 +1,51 @@
+import json
+import os
+from pathlib import Path
+from typing import Dict
+
+from src.utils.config_reader import ConfigReader
+
+RUN_STATE_FILE = "run_state.json"
+
+
+def get_run_state_path() -> Path:
+    config_reader = ConfigReader()
+    return Path(config_reader.get_temp_data_folder()) / RUN_STATE_FILE
+
+
+def load_run_state() -> Dict:
+    """
+    Load the state persisted by the previous run.
+
+    The state holds, among others, the per-source high-water marks ("cursors") used
+    to fetch only the visits that happened since the last run. A missing or
+    unreadable state file yields an empty state, which triggers a full scan.
+
+    Returns:
+        Dict: The run state, always containing a "cursors" mapping.
+    """
+    state_path = get_run_state_path()
+    state = {}
+    if state_path.exists():
+        try:
+            with open(state_path, "r") as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            print(f"Unable to read run state file: {state_path}")
+            state = {}
+    state.setdefault("cursors", {})
+    return state
+
+
+def save_run_state(state: Dict) -> None:
+    """
+    Persist the run state atomically, so a crash never leaves a truncated file.
+
+    Args:
+        state (Dict): The run state to save.
+    """
+    state_path = get_run_state_path()
+    tmp_path = state_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as state_file:
+        json.dump(state, state_file, indent=4)
+    os.replace(tmp_path, state_path)
@@ -0,0 +1,91 @@
+import shutil
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Union
+
+from src.utils.config_reader import ConfigReader
+from src.utils.run_metrics import get_run_metrics
+
+# Seconds to wait on a busy database before falling back to a copy
+BUSY_TIMEOUT = 1.0
+
+
+def connect_read_only(db_path: Path) -> sqlite3.Connection:
+    """
+    Opens a read-only connection to a live browser database.
+
+    The connection goes through SQLite's locking protocol, so it sees a consistent
+    snapshot including the content of the `-wal` file, and only reads the pages the
+    queries touch. Raises sqlite3.OperationalError when the browser holds an
+    exclusive lock on the database.
+    """
+    conn = sqlite3.connect(
+        f"{db_path.as_uri()}?mode=ro", uri=True, timeout=BUSY_TIMEOUT
+    )
+    try:
+        # Opening is lazy: read the schema to find out if the database is accessible
+        conn.execute("SELECT count(*) FROM sqlite_master").fetchone()
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+
+def copy_database(db_path: Path, workspace: Path) -> Path:
+    """
+    Copies a database and its `-wal` file into `workspace`.
+
+    The `-shm` index is not copied: SQLite rebuilds it from the WAL when the copy is
+    opened, so no committed visit is lost.
+    """
+    temp_db_path = workspace / db_path.name
+    shutil.copy(db_path, temp_db_path)
+    wal_path = Path(f"{db_path}-wal")
+    if wal_path.exists():
+        shutil.copy(wal_path, Path(f"{temp_db_path}-wal"))
+    return temp_db_path
+
+
+@contextmanager
+def open_snapshot(db_path: Union[str, Path]) -> Iterator[sqlite3.Connection]:
+    """
+    Opens a consistent, read-only view of a browser history database.
+
+    The live database is read in place when possible. If the browser keeps it
+    locked, the database and its WAL are copied into a private temporary folder,
+    which is removed when the context exits.
+
+    Args:
+        db_path (Union[str, Path]): The path to the browser database.
+
+    Yields:
+        sqlite3.Connection: A connection to query the history from.
+    """
+    db_path = Path(db_path)
+    try:
+        conn = connect_read_only(db_path)
+    except sqlite3.OperationalError:
+        conn = None
+
+    if conn is not None:
+        try:
+            yield conn
+        finally:
+            conn.close()
+        return
+
+    # Copies are intentionally outside syftbox, but we can process them locally
+    config_reader = ConfigReader()
+    workspace = Path(tempfile.mkdtemp(dir=config_reader.get_temp_data_folder()))
+    try:
+        with get_run_metrics().stage("copy"):
+            temp_db_path = copy_database(db_path, workspace)
+        conn = sqlite3.connect(temp_db_path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
@@ -0,0 +1,12 @@
+import pytest
+
+from src import browser_history
+
+
+@pytest.fixture
+def firefox_home(tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(browser_history.platform, "system", lambda: "Linux")
+    profile = tmp_path / ".mozilla" / "firefox" / "abc.default"
+    profile.mkdir(parents=True)
+    return profile
@@ -0,0 +1,320 @@
+import sqlite3
+import sys
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from benchmarks.run_benchmarks import use_history_paths
+from benchmarks.synthetic_history import create_synthetic_history, iter_synthetic_visits
+from src import browser_history
+from src.browser_history import (
+    Visit,
+    fetch_brave_history,
+    fetch_chrome_history,
+    fetch_combined_history,
+    get_changed_sources,
+    get_source_fingerprints,
+    fetch_firefox_history,
+    fetch_safari_history,
+    iter_combined_history,
+    iter_firefox_history,
+    list_chromium_profiles,
+    list_history_sources,
+)
+
+
+def create_places_db(path, visits):
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE moz_places (id INTEGER PRIMARY KEY, url TEXT);
+        CREATE TABLE moz_historyvisits (
+            id INTEGER PRIMARY KEY, place_id INTEGER, visit_date INTEGER
+        );
+        """
+    )
+    add_visits(conn, visits)
+    conn.close()
+
+
+def create_chromium_db(path, visits):
+    path.parent.mkdir(parents=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE urls (id INTEGER PRIMARY KEY, url TEXT, last_visit_time INTEGER);
+        CREATE TABLE visits (id INTEGER PRIMARY KEY, url INTEGER, visit_time INTEGER);
+        """
+    )
+    for url, visit_time in visits:
+        cursor = conn.execute(
+            "INSERT INTO urls (url, last_visit_time) VALUES (?, ?)", (url, visit_time)
+        )
+        conn.execute(
+            "INSERT INTO visits (url, visit_time) VALUES (?, ?)",
+            (cursor.lastrowid, visit_time),
+        )
+    conn.commit()
+    conn.close()
+
+
+def add_visits(conn, visits):
+    for url, visit_date in visits:
+        cursor = conn.execute("INSERT INTO moz_places (url) VALUES (?)", (url,))
+        conn.execute(
+            "INSERT INTO moz_historyvisits (place_id, visit_date) VALUES (?, ?)",
+            (cursor.lastrowid, visit_date),
+        )
+    conn.commit()
+
+
+def test_fetch_firefox_history_incremental(firefox_home):
+    places_db = firefox_home / "places.sqlite"
+    create_places_db(
+        places_db,
+        [("https://mit.edu/a", 1_000_000), ("https://mit.edu/b", 2_000_000)],
+    )
+
+    cursors = {}
+    history = fetch_firefox_history(cursors)
+    # Rows are not sorted unless limited
+    assert sorted(h["url"] for h in history) == [
+        "https://mit.edu/a",
+        "https://mit.edu/b",
+    ]
+    assert cursors == {"firefox:abc.default": 2_000_000}
+
+    # Nothing new since the last run
+    assert fetch_firefox_history(cursors) == []
+
+    conn = sqlite3.connect(places_db)
+    add_visits(conn, [("https://mit.edu/c", 3_000_000)])
+    conn.close()
+
+    history = fetch_firefox_history(cursors)
+    assert [h["url"] for h in history] == ["https://mit.edu/c"]
+    assert cursors == {"firefox:abc.default": 3_000_000}
+
+    # Without cursors the full history is read again
+    assert len(fetch_firefox_history()) == 3
+
+
+def test_fetch_combined_history_concurrent(firefox_home):
+    create_places_db(firefox_home / "places.sqlite", [("https://mit.edu/a", 1)])
+    other_profile = firefox_home.parent / "xyz.work"
+    other_profile.mkdir()
+    create_places_db(other_profile / "places.sqlite", [("https://ox.ac.uk/b", 2)])
+
+    cursors = {}
+    history = fetch_combined_history(cursors, concurrent=True)
+    assert sorted(h["url"] for h in history) == [
+        "https://mit.edu/a",
+        "https://ox.ac.uk/b",
+    ]
+    assert cursors == {"firefox:abc.default": 1, "firefox:xyz.work": 2}
+
+
+@pytest.mark.parametrize("concurrent", [False, True])
+def test_failed_source_fails_the_iteration(firefox_home, monkeypatch, concurrent):
+    create_places_db(
+        firefox_home / "places.sqlite",
+        [(f"https://mit.edu/{i}", i) for i in range(10)],
+    )
+    iter_query_batches = browser_history.iter_query_batches
+
+    def failing_query_batches(*args, **kwargs):
+        with closing(iter_query_batches(*args, **kwargs)) as batches:
+            yield next(batches)
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(browser_history, "iter_query_batches", failing_query_batches)
+    completed = set()
+    batches = []
+    with pytest.raises(sqlite3.OperationalError):
+        for batch in iter_combined_history(
+            {}, concurrent=concurrent, batch_size=3, completed=completed
+        ):
+            batches.append(batch)
+    assert [len(batch) for batch in batches] == [3]
+    assert "firefox:abc.default" not in completed
+
+
+@pytest.mark.parametrize("concurrent", [False, True])
+def test_iter_combined_history_batches(firefox_home, concurrent):
+    create_places_db(
+        firefox_home / "places.sqlite",
+        [(f"https://mit.edu/{i}", i) for i in range(5)],
+    )
+
+    batches = list(iter_combined_history(concurrent=concurrent, batch_size=2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_iter_firefox_history_aggregate(firefox_home):
+    places_db = firefox_home / "places.sqlite"
+    create_places_db(places_db, [("https://mit.edu/a", 1_000_000)])
+    conn = sqlite3.connect(places_db)
+    conn.executemany(
+        "INSERT INTO moz_historyvisits (place_id, visit_date) VALUES (1, ?)",
+        [(3_000_000,), (2_000_000,)],
+    )
+    conn.commit()
+    conn.close()
+
+    cursors = {}
+    (batch,) = list(iter_firefox_history(cursors, aggregate=True))
+    assert len(batch) == 1
+    assert batch[0]["visit_count"] == 3
+    assert batch[0]["first_visit_time"] == datetime(1970, 1, 1, 0, 0, 1)
+    assert batch[0]["visit_time"] == datetime(1970, 1, 1, 0, 0, 3)
+    assert cursors == {"firefox:abc.default": 3_000_000}
+
+
+@pytest.mark.parametrize("concurrent", [False, True])
+def test_unchanged_sources_are_skipped(firefox_home, concurrent):
+    places_db = firefox_home / "places.sqlite"
+    create_places_db(places_db, [("https://mit.edu/a", 1_000_000)])
+    other_profile = firefox_home.parent / "xyz.default"
+    other_profile.mkdir()
+    create_places_db(other_profile / "places.sqlite", [("https://mit.edu/b", 1)])
+
+    fingerprints = get_source_fingerprints()
+    assert set(fingerprints) == {"firefox:abc.default", "firefox:xyz.default"}
+    assert get_changed_sources(fingerprints, fingerprints) == set()
+    assert get_source_fingerprints() == fingerprints
+
+    conn = sqlite3.connect(places_db)
+    add_visits(conn, [("https://mit.edu/c", 2_000_000)])
+    conn.close()
+    changed = get_changed_sources(get_source_fingerprints(), fingerprints)
+    assert changed == {"firefox:abc.default"}
+
+    completed = set()
+    history = [
+        visit["url"]
+        for batch in iter_combined_history(
+            concurrent=concurrent, only=changed, completed=completed
+        )
+        for visit in batch
+    ]
+    assert sorted(history) == ["https://mit.edu/a", "https://mit.edu/c"]
+    assert completed == {"firefox:abc.default"}
+
+    # Nothing to read at all
+    assert list(iter_combined_history(concurrent=concurrent, only=set())) == []
+
+
+def test_chromium_profiles(firefox_home):
+    config = firefox_home.parent.parent.parent / ".config"
+    chrome = config / "google-chrome"
+    create_chromium_db(chrome / "Profile 1" / "History", [("https://mit.edu/b", 2)])
+    create_chromium_db(chrome / "Default" / "History", [("https://mit.edu/a", 1)])
+    create_chromium_db(chrome / "System Profile" / "History", [("https://x.org", 1)])
+    (chrome / "Profile 2").mkdir()
+    create_chromium_db(
+        config / "microsoft-edge" / "Default" / "History", [("https://ox.ac.uk", 3)]
+    )
+
+    assert [profile[:2] for profile in list_chromium_profiles()] == [
+        ("chrome", "Default"),
+        ("chrome", "Profile 1"),
+        ("edge", "Default"),
+    ]
+    assert [(name, key) for name, key, _ in list_history_sources()] == [
+        ("Safari", "safari"),
+        ("Chrome", "chrome"),
+        ("Chrome (Profile 1)", "chrome:Profile 1"),
+        ("Edge", "edge"),
+    ]
+
+    # Every profile has its own cursor and fingerprint
+    cursors = {}
+    history = fetch_combined_history(cursors, concurrent=True)
+    assert sorted((h["browser"], h["url"]) for h in history) == [
+        ("chrome", "https://mit.edu/a"),
+        ("chrome", "https://mit.edu/b"),
+        ("edge", "https://ox.ac.uk"),
+    ]
+    assert cursors == {"chrome": 1, "chrome:Profile 1": 2, "edge": 3}
+    assert set(get_source_fingerprints()) == {"chrome", "chrome:Profile 1", "edge"}
+
+
+def test_visit_dict_view():
+    visit = Visit("https://mit.edu/a", 3_000_000, "firefox")
+    assert visit == {
+        "url": "https://mit.edu/a",
+        "visit_time": datetime(1970, 1, 1, 0, 0, 3),
+        "browser": "firefox",
+    }
+    assert visit.get("visit_count", 1) == 1
+    assert "first_visit_time" not in visit
+    with pytest.raises(KeyError):
+        visit["visit_us"]
+    # No per-instance dict
+    assert not hasattr(visit, "__dict__")
+    assert sys.getsizeof(visit) < sys.getsizeof(dict(visit))
+
+    aggregated = Visit("https://mit.edu/a", 3_000_000, "firefox", 2, 1_000_000)
+    assert aggregated["visit_count"] == 2
+    assert aggregated["first_visit_time"] == datetime(1970, 1, 1, 0, 0, 1)
+
+
+def test_chromium_epoch(firefox_home):
+    chrome = firefox_home.parent.parent.parent / ".config" / "google-chrome"
+    # 1970-01-01 00:00:01 in microseconds since 1601-01-01
+    create_chromium_db(
+        chrome / "Default" / "History", [("https://mit.edu/a", 11644473601000000)]
+    )
+    (visit,) = fetch_chrome_history()
+    assert visit.visit_us == 1_000_000
+    assert visit["visit_time"] == datetime(1970, 1, 1, 0, 0, 1)
+
+
+def test_time_window(tmp_path):
+    end_time = 1_700_000_000
+    paths = create_synthetic_history(tmp_path, 300, 900, 20, end_time=end_time)
+    since = datetime(1970, 1, 1) + timedelta(seconds=end_time - 7 * 24 * 3600)
+    until = datetime.fromtimestamp(end_time - 24 * 3600, timezone.utc)
+
+    def count_expected(seed):
+        count = 0
+        for _, _, times in iter_synthetic_visits(
+            300, 900, 20, end_time=end_time, seed=seed
+        ):
+            for visit_time in times:
+                count += end_time - 7 * 24 * 3600 <= visit_time < end_time - 24 * 3600
+        return count
+
+    with use_history_paths(paths):
+        # Safari, Chrome, Firefox and Brave are generated with seeds 0 to 3
+        for seed, fetch in enumerate(
+            [
+                fetch_safari_history,
+                fetch_chrome_history,
+                fetch_firefox_history,
+                fetch_brave_history,
+            ]
+        ):
+            visits = fetch(since=since, until=until)
+            assert len(visits) == count_expected(seed) > 0
+            assert all(
+                since <= visit["visit_time"] < until.replace(tzinfo=None)
+                for visit in visits
+            )
+
+            newest = sorted((visit.visit_us for visit in fetch()), reverse=True)
+            assert [visit.visit_us for visit in fetch(limit=5)] == newest[:5]
+
+
+def test_limit_with_cursor_and_aggregate(firefox_home):
+    create_places_db(
+        firefox_home / "places.sqlite",
+        [("https://mit.edu/a", 1), ("https://mit.edu/b", 2), ("https://mit.edu/b", 3)],
+    )
+    cursors = {}
+    (batch,) = list(iter_firefox_history(cursors, aggregate=True, limit=1))
+    assert [(visit.url, visit.visit_count) for visit in batch] == [
+        ("https://mit.edu/b", 1)
+    ]
+    assert cursors == {"firefox:abc.default": 3}
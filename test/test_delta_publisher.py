@@ -0,0 +1,89 @@
+import pytest
+
+from src.utils.delta_publisher import (
+    DeltaPublisher,
+    get_manifest_path,
+    load_manifest,
+    read_published,
+    remove_delta_outputs,
+)
+
+
+def publish(folder, entries, snapshot=False, max_segments=24, output_format="json"):
+    publisher = DeltaPublisher(
+        folder, "paper_stats", "papers", output_format, max_segments=max_segments
+    )
+    with publisher.open(snapshot) as writer:
+        writer.write(entries)
+    publisher.commit()
+    return publisher
+
+
+def test_segments_are_appended_to_the_snapshot(tmp_path):
+    publish(tmp_path, ["a", "b"], snapshot=True)
+    publish(tmp_path, ["c"])
+    publish(tmp_path, ["d", "e"])
+
+    assert read_published(tmp_path, "paper_stats", "papers") == list("abcde")
+    manifest = load_manifest(tmp_path, "paper_stats")
+    assert manifest["base"]["sequence"] == 1
+    assert [segment["sequence"] for segment in manifest["segments"]] == [2, 3]
+    assert [segment["entries"] for segment in manifest["segments"]] == [1, 2]
+
+
+def test_empty_run_publishes_no_segment(tmp_path):
+    publish(tmp_path, ["a"], snapshot=True)
+    publish(tmp_path, [])
+
+    assert load_manifest(tmp_path, "paper_stats")["segments"] == []
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "paper_stats.base-000001.json",
+        "paper_stats.manifest.json",
+    ]
+
+
+def test_snapshot_replaces_published_files(tmp_path):
+    publish(tmp_path, ["a"], snapshot=True)
+    publish(tmp_path, ["b"])
+    publish(tmp_path, ["c"], snapshot=True)
+
+    assert read_published(tmp_path, "paper_stats", "papers") == ["c"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "paper_stats.base-000003.json",
+        "paper_stats.manifest.json",
+    ]
+
+
+@pytest.mark.parametrize("output_format", ["json", "ndjson", "binary"])
+def test_segments_are_compacted(tmp_path, output_format):
+    publish(tmp_path, ["a"], snapshot=True, output_format=output_format)
+    for entry in ["b", "c", "d"]:
+        publish(tmp_path, [entry], max_segments=2, output_format=output_format)
+
+    manifest = load_manifest(tmp_path, "paper_stats")
+    assert manifest["base"]["sequence"] == 5
+    assert manifest["segments"] == []
+    assert manifest["next_sequence"] == 6
+    assert sorted(read_published(tmp_path, "paper_stats", "papers")) == list("abcd")
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_compaction_keeps_counts(tmp_path):
+    publish(tmp_path, ["a", "a"], snapshot=True, output_format="json_counts")
+    for entries in [["a", "b"], ["b"], ["a"]]:
+        publish(tmp_path, entries, max_segments=2, output_format="json_counts")
+
+    assert load_manifest(tmp_path, "paper_stats")["segments"] == []
+    published = read_published(tmp_path, "paper_stats", "papers", counts=True)
+    assert sorted(published) == [("a", 4), ("b", 2)]
+
+
+def test_remove_delta_outputs(tmp_path):
+    publish(tmp_path, ["a"], snapshot=True)
+    publish(tmp_path, ["b"])
+    other = tmp_path / "paper_stats.json"
+    other.touch()
+
+    remove_delta_outputs(tmp_path, "paper_stats")
+    assert not get_manifest_path(tmp_path, "paper_stats").exists()
+    assert list(tmp_path.iterdir()) == [other]
@@ -0,0 +1,19 @@
+from src.utils.domain_parts import SPLIT_HOST_CACHE_SIZE, split_host, split_url_host
+
+
+def test_split_host():
+    assert split_host("www.cs.ox.ac.uk") == ("www.cs", "ox", "ac.uk")
+    assert split_host("user@mit.edu:8080") == ("", "mit", "edu")
+    assert split_host("192.168.0.1") == ("", "192.168.0.1", "")
+
+
+def test_split_host_is_memoized():
+    split_host.cache_clear()
+    split_host("arxiv.org")
+    split_host("arxiv.org")
+    assert split_host.cache_info().hits == 1
+    assert split_host.cache_info().maxsize == SPLIT_HOST_CACHE_SIZE
+
+
+def test_split_url_host_without_netloc():
+    assert split_url_host("about:blank", "") == ("", "about", "")
@@ -0,0 +1,86 @@
+import pytest
+
+from src.educational_content_classifier import (
+    TitleParser,
+    classify_url,
+    classify_urls,
+    extract_title,
+    is_educational_domain,
+    parse_html,
+)
+
+
+@pytest.mark.parametrize(
+    "domain,expected",
+    [
+        ("mit.edu", True),
+        ("CS.Stanford.EDU", True),
+        ("edu", False),
+        ("unimelb.edu.au", True),
+        ("ox.ac.uk", True),
+        ("u-tokyo.ac.jp", True),
+        ("ac.uk", False),
+        ("example.ac.1a", False),
+        ("www.uni-heidelberg.de", True),
+        ("uni-heidelberg.de", False),
+        ("www.uni-.de", False),
+        ("www.univ-paris1.fr", True),
+        ("www.uni-paris1.fr", False),
+        ("ku.universitet.dk", True),
+        ("www.universiteit.nl", True),
+        ("harvard.university.com", True),
+        ("cs.uni.lu", True),
+        ("my.college.org", True),
+        ("mit.edu:8080", False),
+        ("google.com", False),
+    ],
+)
+def test_is_educational_domain(domain, expected):
+    assert is_educational_domain(domain) is expected
+
+
+def test_classify_urls_matches_classify_url():
+    urls = [
+        "https://www.youtube.com/watch?v=intro",
+        "https://mit.edu/courses",
+        "https://mit.edu/people",
+        "https://github.com/owner/repo",
+        "https://example.com/research/paper",
+        "https://mit.edu/people",
+        "https://google.com",
+    ]
+    assert classify_urls(urls) == [classify_url(url) for url in urls]
+
+
+def test_classify_urls_unparsable_url():
+    assert classify_urls(["http://[invalid", "https://mit.edu"]) == [None, "academic"]
+
+
+@pytest.mark.parametrize(
+    "html",
+    [
+        "<html><head><title> Intro\n to Physics </title></head><h1>H</h1></html>",
+        '<head><meta property="og:title" content="OG"><title>T</title></head>',
+        '<head><meta property="og:title" content="OG"></head><body><h1>H</h1>',
+        '<head><meta name="twitter:title" content="TW"></head><body><h1>H</h1>',
+        "<head></head><body><h1><a href='/'>Linked</a></h1></body>",
+        "<head></head><body><h1>A<br>B</h1><h1>C</h1></body>",
+        "<head><title></title></head><body><h1>Fallback</h1></body>",
+        "<title>A &amp; B</title>",
+        "<body><p>No title</p></body>",
+    ],
+)
+def test_title_parser_matches_extract_title(html):
+    parser = TitleParser()
+    for start in range(0, len(html), 5):
+        parser.feed(html[start : start + 5])
+    assert parser.get_title() == extract_title(parse_html(html))
+
+
+def test_title_parser_stops_after_head():
+    parser = TitleParser()
+    parser.feed('<html><head><meta property="og:title" content="OG">')
+    assert not parser.done
+    parser.feed("</head>")
+    assert parser.done
+    assert parser.get_title() == "OG"
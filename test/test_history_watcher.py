@@ -0,0 +1,89 @@
+import platform
+import threading
+import time
+
+import pytest
+
+from src.utils.history_watcher import (
+    InotifyWatcher,
+    PollingWatcher,
+    acquire_daemon_lock,
+    get_watched_paths,
+    watch_history,
+)
+
+
+@pytest.fixture
+def history_db(tmp_path):
+    db_path = tmp_path / "places.sqlite"
+    db_path.write_bytes(b"v1")
+    return db_path
+
+
+def test_get_watched_paths(history_db):
+    assert [path.name for path in get_watched_paths([str(history_db)])] == [
+        "places.sqlite",
+        "places.sqlite-wal",
+        "places.sqlite-journal",
+    ]
+
+
+def test_polling_watcher(history_db):
+    with PollingWatcher(get_watched_paths([history_db]), interval=0.01) as watcher:
+        assert not watcher.wait(0.05)
+        # A new WAL file counts as a change
+        (history_db.parent / "places.sqlite-wal").write_bytes(b"frame")
+        assert watcher.wait(1)
+        assert not watcher.wait(0.05)
+
+
+@pytest.mark.skipif(platform.system() != "Linux", reason="inotify is Linux-only")
+def test_inotify_watcher(history_db):
+    with InotifyWatcher(get_watched_paths([history_db])) as watcher:
+        assert not watcher.wait(0.05)
+        # Files that aren't watched are ignored
+        (history_db.parent / "other.sqlite").write_bytes(b"x")
+        assert not watcher.wait(0.05)
+        (history_db.parent / "places.sqlite-wal").write_bytes(b"frame")
+        assert watcher.wait(1)
+
+
+def test_watch_history_runs_on_changes_only(history_db):
+    runs = []
+    stop_event = threading.Event()
+    thread = threading.Thread(
+        target=watch_history,
+        args=(lambda: [str(history_db)], lambda: runs.append(time.monotonic())),
+        kwargs={
+            "debounce": 0.05,
+            "poll_interval": 0.01,
+            "rescan_interval": 0.05,
+            "stop_event": stop_event,
+        },
+    )
+    thread.start()
+    try:
+        # Initial run at start, then nothing until the database changes
+        time.sleep(0.3)
+        assert len(runs) == 1
+
+        # A burst of writes is processed once
+        for frame in range(3):
+            (history_db.parent / "places.sqlite-wal").write_bytes(b"x" * (frame + 1))
+            time.sleep(0.01)
+        time.sleep(0.5)
+        assert len(runs) == 2
+    finally:
+        stop_event.set()
+        thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+def test_acquire_daemon_lock(tmp_path):
+    lock_path = tmp_path / "daemon.lock"
+    lock = acquire_daemon_lock(lock_path)
+    assert lock is not None
+    if platform.system() != "Windows":
+        assert acquire_daemon_lock(lock_path) is None
+    lock.close()
+    assert acquire_daemon_lock(lock_path) is not None
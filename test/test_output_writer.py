@@ -0,0 +1,181 @@
+import hashlib
+import io
+import json
+
+import pytest
+
+from src.utils.output_writer import (
+    FORMAT_VERSION,
+    JsonListWriter,
+    get_output_path,
+    iter_json_list,
+    iter_output_counts,
+    open_output_writer,
+    read_output,
+    remove_stale_outputs,
+)
+
+
+def test_json_list_writer(tmp_path):
+    path = tmp_path / "browser_history_enc.json"
+    with JsonListWriter(path, "browser_history") as writer:
+        writer.write(["a", "b"])
+        writer.write(iter(["c"]))
+        writer.write([])
+
+    document = json.loads(path.read_text())
+    assert document["browser_history"] == ["a", "b", "c"]
+    assert "timestamp" in document
+
+
+def test_json_list_writer_keeps_previous_file_on_error(tmp_path):
+    path = tmp_path / "paper_stats.json"
+    path.write_text('{"papers": ["arxiv.org/pdf/1"]}')
+
+    with pytest.raises(RuntimeError):
+        with JsonListWriter(path, "papers") as writer:
+            writer.write(["arxiv.org/pdf/2"])
+            raise RuntimeError("failed run")
+
+    assert json.loads(path.read_text()) == {"papers": ["arxiv.org/pdf/1"]}
+    assert list(tmp_path.iterdir()) == [path]
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+@pytest.mark.parametrize("output_format", ["json", "compact_json", "ndjson"])
+def test_output_formats_round_trip(tmp_path, output_format, compression):
+    path = get_output_path(tmp_path, "paper_stats", output_format, compression)
+    entries = ["arxiv.org/pdf/1", "arxiv.org/pdf/2", "arxiv.org/pdf/1"]
+    with open_output_writer(path, "papers", output_format, compression) as writer:
+        writer.write(entries)
+
+    document = read_output(path)
+    assert document["papers"] == entries
+    assert document["format"] == output_format
+    assert document["format_version"] == FORMAT_VERSION
+    assert "timestamp" in document
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+def test_binary_format_round_trip(tmp_path, compression):
+    digests = [hashlib.sha256(url.encode()).hexdigest() for url in ["a", "b"]]
+    entries = [digests[0], None, digests[1], digests[0]]
+    path = get_output_path(tmp_path, "browser_history_enc", "binary", compression)
+    with open_output_writer(
+        path, "browser_history", "binary", compression, value_type="digest"
+    ) as writer:
+        writer.write(entries)
+
+    document = read_output(path)
+    assert sorted(document["browser_history"], key=str) == sorted(entries, key=str)
+    assert document["format"] == "binary"
+
+
+def test_read_output_legacy_file(tmp_path):
+    path = tmp_path / "paper_stats.json"
+    path.write_text('{"papers": ["arxiv.org/pdf/1"], "timestamp": "2024-01-01"}')
+
+    document = read_output(path)
+    assert document["papers"] == ["arxiv.org/pdf/1"]
+    assert document["format"] == "json"
+    assert document["format_version"] == 0
+
+
+def test_remove_stale_outputs(tmp_path):
+    current = get_output_path(tmp_path, "paper_stats", "ndjson", "gzip")
+    stale = get_output_path(tmp_path, "paper_stats", "json")
+    current.touch()
+    stale.touch()
+
+    remove_stale_outputs(tmp_path, "paper_stats", current)
+    assert list(tmp_path.iterdir()) == [current]
+
+
+@pytest.mark.parametrize("output_format", ["json", "ndjson", "binary", "json_counts"])
+def test_write_counts(tmp_path, output_format):
+    path = get_output_path(tmp_path, "paper_stats", output_format)
+    with open_output_writer(path, "papers", output_format) as writer:
+        writer.write_counts([("arxiv.org/pdf/1", 2), ("arxiv.org/pdf/2", 1)])
+        writer.write(["arxiv.org/pdf/1"])
+
+    assert sorted(read_output(path)["papers"]) == [
+        "arxiv.org/pdf/1",
+        "arxiv.org/pdf/1",
+        "arxiv.org/pdf/1",
+        "arxiv.org/pdf/2",
+    ]
+
+
+@pytest.mark.parametrize(
+    "output_format, counts",
+    [
+        ("json", [("a", 1), ("a", 1), ("b", 1)]),
+        ("ndjson", [("a", 1), ("a", 1), ("b", 1)]),
+        ("binary", [("a", 2), ("b", 1)]),
+        ("json_counts", [("a", 2), ("b", 1)]),
+    ],
+)
+def test_read_output_counts(tmp_path, output_format, counts):
+    path = get_output_path(tmp_path, "paper_stats", output_format)
+    with open_output_writer(path, "papers", output_format) as writer:
+        writer.write_counts([("a", 2), ("b", 1)])
+
+    assert read_output(path, counts=True)["papers"] == counts
+
+
+def test_json_counts_writer(tmp_path):
+    path = get_output_path(tmp_path, "browser_history_enc", "json_counts")
+    with open_output_writer(path, "browser_history", "json_counts") as writer:
+        writer.write_counts([("aa", 2), (None, 1)])
+        writer.write_counts([("aa", 1)])
+
+    document = json.loads(path.read_text())
+    assert document["browser_history"] == {"aa": 3, "null": 1}
+    assert document["format"] == "json_counts"
+    assert sorted(read_output(path)["browser_history"], key=str) == [
+        None,
+        "aa",
+        "aa",
+        "aa",
+    ]
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip"])
+@pytest.mark.parametrize(
+    "output_format, counts",
+    [
+        ("json", [("a", 1), ("a", 1), ("b", 1)]),
+        ("compact_json", [("a", 1), ("a", 1), ("b", 1)]),
+        ("ndjson", [("a", 1), ("a", 1), ("b", 1)]),
+        ("binary", [("a", 2), ("b", 1)]),
+        ("json_counts", [("a", 2), ("b", 1)]),
+    ],
+)
+def test_iter_output_counts(tmp_path, output_format, compression, counts):
+    path = get_output_path(tmp_path, "paper_stats", output_format, compression)
+    with open_output_writer(path, "papers", output_format, compression) as writer:
+        writer.write_counts([("a", 2), ("b", 1)])
+
+    assert list(iter_output_counts(path, "papers")) == counts
+
+
+def test_iter_output_counts_legacy_file(tmp_path):
+    path = tmp_path / "paper_stats.json"
+    path.write_text('{"timestamp": "2024-01-01", "papers": ["arxiv.org/pdf/1"]}')
+
+    assert list(iter_output_counts(path, "papers")) == [("arxiv.org/pdf/1", 1)]
+
+
+def test_iter_json_list_reads_in_chunks():
+    class ChunkReader(io.StringIO):
+        def read(self, size=-1):
+            assert 0 < size <= 4
+            return super().read(size)
+
+    entries = ["a" * 10, None, {"b": [1, 2]}, "]"]
+    document = json.dumps({"format": "json", "papers": entries, "timestamp": "t"})
+    reader = ChunkReader(document)
+
+    assert list(iter_json_list(reader, "papers", 4)) == entries
+    # The list is read up to its end only
+    assert reader.tell() < len(document)
@@ -0,0 +1,101 @@
+import pytest
+
+from main import process_history
+from src.browser_history import Visit
+from src.paper_detection import count_papers, get_paper_id
+
+
+@pytest.mark.parametrize(
+    "netloc, path, query, paper_id",
+    [
+        ("arxiv.org", "/abs/2101.00001", "", "arxiv:2101.00001"),
+        ("arxiv.org", "/pdf/2101.00001v2", "", "arxiv:2101.00001"),
+        ("www.arxiv.org", "/pdf/2101.00001v1.pdf", "", "arxiv:2101.00001"),
+        ("arxiv.org", "/abs/hep-th/9901001v3", "", "arxiv:hep-th/9901001"),
+        ("arxiv.org", "/list/cs.LG/recent", "", None),
+        ("doi.org", "/10.1145/3368089.3409740", "", "doi:10.1145/3368089.3409740"),
+        (
+            "dl.acm.org",
+            "/doi/pdf/10.1145/3368089.3409740",
+            "",
+            "doi:10.1145/3368089.3409740",
+        ),
+        ("dl.acm.org", "/profile/81100000000", "", None),
+        (
+            "link.springer.com",
+            "/chapter/10.1007/978-3-030-58452-8_13",
+            "",
+            "doi:10.1007/978-3-030-58452-8_13",
+        ),
+        ("ieeexplore.ieee.org", "/document/9157512/", "", "ieee:9157512"),
+        ("ieeexplore.ieee.org", "/stamp/stamp.jsp", "arnumber=9157512", "ieee:9157512"),
+        ("openreview.net", "/forum", "id=YicbFdNTTy", "openreview:YicbFdNTTy"),
+        ("openreview.net", "/pdf", "id=YicbFdNTTy", "openreview:YicbFdNTTy"),
+        ("openreview.net", "/group", "", None),
+        (
+            "www.researchgate.net",
+            "/publication/123456_A_Paper_Title",
+            "",
+            "researchgate:123456",
+        ),
+        ("aclanthology.org", "/2020.acl-main.1.pdf", "", "acl:2020.acl-main.1"),
+        ("aclanthology.org", "/P19-1001/", "", "acl:p19-1001"),
+        (
+            "proceedings.neurips.cc",
+            "/paper/2020/hash/1457c0d6bfcb4967418bfb8ac142f64a-Abstract.html",
+            "",
+            "neurips:1457c0d6bfcb4967418bfb8ac142f64a",
+        ),
+        (
+            "proceedings.mlr.press",
+            "/v139/radford21a.html",
+            "",
+            "pmlr:v139/radford21a",
+        ),
+        (
+            "proceedings.mlr.press",
+            "/v139/radford21a/radford21a.pdf",
+            "",
+            "pmlr:v139/radford21a",
+        ),
+        ("iclr.cc", "/virtual/2023/poster/11011", "", "iclr:2023/poster/11011"),
+        ("ijcai.org", "/proceedings/2021/123", "", "ijcai:2021/123"),
+        ("dblp.org", "/pid/123/456.html", "", None),
+        ("example.com", "/pdf/2101.00001", "", None),
+    ],
+)
+def test_get_paper_id(netloc, path, query, paper_id):
+    assert get_paper_id(netloc, path, query) == paper_id
+
+
+def test_count_papers_deduplicates_versions():
+    visits = [
+        Visit("https://arxiv.org/abs/2101.00001", 0, "firefox", visit_count=2),
+        Visit("https://arxiv.org/pdf/2101.00001v2", 0, "firefox"),
+        Visit("https://www.arxiv.org/pdf/2101.00001v1.pdf", 0, "firefox"),
+        Visit("https://openreview.net/forum?id=abc", 0, "firefox"),
+        Visit("https://example.com/abs/2101.00001", 0, "firefox"),
+    ]
+    ((_, papers),) = process_history([visits])
+    assert count_papers(papers) == {"arxiv:2101.00001": 4, "openreview:abc": 1}
+
+
+def test_papers_on_general_hosts_are_counted():
+    visits = [
+        Visit("https://doi.org/10.1145/3368089.3409740", 0, "firefox"),
+        Visit("https://ieeexplore.ieee.org/stamp/stamp.jsp?arnumber=1", 0, "firefox"),
+        Visit("https://link.springer.com/article/10.1007/abc", 0, "firefox"),
+        Visit("https://proceedings.mlr.press/v139/radford21a.html", 0, "firefox"),
+        Visit("https://doi.org/", 0, "firefox"),
+    ]
+    ((published, papers),) = process_history([visits])
+    assert count_papers(papers) == {
+        "doi:10.1145/3368089.3409740": 1,
+        "ieee:1": 1,
+        "doi:10.1007/abc": 1,
+        "pmlr:v139/radford21a": 1,
+    }
+    # Paper hosts classified as general are counted, but their visits are not
+    # published in the history outputs
+    assert published == []
+    assert all("query" not in urlstr for urlstr in papers)
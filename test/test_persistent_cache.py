@@ -0,0 +1,28 @@
+from src.utils.persistent_cache import PersistentLRUCache
+
+
+def test_lru_eviction(tmp_path):
+    cache = PersistentLRUCache(tmp_path / "cache.json", max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert "a" in cache and "c" in cache
+
+
+def test_persistence_and_version_invalidation(tmp_path):
+    path = tmp_path / "cache.json"
+    cache = PersistentLRUCache(path, max_size=10, version="rules-1")
+    calls = []
+    assert cache.get_or_compute("https://mit.edu", calls.append) is None
+    cache.put("https://ox.ac.uk", "academic")
+    cache.save()
+
+    reloaded = PersistentLRUCache(path, max_size=10, version="rules-1")
+    assert reloaded.get("https://ox.ac.uk") == "academic"
+    assert reloaded.get_or_compute("https://mit.edu", calls.append) is None
+    assert calls == ["https://mit.edu"]
+
+    assert len(PersistentLRUCache(path, max_size=10, version="rules-2")) == 0
+    assert len(PersistentLRUCache(path, max_size=1, version="rules-1")) == 1
@@ -0,0 +1,256 @@
+import sqlite3
+from contextlib import closing
+
+import pytest
+
+import main
+from src import browser_history
+from src.utils import run_state
+from src.utils.delta_publisher import load_manifest, read_published
+from src.utils.output_writer import get_output_path, read_output
+from src.utils.persistent_cache import PersistentLRUCache
+from test.test_browser_history import add_visits, create_places_db
+
+
+@pytest.fixture
+def publish(tmp_path, firefox_home, monkeypatch):
+    """
+    Runs `publish_history` on a Firefox profile, into a temporary public folder,
+    and returns the published clear history.
+    """
+    public_folder = tmp_path / "public"
+    public_folder.mkdir()
+    monkeypatch.setattr(
+        run_state, "get_run_state_path", lambda: tmp_path / "run_state.json"
+    )
+    for setting, value in {
+        "ALLOW_TOP": True,
+        "CONCURRENT_FETCH": False,
+        "AGGREGATE_VISITS": False,
+        "WINDOW_DAYS": 0,
+        "OUTPUT_FORMAT": "json",
+        "OUTPUT_COMPRESSION": "none",
+        "PUBLISH_MODE": "full",
+        "HASH_COUNTS": False,
+        "FETCH_TITLES": False,
+    }.items():
+        monkeypatch.setattr(main, setting, value)
+
+    def run(visits=(), publish_mode="full", full_rescan=False):
+        places_db = firefox_home / "places.sqlite"
+        if not places_db.exists():
+            create_places_db(places_db, [])
+        conn = sqlite3.connect(places_db)
+        add_visits(conn, visits)
+        conn.close()
+
+        monkeypatch.setattr(main, "PUBLISH_MODE", publish_mode)
+        main.publish_history(
+            public_folder,
+            PersistentLRUCache(tmp_path / "classification_cache.json", 100),
+            PersistentLRUCache(tmp_path / "hash_cache.json", 100),
+            PersistentLRUCache(tmp_path / "title_cache.json", 100),
+            full_rescan=full_rescan,
+        )
+        return read(publish_mode)
+
+    def read(publish_mode="full"):
+        name = "browser_history_clear"
+        if publish_mode == "delta":
+            return read_published(public_folder, name, "browser_history")
+        path = get_output_path(public_folder, name, "json", "none")
+        return read_output(path)["browser_history"]
+
+    run.folder = public_folder
+    run.read = read
+    return run
+
+
+def test_resume_appends_new_visits(publish):
+    assert publish([("https://a.mit.edu/", 1)]) == ["a.mit.edu"]
+    assert publish([("https://b.mit.edu/", 2)]) == ["a.mit.edu", "b.mit.edu"]
+    assert run_state.load_run_state()["cursors"] == {"firefox:abc.default": 2}
+
+    # A full rescan replaces the outputs instead of appending to them
+    assert publish(full_rescan=True) == ["a.mit.edu", "b.mit.edu"]
+
+
+def test_unchanged_sources_are_skipped(publish, firefox_home, monkeypatch):
+    other_profile = firefox_home.parent / "xyz.work"
+    other_profile.mkdir()
+    create_places_db(other_profile / "places.sqlite", [("https://x.mit.edu/", 1)])
+    read = []
+    iter_combined_history = main.iter_combined_history
+
+    def spy(*args, only=None, **kwargs):
+        read.append(set(only))
+        return iter_combined_history(*args, only=only, **kwargs)
+
+    monkeypatch.setattr(main, "iter_combined_history", spy)
+    assert sorted(publish([("https://a.mit.edu/", 2)])) == ["a.mit.edu", "x.mit.edu"]
+    assert sorted(publish([("https://b.mit.edu/", 3)])) == [
+        "a.mit.edu",
+        "b.mit.edu",
+        "x.mit.edu",
+    ]
+    # Nothing changed: no source is read and the outputs are left as they are
+    assert len(publish()) == 3
+    assert read == [
+        {"firefox:abc.default", "firefox:xyz.work"},
+        {"firefox:abc.default"},
+    ]
+
+
+@pytest.mark.parametrize("concurrent", [False, True])
+@pytest.mark.parametrize("rows_before_failure", [0, 1])
+def test_failed_source_is_read_again(
+    publish, monkeypatch, concurrent, rows_before_failure
+):
+    assert publish([("https://a.mit.edu/", 1)]) == ["a.mit.edu"]
+    iter_query_batches = browser_history.iter_query_batches
+
+    def failing_query_batches(*args, **kwargs):
+        with closing(iter_query_batches(*args, **kwargs)) as batches:
+            rows = next(batches)
+            if rows_before_failure:
+                yield rows[:rows_before_failure]
+        raise sqlite3.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(main, "CONCURRENT_FETCH", concurrent)
+    monkeypatch.setattr(browser_history, "iter_query_batches", failing_query_batches)
+    with pytest.raises(sqlite3.OperationalError):
+        publish([("https://b.mit.edu/", 2), ("https://c.mit.edu/", 3)])
+    # Nothing was published or saved
+    assert publish.read() == ["a.mit.edu"]
+    assert run_state.load_run_state()["cursors"] == {"firefox:abc.default": 1}
+
+    # The database is unchanged since, but its fingerprint wasn't saved
+    monkeypatch.setattr(browser_history, "iter_query_batches", iter_query_batches)
+    assert publish() == ["a.mit.edu", "b.mit.edu", "c.mit.edu"]
+
+
+def test_delta_snapshot_then_segments(publish):
+    def get_manifest():
+        return load_manifest(publish.folder, "browser_history_clear")
+
+    # Without a snapshot yet, the first run publishes one
+    assert publish([("https://a.mit.edu/", 1)], "delta") == ["a.mit.edu"]
+    assert get_manifest()["base"]["sequence"] == 1
+    assert get_manifest()["segments"] == []
+
+    # Later runs only publish their new visits in a segment
+    assert publish([("https://b.mit.edu/", 2)], "delta") == ["a.mit.edu", "b.mit.edu"]
+    assert [segment["entries"] for segment in get_manifest()["segments"]] == [1]
+
+    # A full rescan publishes a new snapshot
+    assert publish(publish_mode="delta", full_rescan=True) == [
+        "a.mit.edu",
+        "b.mit.edu",
+    ]
+    assert get_manifest()["base"]["sequence"] == 3
+    assert get_manifest()["segments"] == []
+
+
+def test_switch_from_delta_to_full(publish):
+    assert publish([("https://a.mit.edu/", 1)], "delta") == ["a.mit.edu"]
+    assert publish([("https://b.mit.edu/", 2), ("https://c.mit.edu/", 3)], "delta") == [
+        "a.mit.edu",
+        "b.mit.edu",
+        "c.mit.edu",
+    ]
+
+    # The full file carries over everything published in delta mode
+    assert publish([("https://d.mit.edu/", 4)]) == [
+        "a.mit.edu",
+        "b.mit.edu",
+        "c.mit.edu",
+        "d.mit.edu",
+    ]
+    assert not list(publish.folder.glob("browser_history_clear.*-*"))
+
+
+def test_hashed_history_is_aligned(publish):
+    publish([("https://a.mit.edu/", 1), ("https://b.mit.edu/", 2)])
+    clear = publish(
+        [
+            ("https://a.mit.edu/x", 3),
+            ("https://c.mit.edu/", 4),
+            ("https://a.mit.edu/y", 5),
+        ]
+    )
+    assert clear == ["a.mit.edu", "b.mit.edu", "a.mit.edu", "c.mit.edu", "a.mit.edu"]
+
+    path = get_output_path(publish.folder, "browser_history_enc", "json", "none")
+    enc = read_output(path)["browser_history"]
+    assert enc == [main.hash_url(domain) for domain in clear]
+
+
+class FakeTitleFetcher:
+    def __init__(self, cache, **kwargs):
+        self.cache = cache
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    fetched = []
+
+    def fetch_titles(self, urls):
+        urls = list(urls)
+        FakeTitleFetcher.fetched.extend(urls)
+        return {url: url.upper() for url in urls}
+
+
+def test_titles_stay_local(publish, monkeypatch):
+    monkeypatch.setattr(main, "FETCH_TITLES", True)
+    monkeypatch.setattr(main, "TitleFetcher", FakeTitleFetcher)
+    monkeypatch.setattr(FakeTitleFetcher, "fetched", [])
+    stale = get_output_path(publish.folder, "page_titles", "json", "none")
+    stale.write_text('{"titles": ["HTTPS://A.MIT.EDU/X"]}')
+
+    assert publish([("https://a.mit.edu/x", 1)]) == ["a.mit.edu"]
+    assert FakeTitleFetcher.fetched == ["https://a.mit.edu/x"]
+    assert not any("A.MIT.EDU" in path.read_text() for path in publish.folder.iterdir())
+    assert not stale.exists()
+
+
+def test_papers_on_general_hosts_are_not_published(publish):
+    clear = publish(
+        [
+            ("https://doi.org/10.1145/3368089.3409740", 1),
+            ("https://arxiv.org/abs/2101.00001", 2),
+        ]
+    )
+    assert clear == ["arxiv.org"]
+
+    path = get_output_path(publish.folder, "paper_stats", "json", "none")
+    assert sorted(read_output(path)["papers"]) == [
+        "arxiv:2101.00001",
+        "doi:10.1145/3368089.3409740",
+    ]
+
+
+def test_load_previous_falls_back_to_a_readable_file(tmp_path):
+    get_output_path(tmp_path, "paper_stats", "json", "none").write_text("{}")
+    ndjson = get_output_path(tmp_path, "paper_stats", "ndjson", "none")
+    ndjson.write_text('{"format":"ndjson"}\n"a"\n"b"\n')
+
+    assert list(main.load_previous(tmp_path, "paper_stats", "papers")) == [
+        ("a", 1),
+        ("b", 1),
+    ]
+
+
+def test_load_previous_stops_on_a_truncated_file(tmp_path):
+    path = get_output_path(tmp_path, "paper_stats", "json", "none")
+    path.write_text('{"papers": ["a", "b"')
+    ndjson = get_output_path(tmp_path, "paper_stats", "ndjson", "none")
+    ndjson.write_text('{"format":"ndjson"}\n"c"\n')
+
+    # The entries already carried over are not published twice
+    assert list(main.load_previous(tmp_path, "paper_stats", "papers")) == [
+        ("a", 1),
+        ("b", 1),
+    ]
@@ -0,0 +1,87 @@
+import json
+import pstats
+import threading
+
+import pytest
+
+from src.utils.run_metrics import RunMetrics, get_max_rss_kb, profile
+
+
+def test_stage():
+    metrics = RunMetrics()
+    with metrics.stage("classify_url", rows=3):
+        sum(range(10000))
+    with metrics.stage("classify_url") as stage:
+        stage["rows"] += 2
+
+    entry = metrics.to_dict()["stages"]["classify_url"]
+    assert entry["calls"] == 2
+    assert entry["rows"] == 5
+    assert entry["wall_time"] > 0
+    assert entry["cpu_time"] >= 0
+    assert entry["peak_traced_bytes"] is None
+
+
+def test_timed_batches():
+    metrics = RunMetrics()
+    batches = metrics.timed_batches("chrome", iter([[1, 2], [3]]))
+    assert list(batches) == [[1, 2], [3]]
+
+    entry = metrics.to_dict()["sources"]["chrome"]
+    assert entry["calls"] == 1
+    assert entry["rows"] == 3
+
+
+def test_stages_from_threads():
+    metrics = RunMetrics()
+
+    def work():
+        for _ in range(100):
+            with metrics.stage("query", rows=1):
+                pass
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert metrics.to_dict()["stages"]["query"]["rows"] == 400
+
+
+def test_save_and_reset(tmp_path):
+    metrics = RunMetrics()
+    with metrics.stage("save"):
+        pass
+    path = tmp_path / "run_metrics.json"
+    metrics.save(path)
+    assert "save" in json.loads(path.read_text())["stages"]
+
+    metrics.reset()
+    assert metrics.to_dict()["stages"] == {}
+
+
+def test_profile(tmp_path):
+    metrics = RunMetrics()
+    profile_path = tmp_path / "run_profile.prof"
+    with profile(profile_path, metrics):
+        with metrics.stage("split_url"):
+            data = [str(i) for i in range(10000)]
+
+    assert pstats.Stats(str(profile_path)).total_calls > 0
+    assert metrics.to_dict()["top_allocations"]
+    assert metrics.to_dict()["stages"]["split_url"]["peak_traced_bytes"] > 0
+    assert len(data) == 10000
+
+
+@pytest.mark.skipif(get_max_rss_kb() is None, reason="getrusage is unavailable")
+def test_peak_rss_growth():
+    metrics = RunMetrics()
+    with metrics.stage("split_url"):
+        # Beyond the peak reached so far by the test process
+        data = bytearray((get_max_rss_kb() + 32 * 1024) * 1024)
+    del data
+    with metrics.stage("split_url"):
+        pass
+
+    # The largest growth over the calls is kept
+    assert metrics.to_dict()["stages"]["split_url"]["peak_rss_growth_kb"] > 16 * 1024
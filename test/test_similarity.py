@@ -0,0 +1,122 @@
+import json
+
+import numpy as np
+import pytest
+
+from src import similarity
+from src.similarity import (
+    MinHashLSHIndex,
+    compare_browser_histories,
+    compare_browser_histories_tiled,
+    compare_urls,
+    encode_urls,
+    find_similar_entries,
+    iter_json_list,
+    similarity_matrix,
+)
+
+
+def make_url(domain, path, classification="academic"):
+    return {
+        "scheme": "https",
+        "subdomain": "www",
+        "domain": domain,
+        "tld": "edu",
+        "netloc": f"www.{domain}.edu",
+        "path": path,
+        "query": "",
+        "fragment": "",
+        "classification": classification,
+    }
+
+
+HISTORY1 = [make_url("mit", "/courses/6.006"), make_url("stanford", "/cs229")]
+HISTORY2 = [
+    make_url("mit", "/courses/6.006"),
+    make_url("mit", "/courses/6.046"),
+    make_url("berkeley", "/about", "tutorial"),
+]
+
+
+@pytest.fixture
+def history_files(tmp_path):
+    paths = []
+    for name, history in [("h1.json", HISTORY1), ("h2.json", HISTORY2)]:
+        path = tmp_path / name
+        path.write_text(json.dumps({"browser_history": history}))
+        paths.append(path)
+    return paths
+
+
+def test_similarity_matrix_scores():
+    matrix = similarity_matrix(encode_urls(HISTORY1), encode_urls(HISTORY2), 1)
+    assert matrix.shape == (2, 3)
+    assert matrix.dtype == np.float32
+    assert matrix[0, 0] == pytest.approx(1.0)
+    # Closer URLs score higher
+    assert matrix[0, 1] > matrix[0, 2]
+    assert ((matrix >= 0) & (matrix <= 1)).all()
+
+
+def test_similarity_matrix_empty_components():
+    empty = {key: "" for key in make_url("mit", "/")}
+    assert similarity_matrix(encode_urls([empty]), encode_urls([{}]))[0, 0] == 1
+
+
+def test_compare_browser_histories_compat(history_files):
+    matrix = compare_browser_histories(*history_files, mode="compat")
+    assert matrix == [[compare_urls(u1, u2) for u2 in HISTORY2] for u1 in HISTORY1]
+
+
+def test_compare_browser_histories_vectorized(history_files):
+    matrix = compare_browser_histories(*history_files)
+    compat = np.array(compare_browser_histories(*history_files, mode="compat"))
+    assert matrix.shape == compat.shape
+    assert np.abs(matrix - compat).max() < 0.2
+
+
+def test_minhash_lsh_index_query():
+    index = MinHashLSHIndex(bands=32, rows=2)
+    index.add(HISTORY2)
+    matches = index.query(HISTORY1[0], k=2)
+    assert matches[0] == (0, pytest.approx(1.0))
+    assert len(matches) <= 2
+    assert [score for _, score in matches] == sorted(
+        (score for _, score in matches), reverse=True
+    )
+
+
+def test_minhash_lsh_index_query_without_query_components():
+    # As published by `split_url`, without "query" and "fragment"
+    history = [
+        {key: value for key, value in url.items() if key not in {"query", "fragment"}}
+        for url in HISTORY2
+    ]
+    assert compare_urls(history[0], history[0]) == 1.0
+    index = MinHashLSHIndex(bands=32, rows=2)
+    index.add(history)
+    assert index.query(history[0], k=1) == [(0, pytest.approx(1.0))]
+
+
+def test_find_similar_entries(history_files):
+    matches = find_similar_entries(*reversed(history_files), k=1)
+    assert len(matches) == len(HISTORY1)
+    assert matches[0] == [(0, pytest.approx(1.0))]
+
+
+def test_iter_json_list_streams_entries(tmp_path, monkeypatch):
+    path = tmp_path / "history.json"
+    path.write_text(json.dumps({"browser_history": HISTORY2, "timestamp": "now"}))
+    # Entries cut across reads are completed by the next read
+    monkeypatch.setattr(similarity, "READ_SIZE", 5)
+    assert list(iter_json_list(path)) == HISTORY2
+
+
+def test_compare_browser_histories_tiled(history_files, tmp_path):
+    matrix = compare_browser_histories_tiled(
+        *history_files, tmp_path / "scores.npy", tile_size=2, max_workers=2
+    )
+    expected = compare_browser_histories(*history_files)
+    assert matrix.shape == expected.shape
+    assert np.allclose(matrix, expected)
+    assert np.allclose(np.load(tmp_path / "scores.npy"), expected)
@@ -0,0 +1,38 @@
+import sqlite3
+
+from src.utils.sqlite_snapshot import open_snapshot
+
+
+def create_wal_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA wal_autocheckpoint=0")
+    conn.execute("CREATE TABLE urls (url TEXT)")
+    conn.execute("INSERT INTO urls VALUES ('https://mit.edu')")
+    conn.commit()
+    return conn
+
+
+def test_open_snapshot_reads_wal(tmp_path):
+    db_path = tmp_path / "History"
+    writer = create_wal_db(db_path)
+    try:
+        with open_snapshot(db_path) as conn:
+            rows = conn.execute("SELECT url FROM urls").fetchall()
+    finally:
+        writer.close()
+    assert rows == [("https://mit.edu",)]
+
+
+def test_open_snapshot_falls_back_to_copy_when_locked(tmp_path):
+    db_path = tmp_path / "History"
+    writer = create_wal_db(db_path)
+    writer.execute("PRAGMA locking_mode=EXCLUSIVE")
+    writer.execute("INSERT INTO urls VALUES ('https://ox.ac.uk')")
+    writer.commit()
+    try:
+        with open_snapshot(db_path) as conn:
+            rows = conn.execute("SELECT url FROM urls ORDER BY url").fetchall()
+    finally:
+        writer.close()
+    assert rows == [("https://mit.edu",), ("https://ox.ac.uk",)]
@@ -0,0 +1,85 @@
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+from benchmarks.run_benchmarks import (
+    compare_with_baselines,
+    run_benchmarks,
+    use_history_paths,
+)
+from benchmarks.synthetic_history import (
+    create_synthetic_history,
+    iter_synthetic_visits,
+    parse_size,
+)
+from src.browser_history import (
+    fetch_brave_history,
+    fetch_chrome_history,
+    fetch_firefox_history,
+    fetch_safari_history,
+)
+
+
+def test_iter_synthetic_visits():
+    history = list(iter_synthetic_visits(100, 250, num_domains=10, end_time=1e9))
+    assert [url_id for url_id, _, _ in history] == list(range(1, 101))
+    assert len({url for _, url, _ in history}) == 100
+    assert sum(len(times) for _, _, times in history) == 250
+    assert all(1e9 - 90 * 24 * 3600 <= t <= 1e9 for _, _, ts in history for t in ts)
+    # Deterministic for a given seed
+    assert history == list(
+        iter_synthetic_visits(100, 250, num_domains=10, end_time=1e9)
+    )
+
+
+def test_domain_skew():
+    def top_share(skew):
+        hosts = Counter(
+            urlparse(url).netloc
+            for _, url, _ in iter_synthetic_visits(2000, 2000, 100, skew, end_time=0)
+        )
+        return hosts.most_common(1)[0][1] / 2000
+
+    assert top_share(0) < 0.05
+    assert top_share(2) > 0.4
+
+
+def test_synthetic_databases_are_readable(tmp_path):
+    end_time = time.time()
+    paths = create_synthetic_history(tmp_path, 50, 120, end_time=end_time)
+    oldest = datetime(1970, 1, 1) + timedelta(seconds=end_time - 91 * 24 * 3600)
+    newest = datetime(1970, 1, 1) + timedelta(seconds=end_time + 1)
+    with use_history_paths(paths):
+        for fetch in [
+            fetch_safari_history,
+            fetch_chrome_history,
+            fetch_firefox_history,
+            fetch_brave_history,
+        ]:
+            visits = fetch()
+            assert len(visits) == 120
+            assert all(oldest <= visit["visit_time"] <= newest for visit in visits)
+
+
+def test_run_benchmarks(tmp_path):
+    results = run_benchmarks(tmp_path, 200, browsers=["chrome"])
+    assert results["fetch_chrome"]["rows"] == 400
+    assert {"classify_url", "split_url", "hash_url", "save"} <= results.keys()
+    assert all(result["wall_time"] >= 0 for result in results.values())
+
+
+def test_compare_with_baselines():
+    baselines = {"fast": {"wall_time": 1.0}, "slow": {"wall_time": 1.0}}
+    results = {
+        "fast": {"wall_time": 1.1},
+        "slow": {"wall_time": 2.0},
+        "new": {"wall_time": 1.0},
+    }
+    assert compare_with_baselines(results, baselines) == ["slow"]
+
+
+def test_parse_size():
+    assert parse_size("10k") == 10_000
+    assert parse_size("1M") == 1_000_000
+    assert parse_size("2500") == 2500
@@ -0,0 +1,127 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.educational_content_classifier import create_headers, fetch_title
+from src.title_fetcher import TitleFetcher, interleave_hosts
+from src.utils.persistent_cache import PersistentLRUCache
+
+PAGES = {
+    "/course": "<html><head><title> Intro to\n Physics </title></head></html>",
+    "/og": '<html><head><meta property="og:title" content="OG Title"></head></html>',
+    "/untitled": "<html><body><p>No title</p></body></html>",
+    "/late": "<html><body>" + "<p>filler</p>" * 20000 + "<h1>Late</h1></body></html>",
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    requests = []
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.requests.append(self.path)
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        time.sleep(0.02)
+        with cls.lock:
+            cls.in_flight -= 1
+
+        page = PAGES.get(self.path.split("?")[0])
+        if page is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = page.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StubHandler.requests = []
+    StubHandler.in_flight = 0
+    StubHandler.max_in_flight = 0
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_fetch_titles(server):
+    urls = [
+        f"{server}/course",
+        f"{server}/og",
+        f"{server}/untitled",
+        f"{server}/missing",
+        f"{server}/course",
+    ]
+    with TitleFetcher(max_workers=4, timeout=5) as fetcher:
+        titles = fetcher.fetch_titles(urls)
+
+    assert titles == {
+        f"{server}/course": "Intro to Physics",
+        f"{server}/og": "OG Title",
+        f"{server}/untitled": None,
+        f"{server}/missing": None,
+    }
+    assert len(StubHandler.requests) == 4
+
+
+def test_fetch_titles_limits_requests_per_host(server):
+    urls = [f"{server}/course?page={page}" for page in range(12)]
+    with TitleFetcher(max_workers=8, max_per_host=2, timeout=5) as fetcher:
+        titles = fetcher.fetch_titles(urls)
+
+    assert set(titles.values()) == {"Intro to Physics"}
+    assert StubHandler.max_in_flight <= 2
+
+
+def test_fetch_titles_uses_cache_until_expired(server, tmp_path):
+    cache = PersistentLRUCache(tmp_path / "title_cache.json", max_size=10)
+    url = f"{server}/course"
+    with TitleFetcher(cache, timeout=5) as fetcher:
+        assert fetcher.fetch_titles([url]) == {url: "Intro to Physics"}
+        assert fetcher.fetch_titles([url]) == {url: "Intro to Physics"}
+    assert len(StubHandler.requests) == 1
+
+    cache.save()
+    cache = PersistentLRUCache(tmp_path / "title_cache.json", max_size=10)
+    with TitleFetcher(cache, timeout=5) as fetcher:
+        assert fetcher.fetch_titles([url]) == {url: "Intro to Physics"}
+    assert len(StubHandler.requests) == 1
+
+    with TitleFetcher(cache, timeout=5, ttl=0) as fetcher:
+        cache.put(url, ["Stale", time.time() - 1])
+        assert fetcher.fetch_titles([url]) == {url: "Intro to Physics"}
+    assert len(StubHandler.requests) == 2
+
+
+def test_interleave_hosts():
+    urls = ["http://a/1", "http://a/2", "http://a/3", "http://b/1", "http://c/1"]
+    assert interleave_hosts(urls) == [
+        "http://a/1",
+        "http://b/1",
+        "http://c/1",
+        "http://a/2",
+        "http://a/3",
+    ]
+
+
+def test_fetch_title_stops_at_byte_limit(server):
+    url = f"{server}/late"
+    assert fetch_title(url, create_headers(), timeout=5) is None
+    assert fetch_title(url, create_headers(), timeout=5, max_bytes=1 << 20) == "Late"